@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Saved-search alerts for newly scraped and repriced ads.
+Saved searches are compiled into an in-memory index: an inverted index
+from make and model to the searches that name them (or leave them open),
+and per bucket one interval tree each for the price, year and mileage
+ranges. Matching an ad looks up at most three buckets and stabs their
+trees with the values of the ad, so the cost depends on the number of
+matching searches, not on the number of saved searches. save_to_mongo()
+matches every inserted and repriced ad and writes the alerts in bulk.
+"""
+
+import os
+import json
+import math
+import random
+import time
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from pymongo import UpdateOne, ASCENDING
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Seconds a compiled index is used before saved searches are reloaded
+INDEX_TTL_SECONDS = float(os.getenv('ALERT_INDEX_TTL', 60))
+
+# Alert reasons
+NEW_AD = "new"
+PRICE_CHANGE = "price_change"
+
+# Criteria of a saved search; names follow the /api/search parameters
+KEY_CRITERIA = ["make", "model"]
+RANGE_CRITERIA = ["price", "year", "mileage"]
+TERM_CRITERIA = ["variant", "fuel_type", "transmission", "seller_type"]
+GEO_CRITERIA = ["lat", "lon", "radius_km"]
+
+ANY = "*"
+_INF = float("inf")
+
+# Collections whose setup has already been done by this process
+_prepared_collections = set()
+
+def get_saved_searches_collection(database: Database) -> Collection:
+    """
+    Get the saved search collection.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Saved search collection
+    """
+    collection = database[os.getenv('SAVED_SEARCHES_COLLECTION_NAME', 'saved_searches')]
+    if collection.full_name not in _prepared_collections:
+        collection.create_index([("user_id", ASCENDING), ("active", ASCENDING)])
+        _prepared_collections.add(collection.full_name)
+    return collection
+
+def get_alerts_collection(database: Database) -> Collection:
+    """
+    Get the alert collection.
+
+    An alert is unique per search, ad and price, so a repeated save of the
+    same ad does not alert twice.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Alert collection
+    """
+    collection = database[os.getenv('SEARCH_ALERTS_COLLECTION_NAME', 'search_alerts')]
+    if collection.full_name not in _prepared_collections:
+        collection.create_index([("search_id", ASCENDING), ("ad_id", ASCENDING), ("price", ASCENDING)], unique=True)
+        collection.create_index([("user_id", ASCENDING), ("notified", ASCENDING), ("created_at", ASCENDING)])
+        _prepared_collections.add(collection.full_name)
+    return collection
+
+def normalize_criteria(criteria: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate the criteria of a saved search.
+
+    Args:
+        criteria: make, model, variant, fuel_type, transmission and
+            seller_type (a value or a list), price/year/mileage _min and
+            _max, and lat, lon and radius_km
+
+    Returns:
+        Dict[str, Any]: Criteria with lowercase term lists and numeric bounds
+
+    Raises:
+        ValueError: If a criterion is unknown or has an invalid value
+    """
+    allowed = set(KEY_CRITERIA + TERM_CRITERIA + GEO_CRITERIA)
+    allowed.update(f"{name}_{bound}" for name in RANGE_CRITERIA for bound in ("min", "max"))
+    unknown = set(criteria) - allowed
+    if unknown:
+        raise ValueError(f"Unknown criteria: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    for name in KEY_CRITERIA + TERM_CRITERIA:
+        value = criteria.get(name)
+        if value in (None, "", []):
+            continue
+        values = value if isinstance(value, list) else str(value).split(",")
+        normalized[name] = sorted({str(v).strip().lower() for v in values if str(v).strip()})
+
+    for name in [f"{n}_{b}" for n in RANGE_CRITERIA for b in ("min", "max")] + GEO_CRITERIA:
+        if criteria.get(name) in (None, ""):
+            continue
+        try:
+            normalized[name] = float(criteria[name])
+        except (TypeError, ValueError):
+            raise ValueError(f"Criterion '{name}' must be a number")
+
+    for name in RANGE_CRITERIA:
+        if normalized.get(f"{name}_min", -_INF) > normalized.get(f"{name}_max", _INF):
+            raise ValueError(f"Criterion '{name}_min' is greater than '{name}_max'")
+
+    if any(name in normalized for name in GEO_CRITERIA) and not all(name in normalized for name in GEO_CRITERIA):
+        raise ValueError("Criteria 'lat', 'lon' and 'radius_km' must be given together")
+    return normalized
+
+def save_search(collection: Collection, user_id: str, criteria: Dict[str, Any], name: Optional[str] = None) -> str:
+    """
+    Store a saved search.
+
+    Args:
+        collection: Saved search collection
+        user_id: Owner of the search
+        criteria: Search criteria, see normalize_criteria()
+        name: Display name
+
+    Returns:
+        str: ID of the saved search
+    """
+    result = collection.insert_one({
+        "user_id": user_id,
+        "name": name,
+        "criteria": normalize_criteria(criteria),
+        "active": True,
+        "created_at": datetime.now(),
+    })
+    return str(result.inserted_id)
+
+class IntervalTree:
+    """
+    Static centered interval tree answering which intervals contain a point.
+    """
+
+    def __init__(self, intervals: List[Tuple[float, float, int]]):
+        """
+        Args:
+            intervals: Closed intervals as (low, high, item)
+        """
+        self.root = self._build(intervals)
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        endpoints = sorted(value for low, high, _ in intervals for value in (low, high) if not math.isinf(value))
+        center = endpoints[len(endpoints) // 2] if endpoints else 0.0
+
+        left, right, overlapping = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                overlapping.append(interval)
+
+        by_low = sorted(overlapping, key=lambda interval: interval[0])
+        by_high = sorted(overlapping, key=lambda interval: -interval[1])
+        return (
+            center,
+            [interval[0] for interval in by_low], [interval[2] for interval in by_low],
+            [-interval[1] for interval in by_high], [interval[2] for interval in by_high],
+            self._build(left), self._build(right),
+        )
+
+    def stab(self, point: float) -> List[int]:
+        """
+        Get the items of all intervals that contain a point.
+        """
+        items = []
+        node = self.root
+        while node is not None:
+            center, lows, low_items, negated_highs, high_items, left, right = node
+            if point < center:
+                # Intervals here end at or after center; those starting at or
+                # before the point contain it
+                items.extend(low_items[:bisect_right(lows, point)])
+                node = left
+            else:
+                items.extend(high_items[:bisect_right(negated_highs, -point)])
+                node = right if point > center else None
+        return items
+
+class _Bucket:
+    """
+    Searches that share a make/model key, with one tree per range.
+    """
+
+    def __init__(self, searches: List[Tuple[int, Dict[str, Any]]]):
+        self.ids = [position for position, _ in searches]
+        self.trees = {}
+        self.open = {}
+        for name in RANGE_CRITERIA:
+            intervals = []
+            unbounded = set()
+            for position, criteria in searches:
+                low = criteria.get(f"{name}_min", -_INF)
+                high = criteria.get(f"{name}_max", _INF)
+                if math.isinf(low) and math.isinf(high):
+                    unbounded.add(position)
+                if low <= high:
+                    intervals.append((low, high, position))
+            self.trees[name] = IntervalTree(intervals) if len(unbounded) < len(intervals) else None
+            self.open[name] = unbounded
+
+    def match(self, ad: Dict[str, Any]) -> Iterable[int]:
+        hits = []
+        for name in RANGE_CRITERIA:
+            if self.trees[name] is None:
+                continue
+            value = ad.get(name)
+            # An ad without the value only matches searches that leave the
+            # range open
+            hits.append(self.open[name] if value is None else self.trees[name].stab(float(value)))
+        if not hits:
+            return self.ids
+
+        # Intersect starting from the smallest hit list
+        hits.sort(key=len)
+        result = set(hits[0])
+        for other in hits[1:]:
+            if not result:
+                break
+            result.intersection_update(other)
+        return result
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+class AlertIndex:
+    """
+    Compiled saved searches.
+    """
+
+    def __init__(self, searches: List[Dict[str, Any]]):
+        """
+        Args:
+            searches: Saved search documents with _id, user_id and
+                normalized criteria
+        """
+        self.searches = searches
+        grouped: Dict[Tuple[str, str], List[Tuple[int, Dict[str, Any]]]] = {}
+        for position, search in enumerate(searches):
+            criteria = search.get("criteria") or {}
+            for make in criteria.get("make") or [ANY]:
+                for model in criteria.get("model") or [ANY]:
+                    grouped.setdefault((make, model), []).append((position, criteria))
+        self.buckets = {key: _Bucket(members) for key, members in grouped.items()}
+        # Searches with criteria that are checked per match
+        self.filtered = {position for position, search in enumerate(searches)
+                         if any(name in (search.get("criteria") or {}) for name in TERM_CRITERIA + GEO_CRITERIA)}
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.searches)
+
+    def match(self, ad: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Find the saved searches an ad matches.
+
+        Args:
+            ad: Car ad
+
+        Returns:
+            List[Dict[str, Any]]: Matching saved searches
+        """
+        make = str(ad.get("make") or "").lower()
+        model = str(ad.get("model") or "").lower()
+        keys = {(ANY, ANY), (make, ANY), (make, model), (ANY, model)}
+
+        matches = []
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            for position in bucket.match(ad):
+                if position in self.filtered and not self._matches_rest(self.searches[position]["criteria"], ad):
+                    continue
+                matches.append(self.searches[position])
+        return matches
+
+    @staticmethod
+    def _matches_rest(criteria: Dict[str, Any], ad: Dict[str, Any]) -> bool:
+        for name in TERM_CRITERIA:
+            if name in criteria and str(ad.get(name) or "").lower() not in criteria[name]:
+                return False
+        if "radius_km" in criteria:
+            point = ad.get("coordinates")
+            if not point:
+                return False
+            distance = _distance_km(criteria["lat"], criteria["lon"], point["lat"], point["lon"])
+            if distance > criteria["radius_km"]:
+                return False
+        return True
+
+def load_index(collection: Collection) -> AlertIndex:
+    """
+    Compile the active saved searches.
+
+    Args:
+        collection: Saved search collection
+
+    Returns:
+        AlertIndex: Compiled searches
+    """
+    started = time.perf_counter()
+    searches = list(collection.find({"active": True}, {"user_id": 1, "criteria": 1}))
+    index = AlertIndex(searches)
+    logger.info(f"Compiled {len(index)} saved searches in {time.perf_counter() - started:.2f}s")
+    return index
+
+_index: Optional[AlertIndex] = None
+_index_lock = threading.Lock()
+
+def get_alert_index(database: Database) -> AlertIndex:
+    """
+    Get the compiled saved searches, recompiling them every INDEX_TTL_SECONDS.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        AlertIndex: Compiled searches
+    """
+    global _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _index.built_at > INDEX_TTL_SECONDS:
+            _index = load_index(get_saved_searches_collection(database))
+        return _index
+
+def create_alerts(database: Database, new_ads: List[Dict[str, Any]], price_changed: List[Dict[str, Any]]) -> int:
+    """
+    Match new and repriced ads against all saved searches and store alerts.
+
+    Args:
+        database: MongoDB database
+        new_ads: Ads saved for the first time
+        price_changed: Known ads whose price changed
+
+    Returns:
+        int: Number of new alerts
+    """
+    index = get_alert_index(database)
+    if not len(index):
+        return 0
+
+    now = datetime.now()
+    operations = []
+    for reason, ads in ((NEW_AD, new_ads), (PRICE_CHANGE, price_changed)):
+        for ad in ads:
+            for search in index.match(ad):
+                key = {"search_id": search["_id"], "ad_id": ad["id"], "price": ad.get("price")}
+                operations.append(UpdateOne(key, {"$setOnInsert": {
+                    **key,
+                    "user_id": search.get("user_id"),
+                    "reason": reason,
+                    "url": ad["url"],
+                    "title": ad.get("title"),
+                    "created_at": now,
+                    "notified": False,
+                }}, upsert=True))
+
+    if not operations:
+        return 0
+    result = get_alerts_collection(database).bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+def benchmark(searches: int = 100000, ads: int = 10000) -> Dict[str, float]:
+    """
+    Time compiling and matching random saved searches.
+
+    Args:
+        searches: Number of saved searches
+        ads: Number of ads to match
+
+    Returns:
+        Dict[str, float]: Compile seconds, microseconds per ad and matches per ad
+    """
+    from taxonomy import TAXONOMY_PATH
+
+    with open(TAXONOMY_PATH, encoding="utf-8") as f:
+        catalogue = json.load(f)["makes"]
+    rng = random.Random(1)
+    makes = {make.lower(): [model.lower() for model in entry["models"]]
+             for make, entry in catalogue.items() if entry["models"]}
+
+    def random_search():
+        criteria = {}
+        make = rng.choice(list(makes))
+        # Most saved searches name a make and model
+        if rng.random() < 0.98:
+            criteria["make"] = [make]
+            if rng.random() < 0.8:
+                criteria["model"] = [rng.choice(makes[make])]
+        if rng.random() < 0.8:
+            criteria["price_max"] = float(rng.randrange(200000, 2000000, 50000))
+        if rng.random() < 0.3:
+            criteria["price_min"] = float(rng.randrange(100000, int(criteria.get("price_max", 600000)), 50000))
+        if rng.random() < 0.5:
+            criteria["year_min"] = float(rng.randrange(2000, 2024))
+        if rng.random() < 0.5:
+            criteria["mileage_max"] = float(rng.randrange(1000, 30000, 1000))
+        return {"_id": None, "user_id": "bench", "criteria": criteria}
+
+    started = time.perf_counter()
+    index = AlertIndex([random_search() for _ in range(searches)])
+    compile_seconds = time.perf_counter() - started
+
+    sample = []
+    for i in range(ads):
+        make = rng.choice(list(makes))
+        sample.append({"id": str(i), "make": make, "model": rng.choice(makes[make]),
+                       "price": rng.randrange(150000, 2500000), "year": rng.randrange(1995, 2025),
+                       "mileage": rng.randrange(0, 40000)})
+
+    started = time.perf_counter()
+    matched = sum(len(index.match(ad)) for ad in sample)
+    elapsed = time.perf_counter() - started
+    return {
+        "compile_seconds": round(compile_seconds, 2),
+        "microseconds_per_ad": round(elapsed / ads * 1e6, 1),
+        "matches_per_ad": round(matched / ads, 1),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Saved-search alerts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Save a search")
+    add_parser.add_argument("user_id")
+    add_parser.add_argument("criteria", help='JSON criteria, e.g. {"model": "911", "price_max": 900000}')
+    add_parser.add_argument("--name")
+    bench_parser = subparsers.add_parser("benchmark", help="Time matching against random saved searches")
+    bench_parser.add_argument("--searches", type=int, default=100000)
+    bench_parser.add_argument("--ads", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        print(f"Benchmark results: {benchmark(args.searches, args.ads)}")
+    else:
+        from mongodb import get_mongodb_connection
+
+        client, db, _ = get_mongodb_connection()
+        if client is None:
+            raise SystemExit("Failed to connect to MongoDB")
+        try:
+            search_id = save_search(get_saved_searches_collection(db), args.user_id, json.loads(args.criteria), args.name)
+            print(f"Saved search {search_id}")
+        finally:
+            client.close()
@@ -1,19 +1,108 @@
 import json
 import sys
 import os
-from http.server import BaseHTTPRequestHandler
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from datetime import datetime
 
 # Add parent directory to path to import scraper module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from scraper import scrape_blocket, save_to_mongo
+
+# Only the standard library is imported at module level, so a cold start
+# that serves a preflight, a status or an enqueue request never loads
+# Selenium. Each request path imports what it needs (see
+# import_benchmark.py).
+
+# Seconds a connection may stay idle while a request or response is
+# transferred, and seconds a shutdown waits for running scrapes
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('API_REQUEST_TIMEOUT', 30))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('API_SHUTDOWN_DRAIN_SECONDS', 600))
+
+STARTED_AT = datetime.now()
+
+def _flag(query, name):
+    return query.get(name, ['0'])[0].lower() in ('1', 'true', 'yes')
+
+class ScrapeBusyError(RuntimeError):
+    """
+    Raised when a scrape is requested while this process runs one.
+    """
+
+class RunningJobs:
+    """
+    Scrapes running in this process, so only one runs at a time and a
+    shutdown can wait for it.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.running = 0
+        self.draining = False
+    
+    def start(self):
+        with self._condition:
+            if self.draining:
+                raise ScrapeBusyError("Server is shutting down")
+            if self.running:
+                raise ScrapeBusyError("A scrape is already running")
+            self.running += 1
+    
+    def finish(self):
+        with self._condition:
+            self.running -= 1
+            self._condition.notify_all()
+    
+    def drain(self, timeout):
+        """
+        Refuse new scrapes and wait for the running ones.
+        
+        Returns:
+            bool: True if no scrape is running any more
+        """
+        with self._condition:
+            self.draining = True
+            return self._condition.wait_for(lambda: self.running == 0, timeout)
+
+jobs = RunningJobs()
 
 class Handler(BaseHTTPRequestHandler):
+    # Socket timeout for reading requests and writing responses, so a
+    # stalled client cannot hold a worker thread
+    timeout = REQUEST_TIMEOUT_SECONDS
+    
     def do_GET(self):
         """
-        Handle GET requests to /api/scrape
+        Handle GET requests to /api/scrape and /api/scrape/health
+        
+        The health path never imports the scraper or opens a connection.
+        
+        Query parameters:
+            resume: Set to 1 to continue the last unfinished run
+            enqueue: Set to 1 to queue a scrape job for the distributed
+                crawlers instead of scraping in this request
+            job: ID of an enqueued job to report on
+            status: Set to 1 to report the state of the latest run
+            profile: Set to 1 to profile the run; the stats get a
+                "profile" summary and the stack samples are written to
+                PROFILE_DIR
         """
         try:
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            
+            if url.path.rstrip('/').endswith('/health'):
+                response = self._health()
+            elif 'job' in query:
+                response = self._job_status(query['job'][0])
+            elif _flag(query, 'enqueue'):
+                response = self._enqueue(_flag(query, 'resume'))
+            elif _flag(query, 'status'):
+                response = self._run_status()
+            else:
+                response = self._scrape(_flag(query, 'resume'), _flag(query, 'profile'))
+            
             # Set CORS headers
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -22,30 +111,21 @@ class Handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.end_headers()
             
-            # Start time for performance tracking
-            start_time = datetime.now()
-            
-            # Run the scraper
-            car_ads = scrape_blocket()
-            
-            # Save to MongoDB
-            stats = save_to_mongo(car_ads)
-            
-            # Calculate execution time
-            execution_time = (datetime.now() - start_time).total_seconds()
-            
-            # Prepare response
-            response = {
-                "success": True,
-                "message": "Scraping completed successfully",
-                "stats": stats,
-                "execution_time_seconds": execution_time,
-                "timestamp": datetime.now().isoformat()
-            }
-            
             # Send response
-            self.wfile.write(json.dumps(response).encode())
+            self.wfile.write(json.dumps(response, default=str).encode())
+        
+        except ScrapeBusyError as e:
+            self.send_response(409)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
             
+            self.wfile.write(json.dumps({
+                "success": False,
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            }).encode())
+        
         except Exception as e:
             # Handle errors
             self.send_response(500)
@@ -60,6 +140,117 @@ class Handler(BaseHTTPRequestHandler):
             
             self.wfile.write(json.dumps(error_response).encode())
     
+    def _scrape(self, resume, profile=False):
+        """
+        Run the scraper in this request, saving to MongoDB in checkpoints.
+        """
+        from scraper import scrape_with_checkpoints
+        from profiling import profiling_requested
+        
+        # Start time for performance tracking
+        start_time = datetime.now()
+        
+        jobs.start()
+        try:
+            if profile:
+                with profiling_requested():
+                    stats = scrape_with_checkpoints(resume=resume)
+            else:
+                stats = scrape_with_checkpoints(resume=resume)
+        finally:
+            jobs.finish()
+        
+        # Calculate execution time
+        execution_time = (datetime.now() - start_time).total_seconds()
+        
+        return {
+            "success": True,
+            "message": "Scraping completed successfully",
+            "stats": stats,
+            "execution_time_seconds": execution_time,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _health(self):
+        """
+        Report that the process is serving, without touching Selenium or
+        MongoDB.
+        """
+        return {
+            "success": True,
+            "status": "draining" if jobs.draining else "ok",
+            "running_scrapes": jobs.running,
+            "uptime_seconds": round((datetime.now() - STARTED_AT).total_seconds(), 1),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _enqueue(self, resume):
+        """
+        Queue a scrape job for `distributed.py serve-jobs`.
+        """
+        from mongodb import get_mongodb_connection
+        from jobs import get_jobs_collection, enqueue_job
+        
+        client, db, _ = get_mongodb_connection()
+        if client is None:
+            raise RuntimeError("Failed to connect to MongoDB")
+        try:
+            job_id = enqueue_job(get_jobs_collection(db), resume=resume)
+        finally:
+            client.close()
+        
+        return {
+            "success": True,
+            "message": "Scrape job enqueued",
+            "job_id": job_id,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _job_status(self, job_id):
+        """
+        Report the state of an enqueued job.
+        """
+        from mongodb import get_mongodb_connection
+        from jobs import get_jobs_collection, get_job
+        
+        client, db, _ = get_mongodb_connection()
+        if client is None:
+            raise RuntimeError("Failed to connect to MongoDB")
+        try:
+            job = get_job(get_jobs_collection(db), job_id)
+        finally:
+            client.close()
+        
+        return {
+            "success": job is not None,
+            "job": job,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _run_status(self):
+        """
+        Report the URL counts per state of the latest run.
+        """
+        from mongodb import get_mongodb_connection
+        from frontier import get_frontier_collection, get_latest_run, get_run_summary
+        
+        client, db, _ = get_mongodb_connection()
+        if client is None:
+            raise RuntimeError("Failed to connect to MongoDB")
+        try:
+            frontier = get_frontier_collection(db)
+            run_id = get_latest_run(frontier)
+            summary = get_run_summary(frontier, run_id) if run_id else None
+        finally:
+            client.close()
+        
+        return {
+            "success": True,
+            "run_id": run_id,
+            "summary": summary,
+            "timestamp": datetime.now().isoformat()
+        }
+    
     def do_OPTIONS(self):
         """
         Handle OPTIONS requests for CORS preflight
@@ -70,11 +261,52 @@ class Handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
+class ScrapeServer(ThreadingHTTPServer):
+    """
+    Local server that handles every request in its own thread, so
+    preflights, health checks and status requests are answered while a
+    scrape runs.
+    """
+    
+    daemon_threads = True
+    request_queue_size = 128
+
+def serve(host='localhost', port=8000):
+    """
+    Serve /api/scrape until SIGINT or SIGTERM.
+    
+    On the first signal new scrapes are refused while health and status
+    requests are still answered, and the server waits up to
+    SHUTDOWN_DRAIN_SECONDS for a running scrape before it stops. A second
+    signal stops it at once.
+    """
+    server = ScrapeServer((host, port), Handler)
+    
+    def drain_and_shutdown():
+        if not jobs.drain(SHUTDOWN_DRAIN_SECONDS):
+            print("Drain timed out with a scrape still running")
+        server.shutdown()
+    
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot be
+        # called from the serving thread
+        if jobs.draining:
+            print(f"Received signal {signum} again, stopping now")
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        else:
+            print(f"Received signal {signum}, draining running scrapes")
+            threading.Thread(target=drain_and_shutdown, daemon=True).start()
+    
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    
+    print(f"Starting server on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        print("Server stopped")
+
 # For local testing
 if __name__ == "__main__":
-    from http.server import HTTPServer
-    
-    port = int(os.getenv('PORT', 8000))
-    server = HTTPServer(('localhost', port), Handler)
-    print(f"Starting server on port {port}")
-    server.serve_forever() 
\ No newline at end of file
+    serve(os.getenv('HOST', 'localhost'), int(os.getenv('PORT', 8000)))
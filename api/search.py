@@ -0,0 +1,80 @@
+import json
+import sys
+import os
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime
+
+# Add parent directory to path to import the search module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from car_search import search_cars
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        """
+        Handle GET requests to /api/search
+
+        Query parameters:
+            q: Free text search
+            make, model, fuel_type, transmission, seller_type, price_range:
+                Exact filters, several values separated by commas
+            price_min, price_max, year_min, year_max, mileage_min, mileage_max:
+                Range filters
+            near: Place to measure distances from, e.g. Göteborg; or lat
+                and lon
+            radius_km: Only ads within this distance of the place
+            sort: newest, price_asc, price_desc, year_desc, mileage_asc or
+                distance (needs near or lat/lon)
+            size: Number of results per page (max 100)
+            cursor: next_cursor of the previous page
+        """
+        try:
+            query = parse_qs(urlparse(self.path).query)
+            response, cached = search_cars(query)
+            self._send_json(200, response, cached)
+
+        except ValueError as e:
+            self._send_json(400, {
+                "success": False,
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            })
+
+        except Exception as e:
+            self._send_json(500, {
+                "success": False,
+                "message": f"Error during search: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            })
+
+    def do_OPTIONS(self):
+        """
+        Handle OPTIONS requests for CORS preflight
+        """
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+    def _send_json(self, status, body, cached=False):
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('X-Cache', 'HIT' if cached else 'MISS')
+        self.end_headers()
+        self.wfile.write(payload)
+
+# For local testing
+if __name__ == "__main__":
+    from http.server import ThreadingHTTPServer
+
+    port = int(os.getenv('PORT', 8001))
+    server = ThreadingHTTPServer(('localhost', port), Handler)
+    print(f"Starting server on port {port}")
+    server.serve_forever()
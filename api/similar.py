@@ -0,0 +1,83 @@
+import json
+import sys
+import os
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime
+
+# Add parent directory to path to import the similar module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from similar import find_similar, DEFAULT_K
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        """
+        Handle GET requests to /api/similar
+
+        Query parameters:
+            id: ID of the ad to find similar ads for
+            k: Number of similar ads (max 50)
+        """
+        try:
+            query = parse_qs(urlparse(self.path).query)
+            ad_id = query.get('id', [''])[0]
+            if not ad_id:
+                raise ValueError("Parameter 'id' is required")
+            try:
+                k = int(query.get('k', [DEFAULT_K])[0])
+            except ValueError:
+                raise ValueError("Parameter 'k' must be an integer")
+
+            self._send_json(200, find_similar(ad_id, k))
+
+        except ValueError as e:
+            self._send_json(400, {
+                "success": False,
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            })
+
+        except LookupError as e:
+            self._send_json(404, {
+                "success": False,
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            })
+
+        except Exception as e:
+            self._send_json(500, {
+                "success": False,
+                "message": f"Error finding similar ads: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            })
+
+    def do_OPTIONS(self):
+        """
+        Handle OPTIONS requests for CORS preflight
+        """
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        self.wfile.write(payload)
+
+# For local testing
+if __name__ == "__main__":
+    from http.server import ThreadingHTTPServer
+
+    port = int(os.getenv('PORT', 8002))
+    server = ThreadingHTTPServer(('localhost', port), Handler)
+    print(f"Starting server on port {port}")
+    server.serve_forever()
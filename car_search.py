@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Query service over the car_ads Elasticsearch index.
+Builds filtered, faceted and search_after-paginated queries from request
+parameters and caches responses for a short time, keyed by the normalised
+query, so repeated listing page requests do not reach Elasticsearch.
+"""
+
+import os
+import json
+import time
+import base64
+import random
+import logging
+import threading
+import statistics
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Response cache settings
+CACHE_TTL_SECONDS = float(os.getenv('SEARCH_CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1000))
+
+# Page size limits
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Exact-match filters: request parameter -> index field
+TERM_FILTERS = {
+    "make": "make.keyword",
+    "model": "model.keyword",
+    "fuel_type": "fuel_type",
+    "transmission": "transmission",
+    "seller_type": "seller_type",
+    "price_range": "price_range",
+}
+
+# Range filters: request parameter prefix -> index field
+RANGE_FILTERS = {
+    "price": "price",
+    "year": "year",
+    "mileage": "mileage",
+}
+
+# Facets returned with the first result page
+FACETS = {
+    "price_range": "price_range",
+    "seller_type": "seller_type",
+}
+
+# Field holding the geo_point of an ad and the largest distance filter
+GEO_FIELD = "coordinates"
+MAX_RADIUS_KM = 2000
+
+# Sort orders; every order ends with the ad ID so search_after is stable.
+# "distance" is built per request from the origin (see build_query)
+SORT_ORDERS = {
+    "newest": [{"scrape_timestamp": "desc"}, {"id": "asc"}],
+    "price_asc": [{"price": {"order": "asc", "missing": "_last"}}, {"id": "asc"}],
+    "price_desc": [{"price": {"order": "desc", "missing": "_last"}}, {"id": "asc"}],
+    "year_desc": [{"year": {"order": "desc", "missing": "_last"}}, {"id": "asc"}],
+    "mileage_asc": [{"mileage": {"order": "asc", "missing": "_last"}}, {"id": "asc"}],
+}
+
+# Listing pages should be served within this p95 latency under load
+P95_TARGET_MS = 50
+
+# Fields returned for each listing
+LISTING_FIELDS = [
+    "id", "url", "title", "make", "model", "year", "mileage", "price", "price_text",
+    "price_range", "fuel_type", "transmission", "location", "city", "region", "coordinates",
+    "seller_type", "primary_image", "primary_thumbnail", "image_count", "scrape_date",
+]
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+_cache = ResponseCache()
+_es = None
+_es_lock = threading.Lock()
+
+def get_search_client():
+    """
+    Get the Elasticsearch client shared by all requests of this process.
+
+    Returns:
+        Elasticsearch: Elasticsearch client or None if connection fails
+    """
+    global _es
+    if _es is None:
+        with _es_lock:
+            if _es is None:
+                from sync_to_elasticsearch import get_elasticsearch_connection
+                _es = get_elasticsearch_connection()
+    return _es
+
+def _int_param(params: Dict[str, str], name: str) -> Optional[int]:
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Parameter '{name}' must be an integer")
+
+def _float_param(params: Dict[str, str], name: str) -> Optional[float]:
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Parameter '{name}' must be a number")
+
+def _normalize_origin(params: Dict[str, str], normalized: Dict[str, Any]) -> None:
+    # A place name and coordinates are equivalent once resolved, so both
+    # end up as lat/lon in the cache key
+    near = (params.get("near") or "").strip()
+    lat = _float_param(params, "lat")
+    lon = _float_param(params, "lon")
+    if near:
+        from geo import geocode
+
+        geo = geocode(near)
+        if geo is None:
+            raise ValueError(f"Unknown place '{near}'")
+        lat, lon = geo["coordinates"]["lat"], geo["coordinates"]["lon"]
+    elif (lat is None) != (lon is None):
+        raise ValueError("Parameters 'lat' and 'lon' must be given together")
+
+    if lat is not None:
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            raise ValueError("Parameters 'lat' and 'lon' are out of range")
+        normalized["lat"] = round(lat, 4)
+        normalized["lon"] = round(lon, 4)
+
+    radius = _float_param(params, "radius_km")
+    if radius is not None:
+        if "lat" not in normalized:
+            raise ValueError("Parameter 'radius_km' needs 'near' or 'lat' and 'lon'")
+        if not 0 < radius <= MAX_RADIUS_KM:
+            raise ValueError(f"Parameter 'radius_km' must be between 0 and {MAX_RADIUS_KM}")
+        normalized["radius_km"] = radius
+
+def normalize_params(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate request parameters and bring them into a canonical form.
+
+    Equivalent requests produce equal dictionaries, which makes the result
+    usable as a cache key.
+
+    Args:
+        raw: Query parameters, as returned by urllib.parse.parse_qs or a plain dict
+
+    Returns:
+        Dict[str, Any]: Normalised parameters
+
+    Raises:
+        ValueError: If a parameter has an invalid value
+    """
+    params = {
+        key: (value[0] if isinstance(value, list) else value)
+        for key, value in raw.items()
+    }
+    normalized = {}
+
+    query = (params.get("q") or "").strip().lower()
+    if query:
+        normalized["q"] = " ".join(query.split())
+
+    for name in TERM_FILTERS:
+        value = (params.get(name) or "").strip()
+        if value:
+            # Several values can be given separated by commas
+            normalized[name] = sorted({part.strip() for part in value.split(",") if part.strip()})
+
+    for name in RANGE_FILTERS:
+        for bound in ("min", "max"):
+            value = _int_param(params, f"{name}_{bound}")
+            if value is not None:
+                normalized[f"{name}_{bound}"] = value
+
+    _normalize_origin(params, normalized)
+
+    sort = params.get("sort") or "newest"
+    if sort == "distance":
+        if "lat" not in normalized:
+            raise ValueError("Sorting by distance needs 'near' or 'lat' and 'lon'")
+    elif sort not in SORT_ORDERS:
+        raise ValueError(f"Parameter 'sort' must be one of: {', '.join(SORT_ORDERS)}, distance")
+    normalized["sort"] = sort
+
+    size = _int_param(params, "size")
+    normalized["size"] = min(max(size or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+    if params.get("cursor"):
+        normalized["cursor"] = params["cursor"]
+
+    return normalized
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    """
+    Encode the sort values of the last hit as an opaque page cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode()).decode()
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Decode a page cursor created by encode_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Parameter 'cursor' is invalid")
+    if not isinstance(values, list):
+        raise ValueError("Parameter 'cursor' is invalid")
+    return values
+
+def build_query(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the Elasticsearch request body for normalised parameters.
+
+    Args:
+        params: Parameters from normalize_params()
+
+    Returns:
+        Dict[str, Any]: Keyword arguments for Elasticsearch.search()
+    """
+    # Filters do not score and are cached by Elasticsearch
+    filters = [{"term": {"active": True}}]
+
+    for name, field in TERM_FILTERS.items():
+        if name in params:
+            filters.append({"terms": {field: params[name]}})
+
+    for name, field in RANGE_FILTERS.items():
+        bounds = {}
+        if f"{name}_min" in params:
+            bounds["gte"] = params[f"{name}_min"]
+        if f"{name}_max" in params:
+            bounds["lte"] = params[f"{name}_max"]
+        if bounds:
+            filters.append({"range": {field: bounds}})
+
+    if "radius_km" in params:
+        filters.append({"geo_distance": {
+            "distance": f"{params['radius_km']}km",
+            GEO_FIELD: {"lat": params["lat"], "lon": params["lon"]},
+        }})
+
+    query = {"bool": {"filter": filters}}
+    if "q" in params:
+        query["bool"]["must"] = [{"match": {"search_text": {"query": params["q"], "operator": "and"}}}]
+
+    if params["sort"] == "distance":
+        sort = [
+            {"_geo_distance": {
+                GEO_FIELD: {"lat": params["lat"], "lon": params["lon"]},
+                "order": "asc",
+                "unit": "km",
+                "ignore_unmapped": True,
+            }},
+            {"id": "asc"},
+        ]
+    else:
+        sort = SORT_ORDERS[params["sort"]]
+
+    body = {
+        "query": query,
+        "sort": sort,
+        "size": params["size"],
+        "source": LISTING_FIELDS,
+        "track_total_hits": False,
+    }
+
+    if "cursor" in params:
+        body["search_after"] = decode_cursor(params["cursor"])
+    else:
+        # Totals and facets do not change between pages, so only the
+        # first page pays for counting and aggregating
+        body["track_total_hits"] = True
+        body["aggs"] = {
+            name: {"terms": {"field": field, "size": 20}}
+            for name, field in FACETS.items()
+        }
+
+    return body
+
+def _format_response(result: Dict[str, Any], size: int, by_distance: bool = False) -> Dict[str, Any]:
+    hits = result["hits"]["hits"]
+    next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == size else None
+
+    results = [hit["_source"] for hit in hits]
+    if by_distance:
+        # The first sort value is the distance from the origin
+        for listing, hit in zip(results, hits):
+            listing["distance_km"] = round(hit["sort"][0], 1)
+
+    response = {
+        "results": results,
+        "next_cursor": next_cursor,
+    }
+
+    if "aggregations" in result:
+        response["total"] = result["hits"]["total"]["value"]
+        response["facets"] = {
+            name: [
+                {"value": bucket["key"], "count": bucket["doc_count"]}
+                for bucket in result["aggregations"][name]["buckets"]
+            ]
+            for name in FACETS
+        }
+
+    return response
+
+def search_cars(raw_params: Dict[str, Any], es=None, index_name: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Search car ads.
+
+    Args:
+        raw_params: Request parameters: q, make, model, fuel_type, transmission,
+            seller_type, price_range, price_min/max, year_min/max,
+            mileage_min/max, near or lat/lon, radius_km, sort, size and
+            cursor
+        es: Elasticsearch client; the shared client is used when omitted
+        index_name: Index to search; ELASTICSEARCH_INDEX when omitted
+
+    Returns:
+        Tuple[Dict[str, Any], bool]: Response and whether it came from the cache
+
+    Raises:
+        ValueError: If a parameter has an invalid value
+        ConnectionError: If Elasticsearch is not reachable
+    """
+    params = normalize_params(raw_params)
+    cache_key = json.dumps(params, sort_keys=True)
+
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached, True
+
+    es = es or get_search_client()
+    if es is None:
+        raise ConnectionError("Failed to connect to Elasticsearch")
+
+    index_name = index_name or os.getenv('ELASTICSEARCH_INDEX', 'car_ads')
+    result = es.search(index=index_name, **build_query(params))
+
+    response = _format_response(result, params["size"], params["sort"] == "distance")
+    _cache.set(cache_key, response)
+    return response, False
+
+def _listing_params(rng: random.Random) -> Dict[str, str]:
+    # Parameters of a listing page as the frontend filters send them
+    params = {"sort": rng.choice(list(SORT_ORDERS))}
+    if rng.random() < 0.8:
+        params["make"] = rng.choice(["Porsche", "Volvo", "BMW", "Audi", "Mercedes-Benz", "Tesla"])
+    if rng.random() < 0.5:
+        params["price_max"] = str(rng.randrange(200000, 2000000, 100000))
+    if rng.random() < 0.3:
+        params["year_min"] = str(rng.randrange(2005, 2024))
+    if rng.random() < 0.2:
+        params["q"] = rng.choice(["automat", "dragkrok", "servicebok", "fyrhjulsdrift"])
+    return params
+
+def benchmark(requests: int = 2000, concurrency: int = 16, distinct: int = 200, es=None, index_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Time listing page requests through search_cars() from many threads.
+
+    Requests are drawn from `distinct` parameter sets, so repeated pages
+    are answered from the cache the way popular listing pages are. The
+    cache is cleared first.
+
+    Args:
+        requests: Number of requests
+        concurrency: Number of requests in flight
+        distinct: Number of different listing pages
+        es: Elasticsearch client; the shared client is used when omitted
+        index_name: Index to search; ELASTICSEARCH_INDEX when omitted
+
+    Returns:
+        Dict[str, Any]: Requests per second, latency percentiles in ms,
+            cache hit share and errors
+    """
+    rng = random.Random(1)
+    pages = [_listing_params(rng) for _ in range(distinct)]
+    plan = [rng.choice(pages) for _ in range(requests)]
+    _cache.clear()
+
+    def timed(params):
+        started = time.perf_counter()
+        try:
+            _, cached = search_cars(params, es=es, index_name=index_name)
+            error = None
+        except Exception as e:
+            cached, error = False, str(e)
+        return (time.perf_counter() - started) * 1000, cached, error
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, plan))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _, _ in results]
+    misses = [latency for latency, cached, error in results if not cached and not error]
+    errors = [error for _, _, error in results if error]
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "miss_p95_ms": round(statistics.quantiles(misses, n=100)[94], 2) if len(misses) > 1 else None,
+        "cache_hit_share": round(1 - len(misses) / requests, 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Car search tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("benchmark", help="Time listing page requests against the index")
+    bench_parser.add_argument("--requests", type=int, default=2000, help="Number of requests")
+    bench_parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    bench_parser.add_argument("--distinct", type=int, default=200, help="Number of different listing pages")
+    bench_parser.add_argument("--p95-budget-ms", type=float, default=P95_TARGET_MS,
+                              help="Exit with status 1 when p95 latency is higher")
+    args = parser.parse_args()
+
+    results = benchmark(args.requests, args.concurrency, args.distinct)
+    print(f"Benchmark results: {results}")
+    if results["errors"] or results["p95_ms"] > args.p95_budget_ms:
+        sys.exit(1)
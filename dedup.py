@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Duplicate listing detection.
+The same car listed by several sellers, or relisted under a new ID, is
+grouped under one `cluster_id`. Ads are only compared with ads that share a
+blocking key (make, model, year and a mileage or price band), and within a
+block only pairs whose description MinHash or image hashes collide in an LSH
+bucket are verified, so the work grows roughly linearly with the number of ads.
+"""
+
+import os
+import re
+import zlib
+import logging
+from collections import defaultdict
+from typing import Dict, Any, List, Iterable, Optional, Set, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from image_processing import hamming_distance
+
+logger = logging.getLogger(__name__)
+
+# Band widths of the blocking keys
+MILEAGE_BAND = 2000   # mil
+PRICE_BAND = 50000    # kr
+
+# MinHash signature length and LSH layout (NUM_BANDS * ROWS_PER_BAND == NUM_PERM)
+NUM_PERM = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+
+# Words per description shingle
+SHINGLE_SIZE = 3
+
+# Verification thresholds
+TEXT_SIMILARITY_THRESHOLD = float(os.getenv('DEDUP_TEXT_SIMILARITY', 0.8))
+TEXT_SIMILARITY_WITH_IMAGE = float(os.getenv('DEDUP_TEXT_SIMILARITY_WITH_IMAGE', 0.3))
+PHASH_MAX_DISTANCE = 6
+
+# The 64-bit image hash is split into this many chunks for LSH; two hashes
+# within PHASH_MAX_DISTANCE bits always share at least one chunk
+PHASH_CHUNKS = 8
+
+# MinHash permutations: h(x) = (a * x + b) mod p
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def get_signatures_collection(database: Database) -> Collection:
+    """
+    Get the collection holding the dedup signature of every ad.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Signature collection
+    """
+    collection = database[os.getenv('DEDUP_SIGNATURES_COLLECTION_NAME', 'ad_signatures')]
+    collection.create_index("ad_id", unique=True)
+    collection.create_index("block_keys")
+    collection.create_index("cluster_id")
+    return collection
+
+def blocking_keys(ad: Dict[str, Any]) -> List[str]:
+    """
+    Get the blocking keys of an ad.
+
+    Two keys are built so that a change in either mileage or price (for
+    example a relisting at a lower price) still leaves one key in common.
+    Ads without make, model and year get no keys and are never compared.
+
+    Args:
+        ad: Car ad details
+
+    Returns:
+        List[str]: Blocking keys
+    """
+    make, model, year = ad.get("make"), ad.get("model"), ad.get("year")
+    if not (make and model and year):
+        return []
+
+    base = f"{make.lower()}|{model.lower()}|{year}"
+    keys = []
+    if ad.get("mileage") is not None:
+        keys.append(f"{base}|m{ad['mileage'] // MILEAGE_BAND}")
+    if ad.get("price") is not None:
+        keys.append(f"{base}|p{ad['price'] // PRICE_BAND}")
+    return keys or [base]
+
+def minhash(text: str) -> Optional[List[int]]:
+    """
+    Compute the MinHash signature of a text over word shingles.
+
+    Args:
+        text: Text, e.g. an ad description
+
+    Returns:
+        Optional[List[int]]: Signature or None for empty text
+    """
+    words = _WORD_PATTERN.findall((text or "").lower())
+    if not words:
+        return None
+
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) % _MERSENNE_PRIME
+    return [int(value) for value in permuted.min(axis=0)]
+
+def build_signature(ad: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the dedup signature of an ad.
+
+    Args:
+        ad: Car ad details
+
+    Returns:
+        Dict[str, Any]: Signature with ad_id, block_keys, minhash and phashes
+    """
+    images = ad.get("images") or []
+    return {
+        "ad_id": ad["id"],
+        "block_keys": blocking_keys(ad),
+        "minhash": minhash(ad.get("description", "")),
+        "phashes": sorted({image["phash"] for image in images if image.get("phash")}),
+    }
+
+def text_similarity(sig_a: Dict[str, Any], sig_b: Dict[str, Any]) -> float:
+    """
+    Estimate the Jaccard similarity of two descriptions from their MinHashes.
+    """
+    if not sig_a.get("minhash") or not sig_b.get("minhash"):
+        return 0.0
+    matches = sum(1 for a, b in zip(sig_a["minhash"], sig_b["minhash"]) if a == b)
+    return matches / NUM_PERM
+
+def shares_image(sig_a: Dict[str, Any], sig_b: Dict[str, Any]) -> bool:
+    """
+    Check whether two ads have a perceptually identical image.
+    """
+    return any(
+        hamming_distance(hash_a, hash_b) <= PHASH_MAX_DISTANCE
+        for hash_a in sig_a.get("phashes") or []
+        for hash_b in sig_b.get("phashes") or []
+    )
+
+def is_duplicate(sig_a: Dict[str, Any], sig_b: Dict[str, Any]) -> bool:
+    """
+    Decide whether two ads in the same block describe the same car.
+
+    Args:
+        sig_a: Signature of the first ad
+        sig_b: Signature of the second ad
+
+    Returns:
+        bool: True for a near-identical description, or a shared photo
+            backed by a somewhat similar (or missing) description
+    """
+    similarity = text_similarity(sig_a, sig_b)
+    if similarity >= TEXT_SIMILARITY_THRESHOLD:
+        return True
+
+    if shares_image(sig_a, sig_b):
+        no_text = not sig_a.get("minhash") or not sig_b.get("minhash")
+        return no_text or similarity >= TEXT_SIMILARITY_WITH_IMAGE
+
+    return False
+
+def _lsh_buckets(sig: Dict[str, Any]) -> Iterable[Tuple]:
+    """
+    Yield the LSH bucket keys of a signature within each of its blocks.
+    """
+    for block in sig["block_keys"]:
+        if sig.get("minhash"):
+            for band in range(NUM_BANDS):
+                rows = sig["minhash"][band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+                yield (block, "t", band, tuple(rows))
+
+        chunk_chars = 16 // PHASH_CHUNKS
+        for phash in sig.get("phashes") or []:
+            for chunk in range(PHASH_CHUNKS):
+                yield (block, "i", chunk, phash[chunk * chunk_chars:(chunk + 1) * chunk_chars])
+
+def candidate_pairs(signatures: List[Dict[str, Any]], new_ids: Optional[Set[str]] = None) -> Set[Tuple[str, str]]:
+    """
+    Find pairs of ads that share an LSH bucket inside a block.
+
+    Args:
+        signatures: Signatures to compare
+        new_ids: If given, only pairs involving at least one of these ads
+
+    Returns:
+        Set[Tuple[str, str]]: Candidate pairs of ad IDs
+    """
+    buckets = defaultdict(list)
+    for sig in signatures:
+        for bucket in _lsh_buckets(sig):
+            buckets[bucket].append(sig["ad_id"])
+
+    pairs = set()
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if a != b and (new_ids is None or a in new_ids or b in new_ids):
+                    pairs.add((a, b) if a < b else (b, a))
+    return pairs
+
+def cluster_signatures(signatures: List[Dict[str, Any]], new_ids: Optional[Set[str]] = None) -> Dict[str, str]:
+    """
+    Group signatures into duplicate clusters.
+
+    Existing `cluster_id` values of the signatures are kept as groups, so
+    incremental runs extend clusters instead of recomputing them. Each
+    cluster is named after its smallest ad ID.
+
+    Args:
+        signatures: Signatures to cluster
+        new_ids: If given, only pairs involving these ads are verified
+
+    Returns:
+        Dict[str, str]: Cluster ID by ad ID
+    """
+    parent = {sig["ad_id"]: sig["ad_id"] for sig in signatures}
+
+    def find(ad_id):
+        while parent[ad_id] != ad_id:
+            parent[ad_id] = parent[parent[ad_id]]
+            ad_id = parent[ad_id]
+        return ad_id
+
+    def union(a, b):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            if root_a < root_b:
+                parent[root_b] = root_a
+            else:
+                parent[root_a] = root_b
+
+    # Keep the clusters found by earlier runs
+    first_member = {}
+    for sig in signatures:
+        cluster_id = sig.get("cluster_id")
+        if cluster_id:
+            if cluster_id in first_member:
+                union(first_member[cluster_id], sig["ad_id"])
+            else:
+                first_member[cluster_id] = sig["ad_id"]
+
+    by_id = {sig["ad_id"]: sig for sig in signatures}
+    for a, b in candidate_pairs(signatures, new_ids):
+        if find(a) != find(b) and is_duplicate(by_id[a], by_id[b]):
+            union(a, b)
+
+    # Name clusters after their smallest member, or their previous ID if that
+    # is smaller, so names stay stable as clusters grow
+    names = {}
+    for sig in signatures:
+        root = find(sig["ad_id"])
+        candidates = [sig["ad_id"]] + ([sig["cluster_id"]] if sig.get("cluster_id") else [])
+        names[root] = min([names.get(root, root)] + candidates)
+
+    return {ad_id: names[find(ad_id)] for ad_id in parent}
+
+def assign_clusters(collection: Collection, ads: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Assign cluster IDs to newly saved ads.
+
+    Only the stored signatures that share a blocking key with the new ads
+    are loaded. Clusters that get merged are renamed in one update_many each.
+
+    Args:
+        collection: Car ads collection
+        ads: Car ads that were saved
+
+    Returns:
+        Dict[str, int]: Statistics about the run
+    """
+    signatures_collection = get_signatures_collection(collection.database)
+    new_signatures = [build_signature(ad) for ad in ads if ad.get("id")]
+    new_ids = {sig["ad_id"] for sig in new_signatures}
+
+    keys = list({key for sig in new_signatures for key in sig["block_keys"]})
+    stored = list(signatures_collection.find(
+        {"block_keys": {"$in": keys}, "ad_id": {"$nin": list(new_ids)}},
+        {"_id": 0}
+    )) if keys else []
+
+    previous = {sig["ad_id"]: sig.get("cluster_id") for sig in stored}
+    previous.update({
+        doc["ad_id"]: doc.get("cluster_id")
+        for doc in signatures_collection.find({"ad_id": {"$in": list(new_ids)}}, {"_id": 0, "ad_id": 1, "cluster_id": 1})
+    })
+    for sig in new_signatures:
+        sig["cluster_id"] = previous.get(sig["ad_id"])
+
+    clusters = cluster_signatures(stored + new_signatures, new_ids)
+
+    # Renamed clusters: every member, including ones outside the loaded
+    # blocks, follows the new name
+    renamed = {
+        previous[ad_id]: cluster_id
+        for ad_id, cluster_id in clusters.items()
+        if previous.get(ad_id) and previous[ad_id] != cluster_id
+    }
+    for old_id, new_id in renamed.items():
+        signatures_collection.update_many({"cluster_id": old_id}, {"$set": {"cluster_id": new_id}})
+        collection.update_many({"cluster_id": old_id}, {"$set": {"cluster_id": new_id, "indexed": False}})
+
+    signature_ops = [
+        UpdateOne({"ad_id": sig["ad_id"]}, {"$set": dict(sig, cluster_id=clusters[sig["ad_id"]])}, upsert=True)
+        for sig in new_signatures
+    ]
+    ad_ops = [
+        UpdateOne({"id": ad_id}, {"$set": {"cluster_id": cluster_id}})
+        for ad_id, cluster_id in clusters.items()
+        if ad_id in new_ids
+    ]
+    if signature_ops:
+        signatures_collection.bulk_write(signature_ops, ordered=False)
+    if ad_ops:
+        collection.bulk_write(ad_ops, ordered=False)
+
+    duplicates = sum(1 for ad_id in new_ids if clusters[ad_id] != ad_id)
+    if duplicates or renamed:
+        logger.info(f"Dedup: {duplicates} of {len(new_ids)} ads are duplicates, {len(renamed)} clusters merged")
+    return {"ads": len(new_ids), "duplicates": duplicates, "merged_clusters": len(renamed)}
+
+def rebuild_clusters(collection: Collection, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Recompute signatures and clusters for every active ad.
+
+    Use after the image hashes of many ads have been filled in by image
+    processing, or after changing thresholds.
+
+    Args:
+        collection: Car ads collection
+        batch_size: Number of documents per bulk write
+
+    Returns:
+        Dict[str, int]: Statistics about the rebuild
+    """
+    projection = {"_id": 0, "id": 1, "make": 1, "model": 1, "year": 1, "mileage": 1,
+                  "price": 1, "description": 1, "images.phash": 1, "cluster_id": 1}
+    previous = {}
+    signatures = []
+    for doc in collection.find({"active": True}, projection):
+        if doc.get("id"):
+            previous[doc["id"]] = doc.get("cluster_id")
+            signatures.append(build_signature(doc))
+    clusters = cluster_signatures(signatures)
+
+    signatures_collection = get_signatures_collection(collection.database)
+    for i in range(0, len(signatures), batch_size):
+        chunk = signatures[i:i + batch_size]
+        signatures_collection.bulk_write([
+            UpdateOne({"ad_id": sig["ad_id"]}, {"$set": dict(sig, cluster_id=clusters[sig["ad_id"]])}, upsert=True)
+            for sig in chunk
+        ], ordered=False)
+        # Only ads whose cluster changed need to be synced again
+        ad_ops = [
+            UpdateOne({"id": sig["ad_id"]}, {"$set": {"cluster_id": clusters[sig["ad_id"]], "indexed": False}})
+            for sig in chunk
+            if previous.get(sig["ad_id"]) != clusters[sig["ad_id"]]
+        ]
+        if ad_ops:
+            collection.bulk_write(ad_ops, ordered=False)
+
+    stats = {
+        "ads": len(signatures),
+        "clusters": len(set(clusters.values())),
+        "duplicates": sum(1 for ad_id, cluster_id in clusters.items() if ad_id != cluster_id),
+    }
+    logger.info(f"Rebuilt duplicate clusters: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    from mongodb import get_mongodb_connection
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise SystemExit("Failed to connect to MongoDB")
+
+    try:
+        print(f"Dedup results: {rebuild_clusters(collection)}")
+    finally:
+        client.close()
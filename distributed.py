@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Distributed crawling over the shared MongoDB frontier.
+A coordinator runs discovery and publishes the ad URLs of a new run; any
+number of workers, on any machine, lease URLs from the frontier, scrape
+them and save the results. Workers renew their leases with a heartbeat,
+so a crashed worker only delays its URLs by one lease timeout. The
+coordinator can also run as a service that starts a run for every job
+enqueued through /api/scrape (see jobs.py).
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+import uuid
+from typing import Dict, Any, Iterator, Optional
+
+from pymongo.collection import Collection
+
+from mongodb import get_mongodb_connection
+from frontier import (
+    get_frontier_collection, start_run, get_resumable_run, get_run_urls, get_run_summary,
+    claim_url, renew_leases, expire_exhausted, mark_done, LEASE_SECONDS, PENDING, IN_PROGRESS
+)
+from scraper import (
+    setup_driver, discover_with_sessions, iter_scraped_ads,
+    save_to_mongo, ensure_indexes, CHECKPOINT_EVERY
+)
+from sessions import SessionPool
+from selector_stats import SelectorStats, get_selector_stats_collection
+from jobs import get_jobs_collection, claim_job, finish_job
+from politeness import snapshot_all
+from reconcile import reconcile_active_ads
+from schema import ad_id_from_url
+from sources import BlocketSource
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two polls of an idle worker or a waiting coordinator
+POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', 10))
+
+def default_worker_id() -> str:
+    """
+    Get a worker ID that is unique across machines and processes.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+class LeaseHeartbeat:
+    """
+    Background thread that keeps renewing the leases of a worker.
+    """
+
+    def __init__(self, frontier: Collection, worker_id: str, lease_seconds: int = LEASE_SECONDS):
+        self.frontier = frontier
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{worker_id}", daemon=True)
+
+    def _run(self) -> None:
+        # Renew well before expiry so one missed beat is harmless
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                renew_leases(self.frontier, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Error renewing leases: {str(e)}")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+def iter_claimed_urls(frontier: Collection, run_id: str, worker_id: str, lease_seconds: int = LEASE_SECONDS, idle_timeout: float = 0) -> Iterator[str]:
+    """
+    Claim URLs of a run one at a time until none are left.
+
+    Args:
+        frontier: Frontier collection
+        run_id: Run ID
+        worker_id: Worker ID
+        lease_seconds: Lease duration
+        idle_timeout: Seconds to keep polling for expired leases of other
+            workers once nothing is pending
+
+    Yields:
+        str: Claimed URL
+    """
+    idle_since = None
+    while True:
+        url = claim_url(frontier, run_id, worker_id, lease_seconds)
+        if url:
+            idle_since = None
+            yield url
+            continue
+
+        summary = get_run_summary(frontier, run_id)
+        if not summary[IN_PROGRESS] and not summary[PENDING]:
+            return
+
+        idle_since = idle_since or time.monotonic()
+        if time.monotonic() - idle_since >= idle_timeout:
+            return
+        time.sleep(POLL_INTERVAL)
+
+def publish_run() -> Optional[str]:
+    """
+    Run discovery and publish the found ad URLs as a new run.
+
+    Returns:
+        Optional[str]: ID of the new run or None on failure
+    """
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        logger.error("Failed to get MongoDB connection")
+        return None
+
+    sessions = SessionPool(setup_driver)
+    try:
+        frontier = get_frontier_collection(db)
+        return start_run(frontier, discover_with_sessions(sessions), source=BlocketSource.name)
+    except Exception as e:
+        logger.error(f"Error publishing run: {str(e)}")
+        return None
+    finally:
+        sessions.close()
+        client.close()
+
+def serve_jobs(worker_id: Optional[str] = None) -> None:
+    """
+    Start a run for every queued scrape job, one job at a time, forever.
+
+    Args:
+        worker_id: ID of this coordinator; generated when omitted
+    """
+    worker_id = worker_id or default_worker_id()
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise RuntimeError("Failed to get MongoDB connection")
+
+    try:
+        jobs = get_jobs_collection(db)
+        frontier = get_frontier_collection(db)
+        while True:
+            job = claim_job(jobs, worker_id)
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            logger.info(f"Starting scrape job {job['_id']}")
+            try:
+                run_id = get_resumable_run(frontier, BlocketSource.name) if job.get("resume") else None
+                run_id = run_id or publish_run()
+                if run_id is None:
+                    raise RuntimeError("Failed to publish run")
+                finish_job(jobs, job["_id"], result=wait_for_run(run_id))
+            except Exception as e:
+                logger.error(f"Scrape job {job['_id']} failed: {str(e)}")
+                finish_job(jobs, job["_id"], error=str(e))
+    finally:
+        client.close()
+
+def wait_for_run(run_id: str, reconcile: bool = True) -> Dict[str, Any]:
+    """
+    Wait until every URL of a run is done or failed, then reconcile.
+
+    Args:
+        run_id: Run ID
+        reconcile: Mark ads missing from the run as inactive afterwards
+
+    Returns:
+        Dict[str, Any]: Final URL counts per state and deactivated ads
+    """
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise RuntimeError("Failed to get MongoDB connection")
+
+    try:
+        frontier = get_frontier_collection(db)
+        while True:
+            expire_exhausted(frontier, run_id)
+            summary = get_run_summary(frontier, run_id)
+            if not summary[PENDING] and not summary[IN_PROGRESS]:
+                break
+            logger.info(f"Run {run_id}: {summary}")
+            time.sleep(POLL_INTERVAL)
+
+        result = {"run_id": run_id, **summary, "deactivated": 0}
+        if reconcile:
+            # Workers scrape Blocket; ads of other sources are left alone
+            seen_ids = [ad_id_from_url(url) for url in get_run_urls(frontier, run_id)]
+            result["deactivated"] = reconcile_active_ads(collection, seen_ids, scope=BlocketSource().scope())["deactivated"]
+        return result
+    finally:
+        client.close()
+
+def run_worker(run_id: Optional[str] = None, worker_id: Optional[str] = None, lease_seconds: int = LEASE_SECONDS,
+               checkpoint_every: int = CHECKPOINT_EVERY, idle_timeout: float = 0) -> Dict[str, Any]:
+    """
+    Scrape leased URLs of a run until none are left.
+
+    Args:
+        run_id: Run to work on; the latest unfinished run when omitted
+        worker_id: Worker ID; generated when omitted
+        lease_seconds: Lease duration
+        checkpoint_every: Maximum number of ads per batch written to MongoDB
+        idle_timeout: Seconds to wait for expired leases of other workers
+            once nothing is pending
+
+    Returns:
+        Dict[str, Any]: Statistics about the work done by this worker
+    """
+    worker_id = worker_id or default_worker_id()
+    stats = {"run_id": run_id, "worker_id": worker_id, "total_ads": 0, "inserted": 0, "updated": 0,
+             "unchanged": 0, "price_changed": 0, "duplicates": 0, "alerts": 0, "errors": 0, "failed_urls": 0,
+             "blocked_pages": 0, "empty_pages": 0, "requeued_urls": 0}
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        logger.error("Failed to get MongoDB connection")
+        stats["errors"] += 1
+        return stats
+
+    sessions = SessionPool(setup_driver)
+    heartbeat = None
+    selector_stats = None
+    try:
+        ensure_indexes(collection)
+        frontier = get_frontier_collection(db)
+        run_id = run_id or get_resumable_run(frontier, BlocketSource.name)
+        stats["run_id"] = run_id
+        if not run_id:
+            logger.info("No unfinished run to work on")
+            return stats
+
+        logger.info(f"Worker {worker_id} joining run {run_id}")
+        heartbeat = LeaseHeartbeat(frontier, worker_id, lease_seconds)
+        heartbeat.start()
+        selector_stats = SelectorStats(get_selector_stats_collection(db))
+
+        urls = iter_claimed_urls(frontier, run_id, worker_id, lease_seconds, idle_timeout)
+        save_stats = save_to_mongo(
+            iter_scraped_ads(sessions, urls, frontier=frontier, stats=stats, selector_stats=selector_stats),
+            collection=collection,
+            batch_size=checkpoint_every,
+            on_batch=lambda batch: mark_done(frontier, [ad["url"] for ad in batch])
+        )
+        for key in ("total_ads", "inserted", "updated", "unchanged", "price_changed", "duplicates", "alerts", "errors"):
+            stats[key] += save_stats[key]
+    except Exception as e:
+        logger.error(f"Error in worker {worker_id}: {str(e)}")
+        stats["errors"] += 1
+    finally:
+        if heartbeat is not None:
+            heartbeat.stop()
+        if selector_stats is not None:
+            selector_stats.flush()
+        sessions.close()
+        client.close()
+
+    stats["politeness"] = snapshot_all()
+    stats["sessions"] = sessions.snapshot()
+    logger.info(f"Worker {worker_id} finished: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Distributed Blocket crawl over the MongoDB frontier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Publish a new run and wait for the workers")
+    coordinator_parser.add_argument("--no-wait", action="store_true", help="Exit after publishing the run")
+
+    subparsers.add_parser("serve-jobs", help="Start a run for every job enqueued through the API")
+
+    worker_parser = subparsers.add_parser("worker", help="Scrape URLs of a run")
+    worker_parser.add_argument("--run-id", help="Run to work on (default: latest unfinished run)")
+    worker_parser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS)
+    worker_parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY)
+    worker_parser.add_argument("--idle-timeout", type=float, default=0,
+                               help="Seconds to wait for other workers' expired leases before exiting")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        run_id = publish_run()
+        if run_id is None:
+            raise SystemExit("Failed to publish run")
+        print(f"Published run {run_id}")
+        if not args.no_wait:
+            print(f"Run results: {wait_for_run(run_id)}")
+    elif args.command == "serve-jobs":
+        serve_jobs()
+    else:
+        stats = run_worker(args.run_id, lease_seconds=args.lease_seconds,
+                           checkpoint_every=args.checkpoint_every, idle_timeout=args.idle_timeout)
+        print(f"Worker results: {stats}")
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Persistent URL frontier for resumable scrape runs.
+Every ad URL discovered by a run is stored in MongoDB together with its
+state, so a run that crashes or times out can be resumed where it stopped.
+Workers on several machines can share a run by leasing URLs with
+claim_url(); a lease that is not renewed expires and the URL is handed
+to the next worker.
+"""
+
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Iterable
+
+from pymongo import UpdateOne, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# URL states
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+# Maximum number of operations sent in a single bulk write
+BULK_CHUNK_SIZE = 500
+
+# Seconds a worker may hold a URL without renewing its lease
+LEASE_SECONDS = int(os.getenv('FRONTIER_LEASE_SECONDS', 300))
+
+# Leased URLs are given up on after this many attempts
+MAX_ATTEMPTS = int(os.getenv('FRONTIER_MAX_ATTEMPTS', 3))
+
+# URLs are given up on after being put back this many times for blocks,
+# so a page that is blocked for good does not keep a run from finishing
+MAX_BLOCKED = int(os.getenv('FRONTIER_MAX_BLOCKED', 5))
+
+def get_frontier_collection(database: Database) -> Collection:
+    """
+    Get the frontier collection and make sure its indexes exist.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Frontier collection
+    """
+    collection = database[os.getenv('FRONTIER_COLLECTION_NAME', 'scrape_frontier')]
+    collection.create_index("url", unique=True)
+    collection.create_index([("run_id", ASCENDING), ("state", ASCENDING)])
+    collection.create_index([("run_id", ASCENDING), ("state", ASCENDING), ("lease_expires_at", ASCENDING)])
+    return collection
+
+def start_run(collection: Collection, urls: Iterable[str], source: Optional[str] = None) -> str:
+    """
+    Register the URLs of a new run as pending.
+
+    URLs already known from earlier runs are reset to pending and moved
+    to the new run.
+
+    Args:
+        collection: Frontier collection
+        urls: Ad URLs found by discovery
+        source: Name of the source the run crawls, when sources run side
+            by side; its runs get their own IDs
+
+    Returns:
+        str: ID of the new run
+    """
+    now = datetime.now(timezone.utc)
+    # Runs sort by start time; the random part keeps runs published in the
+    # same second, e.g. by a coordinator and a job service, apart
+    run_id = f"{now:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    fields = {"run_id": run_id, "state": PENDING, "attempts": 0, "updated_at": now}
+    cleared = {"error": "", "worker_id": "", "lease_expires_at": ""}
+    if source:
+        run_id = fields["run_id"] = f"{run_id}-{source}"
+        fields["source"] = source
+    else:
+        cleared["source"] = ""
+
+    operations = [
+        UpdateOne(
+            {"url": url},
+            {
+                "$set": fields,
+                "$unset": cleared
+            },
+            upsert=True
+        )
+        for url in urls
+    ]
+
+    for i in range(0, len(operations), BULK_CHUNK_SIZE):
+        collection.bulk_write(operations[i:i + BULK_CHUNK_SIZE], ordered=False)
+
+    logger.info(f"Started run {run_id} with {len(operations)} URLs")
+    return run_id
+
+def get_resumable_run(collection: Collection, source: Optional[str] = None) -> Optional[str]:
+    """
+    Find the most recent run that still has unfinished URLs.
+
+    Args:
+        collection: Frontier collection
+        source: Only consider runs of this source
+
+    Returns:
+        Optional[str]: Run ID or None if every run has finished
+    """
+    query = {"state": {"$in": [PENDING, IN_PROGRESS]}}
+    if source:
+        query["source"] = source
+    doc = collection.find_one(
+        query,
+        sort=[("run_id", DESCENDING)],
+        projection={"run_id": 1}
+    )
+    return doc["run_id"] if doc else None
+
+def reset_in_progress(collection: Collection, run_id: str) -> int:
+    """
+    Move URLs left in progress by an interrupted run back to pending.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+
+    Returns:
+        int: Number of URLs reset
+    """
+    result = collection.update_many(
+        {"run_id": run_id, "state": IN_PROGRESS},
+        {"$set": {"state": PENDING, "updated_at": datetime.now(timezone.utc)}}
+    )
+    return result.modified_count
+
+def get_pending_urls(collection: Collection, run_id: str) -> List[str]:
+    """
+    Get the URLs of a run that still have to be scraped.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+
+    Returns:
+        List[str]: Pending URLs
+    """
+    cursor = collection.find({"run_id": run_id, "state": PENDING}, projection={"url": 1})
+    return [doc["url"] for doc in cursor]
+
+def get_run_urls(collection: Collection, run_id: str) -> List[str]:
+    """
+    Get every URL discovered by a run, whatever its state.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+
+    Returns:
+        List[str]: URLs of the run
+    """
+    cursor = collection.find({"run_id": run_id}, projection={"url": 1})
+    return [doc["url"] for doc in cursor]
+
+def get_latest_run(collection: Collection) -> Optional[str]:
+    """
+    Get the ID of the most recent run.
+
+    Args:
+        collection: Frontier collection
+
+    Returns:
+        Optional[str]: Run ID or None if no run has been started
+    """
+    doc = collection.find_one({}, sort=[("run_id", DESCENDING)], projection={"run_id": 1})
+    return doc["run_id"] if doc else None
+
+def mark_in_progress(collection: Collection, url: str) -> None:
+    """
+    Mark a URL as being scraped.
+
+    Args:
+        collection: Frontier collection
+        url: Ad URL
+    """
+    collection.update_one(
+        {"url": url},
+        {"$set": {"state": IN_PROGRESS, "updated_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}}
+    )
+
+def mark_done(collection: Collection, urls: List[str]) -> None:
+    """
+    Mark URLs whose records have been saved as done.
+
+    Args:
+        collection: Frontier collection
+        urls: Ad URLs
+    """
+    if not urls:
+        return
+
+    collection.update_many(
+        {"url": {"$in": urls}},
+        {"$set": {"state": DONE, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+def mark_failed(collection: Collection, url: str, error: str) -> None:
+    """
+    Mark a URL as failed.
+
+    Args:
+        collection: Frontier collection
+        url: Ad URL
+        error: Error message
+    """
+    collection.update_one(
+        {"url": url},
+        {"$set": {"state": FAILED, "error": error, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+def requeue_url(collection: Collection, url: str, reason: str) -> bool:
+    """
+    Put a URL whose page was blocked back to pending.
+
+    A block says nothing about the page, so the try is not counted against
+    MAX_ATTEMPTS and the lease is released for the next worker. A URL that
+    was already put back MAX_BLOCKED times is marked as failed instead.
+
+    Args:
+        collection: Frontier collection
+        url: Ad URL
+        reason: Classification of the blocked page
+
+    Returns:
+        bool: False if the URL was marked as failed
+    """
+    now = datetime.now(timezone.utc)
+    result = collection.update_one(
+        {"url": url, "blocked": {"$not": {"$gte": MAX_BLOCKED}}},
+        {
+            "$set": {"state": PENDING, "error": reason, "updated_at": now},
+            "$inc": {"attempts": -1, "blocked": 1},
+            "$unset": {"worker_id": "", "lease_expires_at": ""}
+        }
+    )
+    if result.matched_count:
+        return True
+
+    logger.warning(f"Giving up on {url} after {MAX_BLOCKED} blocked tries")
+    collection.update_one(
+        {"url": url},
+        {
+            "$set": {"state": FAILED, "error": f"Blocked {MAX_BLOCKED} times ({reason})", "updated_at": now},
+            "$unset": {"worker_id": "", "lease_expires_at": ""}
+        }
+    )
+    return False
+
+def get_run_summary(collection: Collection, run_id: str) -> dict:
+    """
+    Count the URLs of a run per state.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+
+    Returns:
+        dict: Number of URLs per state
+    """
+    summary = {PENDING: 0, IN_PROGRESS: 0, DONE: 0, FAILED: 0}
+    pipeline = [
+        {"$match": {"run_id": run_id}},
+        {"$group": {"_id": "$state", "count": {"$sum": 1}}}
+    ]
+    for row in collection.aggregate(pipeline):
+        summary[row["_id"]] = row["count"]
+    return summary
+
+def claim_url(collection: Collection, run_id: str, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> Optional[str]:
+    """
+    Lease the next URL of a run to a worker.
+
+    Pending URLs are handed out first; URLs whose lease has expired, because
+    their worker crashed or hung, are handed out again. The update is a
+    single find_one_and_update, so two workers never get the same URL.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+        worker_id: ID of the claiming worker
+        lease_seconds: Lease duration
+
+    Returns:
+        Optional[str]: Claimed URL or None if there is nothing left to claim
+    """
+    # Lease deadlines are in UTC; workers on other machines compare them
+    # with their own clocks
+    now = datetime.now(timezone.utc)
+    update = {"$set": {
+        "state": IN_PROGRESS,
+        "worker_id": worker_id,
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+        "updated_at": now
+    }}
+
+    doc = collection.find_one_and_update(
+        {"run_id": run_id, "state": PENDING},
+        update,
+        projection={"url": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc is None:
+        doc = collection.find_one_and_update(
+            {
+                "run_id": run_id,
+                "state": IN_PROGRESS,
+                "lease_expires_at": {"$lt": now},
+                "attempts": {"$lt": MAX_ATTEMPTS}
+            },
+            update,
+            projection={"url": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is not None:
+            logger.info(f"Reclaimed expired lease on {doc['url']}")
+
+    return doc["url"] if doc else None
+
+def renew_leases(collection: Collection, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> int:
+    """
+    Extend the leases of every URL a worker is still working on.
+
+    Called periodically by a heartbeat, so URLs waiting in a save batch keep
+    their lease too.
+
+    Args:
+        collection: Frontier collection
+        worker_id: Worker ID
+        lease_seconds: Lease duration from now
+
+    Returns:
+        int: Number of leases renewed
+    """
+    now = datetime.now(timezone.utc)
+    result = collection.update_many(
+        {"worker_id": worker_id, "state": IN_PROGRESS},
+        {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}}
+    )
+    return result.modified_count
+
+def expire_exhausted(collection: Collection, run_id: str) -> int:
+    """
+    Mark URLs whose lease expired too often as failed, so the run can finish.
+
+    Args:
+        collection: Frontier collection
+        run_id: Run ID
+
+    Returns:
+        int: Number of URLs marked as failed
+    """
+    now = datetime.now(timezone.utc)
+    result = collection.update_many(
+        {
+            "run_id": run_id,
+            "state": IN_PROGRESS,
+            "lease_expires_at": {"$lt": now},
+            "attempts": {"$gte": MAX_ATTEMPTS}
+        },
+        {"$set": {"state": FAILED, "error": "Lease expired too many times", "updated_at": now}}
+    )
+    return result.modified_count
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Offline geocoding of ad locations with a Swedish locality gazetteer.
+swedish_localities.csv lists the counties and the main localities of
+every municipality with their coordinates. The gazetteer is held in a
+compact in-memory index: coordinates in float arrays, names in a dict
+and a trigram index for misspelled names. geocode() resolves the
+city/region of an ad to a point for the `coordinates` geo_point field of
+the Elasticsearch index, so distance filters and sorting run inside a
+single query. Run this module with `backfill` to geocode stored ads.
+"""
+
+import os
+import csv
+import logging
+from array import array
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from taxonomy import tokenize
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', os.path.join(ROOT, 'swedish_localities.csv'))
+
+# Precision of a resolved point
+LOCALITY = "locality"
+COUNTY = "county"
+
+# Words that do not tell places apart, e.g. "Stockholms län"
+STOP_WORDS = {"lan", "kommun", "stad", "centrum"}
+
+# Share of its trigrams a misspelled name must have in common with a
+# gazetteer name, and the edit distance allowed per character
+MIN_TRIGRAM_OVERLAP = 0.4
+MAX_EDITS_PER_CHAR = 0.2
+
+def normalize_place(name: str) -> str:
+    """
+    Normalize a place name, e.g. "Västra Götalands län" -> "vastra gotalands".
+
+    Args:
+        name: Place name
+
+    Returns:
+        str: Lowercase name without accents and stop words
+    """
+    return " ".join(word for word in tokenize(name) if word not in STOP_WORDS)
+
+def _trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    # Optimal string alignment distance, giving up once it exceeds limit.
+    # Swapped neighbouring letters, the most common typo, count as one edit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+class Gazetteer:
+    """
+    In-memory index of Swedish counties and localities.
+    """
+
+    def __init__(self, path: str = GAZETTEER_PATH):
+        """
+        Args:
+            path: Path of the gazetteer CSV
+        """
+        self.names: List[str] = []
+        self.counties: List[str] = []
+        self.lat = array("f")
+        self.lon = array("f")
+        self.population = array("l")
+        self.county_of = array("H")
+
+        self._localities: Dict[str, List[int]] = {}
+        self._county_rows: Dict[str, int] = {}
+        self._trigrams: Dict[str, List[str]] = {}
+
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+        for row in rows:
+            if row["county"] not in self.counties:
+                self.counties.append(row["county"])
+
+        for row in rows:
+            index = len(self.names)
+            self.names.append(row["name"])
+            self.lat.append(float(row["lat"]))
+            self.lon.append(float(row["lon"]))
+            self.population.append(int(row["population"] or 0))
+            self.county_of.append(self.counties.index(row["county"]))
+
+            target = self._county_rows if row["kind"] == COUNTY else self._localities
+            for name in [row["name"]] + [alias for alias in row["aliases"].split("|") if alias]:
+                key = normalize_place(name)
+                if row["kind"] == COUNTY:
+                    target.setdefault(key, index)
+                else:
+                    target.setdefault(key, []).append(index)
+
+        for key in list(self._localities) + list(self._county_rows):
+            for trigram in _trigrams(key):
+                self._trigrams.setdefault(trigram, []).append(key)
+
+        logger.info(f"Loaded gazetteer with {len(self._localities)} locality and {len(self._county_rows)} county names")
+
+    def _fuzzy_key(self, key: str, candidates) -> Optional[str]:
+        # Names sharing enough trigrams with the key, closest first
+        counts: Dict[str, int] = {}
+        for trigram in _trigrams(key):
+            for name in self._trigrams.get(trigram, ()):
+                if name in candidates:
+                    counts[name] = counts.get(name, 0) + 1
+
+        limit = max(1, int(len(key) * MAX_EDITS_PER_CHAR))
+        best = None
+        for name, shared in counts.items():
+            if shared < MIN_TRIGRAM_OVERLAP * len(_trigrams(name)):
+                continue
+            distance = _edit_distance(key, name, limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, name)
+        return best[1] if best else None
+
+    def find_county(self, name: str) -> Optional[int]:
+        """
+        Find the row of a county, allowing for genitive forms and typos.
+
+        Args:
+            name: County name, e.g. "Skåne" or "Västra Götalands län"
+
+        Returns:
+            Optional[int]: Row index or None if unknown
+        """
+        key = normalize_place(name)
+        if not key:
+            return None
+        for candidate in (key, key[:-1] if key.endswith("s") else None):
+            if candidate and candidate in self._county_rows:
+                return self._county_rows[candidate]
+        fuzzy = self._fuzzy_key(key, self._county_rows)
+        return self._county_rows[fuzzy] if fuzzy else None
+
+    def find_locality(self, name: str, county: Optional[int] = None) -> Optional[int]:
+        """
+        Find the row of a locality, allowing for typos.
+
+        Args:
+            name: Locality or municipality name
+            county: Row of the county; only localities in it are matched
+
+        Returns:
+            Optional[int]: Row index or None if unknown, or not in the
+                county
+        """
+        key = normalize_place(name)
+        if not key:
+            return None
+        rows = self._localities.get(key)
+        if rows is None:
+            fuzzy = self._fuzzy_key(key, self._localities)
+            if fuzzy is None:
+                return None
+            rows = self._localities[fuzzy]
+
+        if county is not None:
+            # A close name elsewhere in Sweden is a worse guess than the
+            # centre of the county the ad is in
+            rows = [row for row in rows if self.county_of[row] == self.county_of[county]]
+            if not rows:
+                return None
+        return max(rows, key=lambda row: self.population[row])
+
+    def point(self, row: int) -> Dict[str, float]:
+        """
+        Get the coordinates of a row as an Elasticsearch geo_point.
+        """
+        return {"lat": round(self.lat[row], 4), "lon": round(self.lon[row], 4)}
+
+_gazetteer: Optional[Gazetteer] = None
+
+def get_gazetteer() -> Gazetteer:
+    """
+    Get the gazetteer, loading it on first use.
+
+    Returns:
+        Gazetteer: Shared gazetteer
+    """
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer()
+    return _gazetteer
+
+@lru_cache(maxsize=4096)
+def _geocode(city: str, region: str) -> Optional[Tuple[float, float, str, str]]:
+    gazetteer = get_gazetteer()
+    county = gazetteer.find_county(region) if region else None
+
+    row = gazetteer.find_locality(city, county) if city else None
+    if row is None and city and county is None:
+        # Blocket shows a county alone in the city position of some ads
+        county = gazetteer.find_county(city)
+    if row is not None:
+        precision = LOCALITY
+    elif county is not None:
+        row, precision = county, COUNTY
+    else:
+        return None
+
+    point = gazetteer.point(row)
+    return point["lat"], point["lon"], precision, gazetteer.counties[gazetteer.county_of[row]]
+
+def geocode(city: Optional[str], region: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Resolve the city and region of an ad to coordinates.
+
+    Lookups are memoised; ads come from a few hundred places.
+
+    Args:
+        city: City as shown on the ad, e.g. "Göteborg"
+        region: Region as shown on the ad, e.g. "Västra Götaland"
+
+    Returns:
+        Optional[Dict[str, Any]]: "coordinates" (lat/lon), "geo_precision"
+            (locality or county) and "county", or None if unknown
+    """
+    result = _geocode((city or "").strip(), (region or "").strip())
+    if result is None:
+        return None
+    lat, lon, precision, county = result
+    return {"coordinates": {"lat": lat, "lon": lon}, "geo_precision": precision, "county": county}
+
+def backfill(collection: Collection, batch_size: int = 1000, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Geocode the stored ads that have no coordinates yet.
+
+    Args:
+        collection: Car ads collection
+        batch_size: Number of updates per bulk write
+        dry_run: Count the ads without writing them
+
+    Returns:
+        Dict[str, int]: Statistics about the backfill
+    """
+    stats = {"ads": 0, "geocoded": 0, "unresolved": 0}
+    operations = []
+    query = {"coordinates": {"$exists": False}}
+    for doc in collection.find(query, {"_id": 0, "url": 1, "city": 1, "region": 1}):
+        stats["ads"] += 1
+        geo = geocode(doc.get("city"), doc.get("region"))
+        if geo is None:
+            stats["unresolved"] += 1
+            continue
+
+        stats["geocoded"] += 1
+        operations.append(UpdateOne({"url": doc["url"]}, {"$set": {**geo, "indexed": False}}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations and not dry_run:
+        collection.bulk_write(operations, ordered=False)
+
+    logger.info(f"Geocoding backfill: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+
+    from mongodb import get_mongodb_connection
+
+    parser = argparse.ArgumentParser(description="Offline geocoding of ad locations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    lookup_parser = subparsers.add_parser("lookup", help="Geocode a place")
+    lookup_parser.add_argument("city")
+    lookup_parser.add_argument("region", nargs="?")
+    backfill_parser = subparsers.add_parser("backfill", help="Geocode stored ads without coordinates")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="Count ads without writing them")
+    args = parser.parse_args()
+
+    if args.command == "lookup":
+        print(geocode(args.city, args.region) or "Unknown place")
+    else:
+        client, db, collection = get_mongodb_connection()
+        if client is None:
+            raise SystemExit("Failed to connect to MongoDB")
+        try:
+            print(f"Backfill results: {backfill(collection, dry_run=args.dry_run)}")
+        finally:
+            client.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Post-download processing of ad images.
+Each downloaded file is stored once under the SHA-256 of its content, gets
+resized WebP variants for the frontend and a perceptual hash (dHash) that
+survives re-encoding and resizing, for finding reused photos across ads.
+The functions here run in worker processes; see ImageDownloadQueue.
+"""
+
+import os
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Root of the content-addressed image store
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'images/store')
+
+# Variant name -> maximum (width, height); aspect ratio is kept
+IMAGE_VARIANTS = {
+    "thumb": (320, 240),
+    "medium": (960, 720),
+}
+
+# WebP quality of the variants
+WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+
+# File extensions of the stored originals by Pillow format
+ORIGINAL_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+
+def content_hash(path: str) -> str:
+    """
+    Compute the SHA-256 of a file.
+
+    Args:
+        path: File path
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def stored_path(digest: str, suffix: str) -> str:
+    """
+    Get the path of a file in the content-addressed store.
+
+    Files are spread over two directory levels so no directory gets too big.
+
+    Args:
+        digest: SHA-256 of the original image
+        suffix: File name suffix, e.g. ".jpg" or "_thumb.webp"
+
+    Returns:
+        str: File path
+    """
+    return os.path.join(IMAGE_STORE_DIR, digest[:2], digest[2:4], f"{digest}{suffix}")
+
+def dhash(image: Image.Image, hash_size: int = 8) -> str:
+    """
+    Compute the difference hash of an image.
+
+    The image is shrunk to (hash_size + 1) x hash_size grey pixels and every
+    bit records whether a pixel is brighter than its right neighbour.
+    Near-identical photos differ in only a few bits.
+
+    Args:
+        image: Image
+        hash_size: Number of bits per row and of rows
+
+    Returns:
+        str: Hash as a hex string (16 characters for the default size)
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """
+    Count the differing bits of two hex hashes.
+    """
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+def process_image(download_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Move a downloaded image into the store and create its variants.
+
+    If an identical file is already stored, the download is discarded and
+    the existing files are reused. Runs in a worker process.
+
+    Args:
+        download_path: Path of the freshly downloaded file
+
+    Returns:
+        Optional[Dict[str, Any]]: Image metadata (content_hash, phash, width,
+            height and variants paths) or None if the file is not an image
+    """
+    try:
+        digest = content_hash(download_path)
+
+        with Image.open(download_path) as image:
+            image.load()
+            extension = ORIGINAL_EXTENSIONS.get(image.format, "img")
+            original_path = stored_path(digest, f".{extension}")
+            variants = {"original": original_path}
+
+            Path(original_path).parent.mkdir(parents=True, exist_ok=True)
+            if os.path.exists(original_path):
+                os.remove(download_path)
+            else:
+                os.replace(download_path, original_path)
+
+            rgb = image.convert("RGB")
+            for name, size in IMAGE_VARIANTS.items():
+                variant_path = stored_path(digest, f"_{name}.webp")
+                if not os.path.exists(variant_path):
+                    variant = rgb.copy()
+                    variant.thumbnail(size, Image.Resampling.LANCZOS)
+                    variant.save(variant_path, "WEBP", quality=WEBP_QUALITY, method=4)
+                variants[name] = variant_path
+
+            return {
+                "content_hash": digest,
+                "phash": dhash(image),
+                "width": image.width,
+                "height": image.height,
+                "variants": variants,
+            }
+    except Exception as e:
+        logger.error(f"Error processing image {download_path}: {str(e)}")
+        if os.path.exists(download_path):
+            os.remove(download_path)
+        return None
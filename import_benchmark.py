@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cold-start import benchmark for the API handlers.
+Every measurement runs in a fresh interpreter, the way a serverless cold
+start does, and times the imports of one request path of /api/scrape.
+Exits with status 1 when a slim path exceeds its budget.
+"""
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Cold-start budget of the paths that must not load the scraper
+BUDGET_MS = float(os.getenv('COLD_START_BUDGET_MS', 300))
+
+# Path name -> (modules imported, checked against the budget); a CORS
+# preflight or health check needs nothing beyond the handler module itself
+PATHS = {
+    "preflight": (["api.scrape"], True),
+    "health": (["api.scrape"], True),
+    "status": (["api.scrape", "mongodb", "frontier"], True),
+    "enqueue": (["api.scrape", "mongodb", "jobs"], True),
+    "scrape": (["api.scrape", "scraper"], False),
+}
+
+_SNIPPET = """
+import sys, time, json, importlib, importlib.util
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+for name in {modules!r}:
+    if name == "api.scrape":
+        spec = importlib.util.spec_from_file_location("api_scrape", {handler!r})
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    else:
+        importlib.import_module(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "selenium": "selenium" in sys.modules}}))
+"""
+
+def measure(modules: List[str], runs: int = 5) -> Dict[str, float]:
+    """
+    Time importing modules in fresh interpreters.
+
+    Args:
+        modules: Modules to import, in order
+        runs: Number of interpreters to start
+
+    Returns:
+        Dict[str, float]: Median and maximum milliseconds and whether
+            Selenium got imported
+    """
+    code = _SNIPPET.format(root=ROOT, modules=modules, handler=os.path.join(ROOT, "api", "scrape.py"))
+    timings = []
+    selenium = False
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        selenium = selenium or result["selenium"]
+
+    return {"median_ms": round(statistics.median(timings), 1), "max_ms": round(max(timings), 1), "selenium": selenium}
+
+def top_imports(modules: List[str], limit: int = 15) -> List[str]:
+    """
+    List the slowest imports of a path with `python -X importtime`.
+
+    Args:
+        modules: Modules to import
+        limit: Number of lines to return
+
+    Returns:
+        List[str]: importtime lines, slowest cumulative time first
+    """
+    code = _SNIPPET.format(root=ROOT, modules=modules, handler=os.path.join(ROOT, "api", "scrape.py"))
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True).stderr
+    rows = [line for line in stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    rows = [row for row in rows if row.split("|")[1].strip().isdigit()]
+    return sorted(rows, key=lambda row: -int(row.split("|")[1]))[:limit]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the cold-start imports of /api/scrape")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per path")
+    parser.add_argument("--path", choices=sorted(PATHS), help="Only measure this path")
+    parser.add_argument("--importtime", action="store_true", help="Show the slowest imports of each path")
+    args = parser.parse_args()
+
+    over_budget = []
+    for name, (modules, budgeted) in PATHS.items():
+        if args.path and name != args.path:
+            continue
+
+        result = measure(modules, args.runs)
+        status = ""
+        if budgeted:
+            status = "ok" if result["median_ms"] <= BUDGET_MS and not result["selenium"] else "OVER BUDGET"
+            if status != "ok":
+                over_budget.append(name)
+        print(f"{name:9} median {result['median_ms']:8.1f} ms  max {result['max_ms']:8.1f} ms  "
+              f"selenium={'yes' if result['selenium'] else 'no '}  {status}")
+
+        if args.importtime:
+            for line in top_imports(modules):
+                print(f"    {line}")
+
+    if over_budget:
+        print(f"Over the {BUDGET_MS:.0f} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
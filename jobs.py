@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Queue of requested scrape jobs.
+The /api/scrape handler can enqueue a job instead of scraping in the
+request; `python distributed.py serve-jobs` picks the jobs up, publishes a
+run for each and waits for the workers to finish it.
+"""
+
+import os
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+def get_jobs_collection(database: Database) -> Collection:
+    """
+    Get the scrape job collection.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Job collection
+    """
+    collection = database[os.getenv('SCRAPE_JOBS_COLLECTION_NAME', 'scrape_jobs')]
+    collection.create_index([("state", ASCENDING), ("created_at", ASCENDING)])
+    return collection
+
+def enqueue_job(collection: Collection, resume: bool = False) -> str:
+    """
+    Request a scrape.
+
+    Args:
+        collection: Job collection
+        resume: Continue the last unfinished run instead of starting a new one
+
+    Returns:
+        str: Job ID
+    """
+    result = collection.insert_one({"state": QUEUED, "resume": resume, "created_at": datetime.now()})
+    logger.info(f"Enqueued scrape job {result.inserted_id}")
+    return str(result.inserted_id)
+
+def claim_job(collection: Collection, worker_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Take the oldest queued job.
+
+    Args:
+        collection: Job collection
+        worker_id: ID of the process taking the job
+
+    Returns:
+        Optional[Dict[str, Any]]: Job or None if the queue is empty
+    """
+    return collection.find_one_and_update(
+        {"state": QUEUED},
+        {"$set": {"state": RUNNING, "worker_id": worker_id, "started_at": datetime.now()}},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def finish_job(collection: Collection, job_id: Any, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    """
+    Record the outcome of a job.
+
+    Args:
+        collection: Job collection
+        job_id: Job ID
+        result: Run statistics
+        error: Error message if the job failed
+    """
+    collection.update_one(
+        {"_id": ObjectId(job_id) if isinstance(job_id, str) else job_id},
+        {"$set": {
+            "state": FAILED if error else FINISHED,
+            "result": result,
+            "error": error,
+            "finished_at": datetime.now()
+        }}
+    )
+
+def get_job(collection: Collection, job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a job.
+
+    Args:
+        collection: Job collection
+        job_id: Job ID
+
+    Returns:
+        Optional[Dict[str, Any]]: Job or None if unknown
+    """
+    try:
+        return collection.find_one({"_id": ObjectId(job_id)})
+    except Exception:
+        return None
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Load test for the non-scrape endpoints of the local /api/scrape server.
+Sends requests to the health, preflight and (with MongoDB) status paths
+from many threads and reports requests per second and latency
+percentiles per path. Idle connections can be held open during the test,
+the way a slow client or a running scrape holds one, to check that they
+do not stall the other requests. Without --url the server of
+api/scrape.py is started in this process on a free port.
+Exits with status 1 when a request fails or p99 exceeds --p99-budget-ms.
+"""
+
+import os
+import sys
+import time
+import socket
+import statistics
+import threading
+import http.client
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Path name -> (method, path); status needs MongoDB
+ENDPOINTS = {
+    "health": ("GET", "/api/scrape/health"),
+    "preflight": ("OPTIONS", "/api/scrape"),
+    "status": ("GET", "/api/scrape?status=1"),
+}
+
+def start_local_server() -> Tuple[Any, str]:
+    """
+    Start the server of api/scrape.py on a free port in a background thread.
+
+    Returns:
+        Tuple[Any, str]: Server and its base URL
+    """
+    spec = importlib.util.spec_from_file_location("api_scrape", os.path.join(ROOT, "api", "scrape.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    class QuietHandler(module.Handler):
+        def log_message(self, format, *args):
+            pass
+
+    server = module.ScrapeServer(("127.0.0.1", 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def _request(host: str, port: int, method: str, path: str, timeout: float) -> Tuple[float, Optional[str]]:
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request(method, path)
+        response = connection.getresponse()
+        response.read()
+        error = None if response.status < 400 else f"HTTP {response.status}"
+    except (OSError, http.client.HTTPException) as e:
+        error = type(e).__name__
+    finally:
+        connection.close()
+    return time.perf_counter() - started, error
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def run_endpoint(base_url: str, method: str, path: str, requests: int, concurrency: int,
+                 timeout: float = 10.0) -> Dict[str, Any]:
+    """
+    Send requests to one path from `concurrency` threads.
+
+    Args:
+        base_url: Server URL, e.g. http://localhost:8000
+        method: HTTP method
+        path: Path and query
+        requests: Number of requests
+        concurrency: Number of requests in flight
+        timeout: Seconds before a request fails
+
+    Returns:
+        Dict[str, Any]: Requests per second, latency percentiles in ms and
+            errors
+    """
+    url = urlparse(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: _request(url.hostname, url.port or 80, method, path, timeout), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = [error for _, error in results if error]
+    return {
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p90_ms": round(_percentile(latencies, 0.9), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+        "max_ms": round(max(latencies), 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+def open_idle_connections(base_url: str, count: int) -> List[socket.socket]:
+    """
+    Open connections that send part of a request line and then stall.
+    """
+    url = urlparse(base_url)
+    sockets = []
+    for _ in range(count):
+        sock = socket.create_connection((url.hostname, url.port or 80))
+        sock.sendall(b"GET /api/scrape/health")
+        sockets.append(sock)
+    return sockets
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test the non-scrape endpoints of /api/scrape")
+    parser.add_argument("--url", help="Server to test; a local server is started when omitted")
+    parser.add_argument("--endpoints", default="health,preflight",
+                        help=f"Comma-separated paths out of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per path")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight")
+    parser.add_argument("--idle-connections", type=int, default=4,
+                        help="Stalled connections held open during the test")
+    parser.add_argument("--p99-budget-ms", type=float, help="Fail when a path's p99 latency is higher")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_local_server()
+
+    idle = open_idle_connections(base_url, args.idle_connections)
+    failed = []
+    try:
+        print(f"{args.concurrency} concurrent clients, {len(idle)} stalled connections, {base_url}")
+        for name in args.endpoints.split(","):
+            method, path = ENDPOINTS[name.strip()]
+            result = run_endpoint(base_url, method, path, args.requests, args.concurrency)
+            print(f"{name:9} {result['requests_per_second']:8.1f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+                  f"p90 {result['p90_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  max {result['max_ms']:7.2f} ms  "
+                  f"errors {result['errors']}" + (f" ({result['first_error']})" if result["errors"] else ""))
+            if result["errors"] or (args.p99_budget_ms and result["p99_ms"] > args.p99_budget_ms):
+                failed.append(name)
+    finally:
+        for sock in idle:
+            sock.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Precomputed market statistics per make/model/year/fuel type segment.
+Each segment document holds counts, sums and quantile sketches that are
+updated with $inc from every save_to_mongo batch, so median prices and
+percentiles are read with a single document lookup instead of aggregating
+the whole collection.
+
+The sketches are logarithmic histograms: a value x is counted in bucket
+ceil(log_gamma(x)), which keeps every quantile within SKETCH_RELATIVE_ACCURACY
+of the true value. Sketches merge by adding bucket counts, which is what
+makes the $inc updates and the wildcard segments possible.
+"""
+
+import os
+import math
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Relative accuracy of the quantiles
+SKETCH_RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# Fields of an ad that determine its contribution to the rollups
+CONTRIBUTION_FIELDS = ["make", "model", "year", "fuel_type", "price", "mileage", "active"]
+
+# Segment levels; "*" matches every value
+ANY = "*"
+
+# Quantiles reported by get_segment_stats()
+REPORTED_QUANTILES = {"p25": 0.25, "median": 0.5, "p75": 0.75, "p90": 0.9}
+
+def get_rollups_collection(database: Database) -> Collection:
+    """
+    Get the market statistics collection.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Rollup collection
+    """
+    return database[os.getenv('MARKET_STATS_COLLECTION_NAME', 'market_stats')]
+
+def sketch_bucket(value: float) -> str:
+    """
+    Get the sketch bucket of a positive value.
+
+    Args:
+        value: Value to count
+
+    Returns:
+        str: Bucket index, as used in the stored sketch documents
+    """
+    return str(math.ceil(math.log(value) / _LOG_GAMMA))
+
+def sketch_quantile(sketch: Dict[str, int], quantile: float) -> Optional[float]:
+    """
+    Estimate a quantile from a sketch.
+
+    Args:
+        sketch: Bucket counts
+        quantile: Quantile between 0 and 1
+
+    Returns:
+        Optional[float]: Estimated value or None for an empty sketch
+    """
+    buckets = sorted((int(index), count) for index, count in sketch.items() if count > 0)
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+
+    rank = quantile * (total - 1)
+    seen = 0
+    for index, count in buckets:
+        seen += count
+        if seen > rank:
+            # Midpoint of the bucket (gamma^(i-1), gamma^i]
+            return 2 * _GAMMA ** index / (_GAMMA + 1)
+    return 2 * _GAMMA ** buckets[-1][0] / (_GAMMA + 1)
+
+def merge_sketches(*sketches: Dict[str, int]) -> Dict[str, int]:
+    """
+    Merge sketches by adding their bucket counts.
+    """
+    merged = defaultdict(int)
+    for sketch in sketches:
+        for index, count in sketch.items():
+            merged[index] += count
+    return dict(merged)
+
+def segment_keys(make: str, model: str, year: Any, fuel_type: str) -> List[Tuple[str, str, str, str]]:
+    """
+    Get the segments an ad counts in, from make level down to fuel type.
+    """
+    return [
+        (make, ANY, ANY, ANY),
+        (make, model, ANY, ANY),
+        (make, model, year, ANY),
+        (make, model, year, fuel_type),
+    ]
+
+def segment_id(make: str, model: str = ANY, year: Any = ANY, fuel_type: str = ANY) -> str:
+    """
+    Get the document ID of a segment.
+    """
+    return "|".join(str(part).lower() for part in (make, model, year, fuel_type))
+
+def _contribution(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Get what an ad adds to the rollups, or None if it is not counted.
+    """
+    if not doc or doc.get("active") is False or not doc.get("make") or not doc.get("price"):
+        return None
+
+    contribution = {
+        "segment": (doc["make"], doc.get("model") or ANY, doc.get("year") or ANY, doc.get("fuel_type") or ANY),
+        "price": doc["price"],
+        "price_bucket": sketch_bucket(doc["price"]),
+        "price_per_mil_bucket": None,
+    }
+    if doc.get("mileage"):
+        contribution["price_per_mil_bucket"] = sketch_bucket(doc["price"] / doc["mileage"])
+    return contribution
+
+def _add(increments: Dict[str, Dict[str, float]], contribution: Dict[str, Any], sign: int) -> None:
+    for key in segment_keys(*contribution["segment"]):
+        inc = increments[segment_id(*key)]
+        inc["count"] = inc.get("count", 0) + sign
+        inc["price_sum"] = inc.get("price_sum", 0) + sign * contribution["price"]
+
+        field = f"price_sketch.{contribution['price_bucket']}"
+        inc[field] = inc.get(field, 0) + sign
+
+        if contribution["price_per_mil_bucket"] is not None:
+            field = f"price_per_mil_sketch.{contribution['price_per_mil_bucket']}"
+            inc[field] = inc.get(field, 0) + sign
+
+def _write(database: Database, increments: Dict[str, Dict[str, float]]) -> int:
+    operations = []
+    now = datetime.now()
+    for seg_id, inc in increments.items():
+        inc = {field: value for field, value in inc.items() if value}
+        if not inc:
+            continue
+
+        make, model, year, fuel_type = seg_id.split("|")
+        operations.append(UpdateOne(
+            {"_id": seg_id},
+            {
+                "$inc": inc,
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"make": make, "model": model, "year": year, "fuel_type": fuel_type}
+            },
+            upsert=True
+        ))
+
+    if operations:
+        get_rollups_collection(database).bulk_write(operations, ordered=False)
+    return len(operations)
+
+def update_rollups(database: Database, ads: List[Dict[str, Any]], previous: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Update the rollups with a batch of saved ads.
+
+    The stored state of each ad is taken out of its old segment and the new
+    state is added, so price changes, re-parsed make/model fields and
+    reactivated ads are all counted correctly.
+
+    Args:
+        database: MongoDB database
+        ads: Car ads that were saved
+        previous: Stored values by ad URL, loaded before the save with at
+            least CONTRIBUTION_FIELDS
+
+    Returns:
+        int: Number of segment documents updated
+    """
+    increments = defaultdict(dict)
+
+    for ad in ads:
+        old = _contribution(previous.get(ad["url"]))
+        new = _contribution(ad)
+        if old == new:
+            continue
+        if old:
+            _add(increments, old, -1)
+        if new:
+            _add(increments, new, 1)
+
+    return _write(database, increments)
+
+def record_deactivations(database: Database, docs: List[Dict[str, Any]], deactivated_timestamp: int) -> int:
+    """
+    Remove ads that went off the market from the rollups and record how long
+    they were listed.
+
+    Args:
+        database: MongoDB database
+        docs: Stored ads, with CONTRIBUTION_FIELDS and first_seen_timestamp
+        deactivated_timestamp: Unix time of the deactivation
+
+    Returns:
+        int: Number of segment documents updated
+    """
+    increments = defaultdict(dict)
+
+    for doc in docs:
+        contribution = _contribution(doc)
+        if not contribution:
+            continue
+        _add(increments, contribution, -1)
+
+        if doc.get("first_seen_timestamp") is not None:
+            days = max((deactivated_timestamp - doc["first_seen_timestamp"]) / 86400, 1 / 24)
+            for key in segment_keys(*contribution["segment"]):
+                inc = increments[segment_id(*key)]
+                field = f"days_on_market_sketch.{sketch_bucket(days)}"
+                inc[field] = inc.get(field, 0) + 1
+
+    return _write(database, increments)
+
+def get_segment_stats(database: Database, make: str, model: str = ANY, year: Any = ANY, fuel_type: str = ANY) -> Optional[Dict[str, Any]]:
+    """
+    Get the statistics of a segment with a single document lookup.
+
+    Leave model, year or fuel_type out to get the statistics across all
+    values of that field.
+
+    Args:
+        database: MongoDB database
+        make: Car make
+        model: Car model
+        year: Model year
+        fuel_type: Fuel type
+
+    Returns:
+        Optional[Dict[str, Any]]: Active ad count, mean price and quantiles of
+            price, price per mil and days on market, or None if unknown
+    """
+    doc = get_rollups_collection(database).find_one({"_id": segment_id(make, model, year, fuel_type)})
+    if not doc:
+        return None
+
+    def quantiles(sketch):
+        return {name: _round(sketch_quantile(sketch or {}, q)) for name, q in REPORTED_QUANTILES.items()}
+
+    count = doc.get("count", 0)
+    return {
+        "segment": {"make": doc["make"], "model": doc["model"], "year": doc["year"], "fuel_type": doc["fuel_type"]},
+        "active_ads": count,
+        "mean_price": round(doc.get("price_sum", 0) / count) if count else None,
+        "price": quantiles(doc.get("price_sketch")),
+        "price_per_mil": quantiles(doc.get("price_per_mil_sketch")),
+        "days_on_market": quantiles(doc.get("days_on_market_sketch")),
+        "updated_at": doc.get("updated_at"),
+    }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+def rebuild_rollups(collection: Collection, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Recompute all rollups from the stored active ads.
+
+    Days on market cannot be recovered for ads deactivated earlier and
+    starts from zero.
+
+    Args:
+        collection: Car ads collection
+        batch_size: Number of ads per rollup update
+
+    Returns:
+        Dict[str, int]: Statistics about the rebuild
+    """
+    database = collection.database
+    get_rollups_collection(database).delete_many({})
+
+    stats = {"ads": 0, "segment_updates": 0}
+    projection = {"_id": 0, "url": 1, **{field: 1 for field in CONTRIBUTION_FIELDS}}
+    batch = []
+    for doc in collection.find({"active": True}, projection):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            stats["segment_updates"] += update_rollups(database, batch, {})
+            stats["ads"] += len(batch)
+            batch = []
+    if batch:
+        stats["segment_updates"] += update_rollups(database, batch, {})
+        stats["ads"] += len(batch)
+
+    logger.info(f"Rebuilt market statistics: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    from mongodb import get_mongodb_connection
+
+    parser = argparse.ArgumentParser(description="Market statistics per segment")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recompute all rollups from the stored ads")
+    show_parser = subparsers.add_parser("show", help="Show the statistics of a segment")
+    show_parser.add_argument("make")
+    show_parser.add_argument("model", nargs="?", default=ANY)
+    show_parser.add_argument("year", nargs="?", default=ANY)
+    show_parser.add_argument("fuel_type", nargs="?", default=ANY)
+    args = parser.parse_args()
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise SystemExit("Failed to connect to MongoDB")
+
+    try:
+        if args.command == "rebuild":
+            print(f"Rebuild results: {rebuild_rollups(collection)}")
+        else:
+            stats = get_segment_stats(db, args.make, args.model, args.year, args.fuel_type)
+            print(json.dumps(stats, indent=2, default=str) if stats else "Unknown segment")
+    finally:
+        client.close()
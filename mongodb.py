@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+MongoDB connection shared by the scraper, the tools and the API handlers.
+Kept free of Selenium and the other scraping dependencies so lightweight
+entry points can open a connection without importing scraper.py.
+"""
+
+import os
+import logging
+from typing import Optional
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+def get_mongodb_connection() -> tuple[Optional[MongoClient], Optional[Database], Optional[Collection]]:
+    """
+    Establish connection to MongoDB Atlas.
+
+    Returns:
+        tuple: (client, database, collection) or (None, None, None) if connection fails
+    """
+    try:
+        mongodb_uri = os.getenv('MONGODB_URI')
+        db_name = os.getenv('DATABASE_NAME', 'blocket_cars')
+        collection_name = os.getenv('COLLECTION_NAME', 'car_ads')
+
+        if not mongodb_uri:
+            logger.error("MongoDB URI not found in environment variables")
+            return None, None, None
+
+        # Connect to MongoDB with SSL certificate verification disabled
+        # Note: This is not recommended for production use, but helps during development
+        client = MongoClient(
+            mongodb_uri,
+            tlsAllowInvalidCertificates=True,  # Use this instead of ssl_cert_reqs
+            serverSelectionTimeoutMS=5000  # 5 second timeout
+        )
+
+        database = client[db_name]
+        collection = database[collection_name]
+
+        # Test connection
+        client.admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+
+        return client, database, collection
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {str(e)}")
+        return None, None, None
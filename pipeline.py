@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Streaming building blocks for the scrape -> save pipeline.
+Scraped ads are consumed in bounded batches and their images are downloaded
+and processed by background workers fed from a bounded queue, so memory use
+does not grow with the size of the crawl.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from image_processing import IMAGE_STORE_DIR, process_image
+from politeness import get_controller
+
+logger = logging.getLogger(__name__)
+
+# Number of image download threads and maximum number of queued images
+IMAGE_WORKERS = int(os.getenv('IMAGE_DOWNLOAD_WORKERS', 4))
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 200))
+
+# Number of image processing processes
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', os.cpu_count() or 2))
+
+# Fields added to image objects by processing
+PROCESSED_IMAGE_FIELDS = ["content_hash", "phash", "width", "height", "variants"]
+
+# Image processing pool shared by the download queues of this process
+_image_pool: Optional[ProcessPoolExecutor] = None
+_image_pool_lock = threading.Lock()
+
+def get_image_pool(broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+    """
+    Get the image processing pool of this process, starting it on first use.
+
+    Starting worker processes is slow, so the API and job worker processes,
+    which save once per run or job, reuse one pool for all of them.
+
+    Args:
+        broken: A pool that stopped working because one of its processes
+            died; it is replaced if it is still the shared pool
+
+    Returns:
+        ProcessPoolExecutor: Image processing pool
+    """
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None or _image_pool is broken:
+            if _image_pool is not None:
+                _image_pool.shutdown(wait=False)
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS)
+        return _image_pool
+
+def batched(items: Iterable[Any], batch_size: int, max_wait: Optional[float] = None) -> Iterator[List[Any]]:
+    """
+    Group items from an iterable into lists of at most `batch_size` items.
+
+    A batch is also emitted once it has been open for `max_wait` seconds, so
+    slow producers such as the scraper still deliver records promptly.
+
+    Args:
+        items: Items to group
+        batch_size: Maximum number of items per batch
+        max_wait: Maximum age of a batch in seconds, or None for no limit
+
+    Yields:
+        List[Any]: Batch of items
+    """
+    batch = []
+    batch_started = None
+
+    for item in items:
+        if not batch:
+            batch_started = time.monotonic()
+        batch.append(item)
+
+        if len(batch) >= batch_size or (max_wait is not None and time.monotonic() - batch_started >= max_wait):
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+class ImageDownloadQueue:
+    """
+    Download and process ad images in the background.
+
+    Images are handed over through a bounded queue; `enqueue` blocks when the
+    queue is full, which keeps the scraper from running ahead of the downloads.
+    Download threads pass each file to the image processing pool of the
+    process, which stores it by content hash and creates its variants (see
+    image_processing.py), so photos reused across ads are stored and
+    processed once.
+    """
+
+    def __init__(self, collection: Collection, workers: int = IMAGE_WORKERS, max_pending: int = IMAGE_QUEUE_SIZE, pool: Optional[ProcessPoolExecutor] = None):
+        """
+        Start the download workers.
+
+        Args:
+            collection: Car ads collection, used to record processed images
+            workers: Number of download threads
+            max_pending: Maximum number of queued images
+            pool: Image processing pool; the pool of the process
+                (get_image_pool()) when omitted. It is not shut down by
+                close().
+        """
+        self.collection = collection
+        self.assets = get_image_assets_collection(collection.database)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.downloaded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pool = pool or get_image_pool()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"image-download-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def attach_processed(self, ads: List[Dict[str, Any]]) -> None:
+        """
+        Copy the results of earlier processing onto the image objects of ads.
+
+        Scraped image objects only have a URL; without this, every re-scrape
+        would overwrite the stored variants and download the image again.
+
+        Args:
+            ads: Car ads about to be saved
+        """
+        urls = [img["url"] for ad in ads for img in ad.get("images") or [] if img.get("url")]
+        if not urls:
+            return
+
+        known = {asset["url"]: asset for asset in self.assets.find({"url": {"$in": urls}}, {"_id": 0})}
+        for ad in ads:
+            for img in ad.get("images") or []:
+                asset = known.get(img.get("url"))
+                if asset:
+                    img.update({field: asset[field] for field in PROCESSED_IMAGE_FIELDS if field in asset})
+                    img["downloaded"] = True
+
+    def enqueue(self, ad: Dict[str, Any]) -> None:
+        """
+        Queue the images of an ad that have not been processed yet.
+
+        Args:
+            ad: Car ad details
+        """
+        for img in ad.get("images") or []:
+            if img.get("url") and not img.get("content_hash"):
+                self.queue.put((ad["url"], img["url"]))
+
+    def close(self) -> None:
+        """
+        Wait for all queued images to be processed and stop the download
+        workers.
+        """
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        logger.info(f"Image downloads finished: {self.downloaded} downloaded, {self.failed} failed")
+
+    def _worker(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+
+            ad_url, img_url = task
+            if self._download(ad_url, img_url):
+                with self._lock:
+                    self.downloaded += 1
+            else:
+                with self._lock:
+                    self.failed += 1
+
+    def _download(self, ad_url: str, img_url: str) -> bool:
+        try:
+            # Another ad may already have brought in the same image
+            asset = self.assets.find_one({"url": img_url}, {"_id": 0})
+
+            if asset is None:
+                download_dir = Path(IMAGE_STORE_DIR) / "tmp"
+                download_dir.mkdir(parents=True, exist_ok=True)
+                download_path = str(download_dir / uuid.uuid4().hex)
+
+                # Download the image; the host's controller decides how
+                # many of the download threads may fetch at once
+                with get_controller(urlparse(img_url).netloc).slot() as request:
+                    response = requests.get(img_url, stream=True, timeout=10)
+                    request.mark(status=response.status_code)
+                    if response.status_code != 200:
+                        logger.warning(f"Failed to download image {img_url}: HTTP {response.status_code}")
+                        return False
+
+                    with open(download_path, 'wb') as f:
+                        for chunk in response.iter_content(65536):
+                            f.write(chunk)
+
+                # Hash, store and resize in a worker process
+                try:
+                    processed = self._pool.submit(process_image, download_path).result()
+                except BrokenProcessPool:
+                    # A worker process died; the next images go to a new pool
+                    self._pool = get_image_pool(broken=self._pool)
+                    raise
+                if processed is None:
+                    return False
+
+                asset = {"url": img_url, **processed}
+                self.assets.update_one({"url": img_url}, {"$set": asset}, upsert=True)
+                logger.info(f"Stored image {img_url} as {processed['content_hash'][:12]}")
+
+            # Update the image in MongoDB
+            self.collection.update_one(
+                {"url": ad_url},
+                {"$set": {
+                    "images.$[elem].downloaded": True,
+                    **{f"images.$[elem].{field}": asset[field] for field in PROCESSED_IMAGE_FIELDS if field in asset}
+                }},
+                array_filters=[{"elem.url": img_url}]
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error downloading image {img_url}: {str(e)}")
+            return False
+
+def get_image_assets_collection(database: Database) -> Collection:
+    """
+    Get the collection of processed images, keyed by image URL.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Image asset collection
+    """
+    collection = database[os.getenv('IMAGE_ASSETS_COLLECTION_NAME', 'image_assets')]
+    collection.create_index("url", unique=True)
+    collection.create_index("content_hash")
+    collection.create_index("phash")
+    return collection
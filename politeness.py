@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Adaptive request pacing shared by all fetchers of a host.
+A PolitenessController limits how many requests to a host are in flight
+and how far apart they start. It follows AIMD: while the p95 latency and
+the share of blocked responses (HTTP 429/403/503, captcha pages) stay
+under their targets the limit grows by one request and the delay shrinks
+by a step; when either target is missed the limit is halved and the delay
+doubled. snapshot() exposes the state for the run statistics.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bounds and starting point of the pause between request starts, in seconds
+MIN_DELAY = float(os.getenv('POLITENESS_MIN_DELAY', 0.5))
+MAX_DELAY = float(os.getenv('POLITENESS_MAX_DELAY', 30))
+INITIAL_DELAY = float(os.getenv('POLITENESS_INITIAL_DELAY', 2))
+DELAY_STEP = float(os.getenv('POLITENESS_DELAY_STEP', 0.25))
+
+# Upper bound of concurrent requests per host
+MAX_CONCURRENCY = int(os.getenv('POLITENESS_MAX_CONCURRENCY', 8))
+
+# Back off when p95 latency (seconds) or the blocked share exceed these
+P95_TARGET = float(os.getenv('POLITENESS_P95_TARGET', 5.0))
+ERROR_TARGET = float(os.getenv('POLITENESS_ERROR_TARGET', 0.05))
+
+# Number of recent requests the targets are measured over, and how many
+# requests pass between two increases
+WINDOW = int(os.getenv('POLITENESS_WINDOW', 50))
+ADJUST_EVERY = 10
+
+# HTTP statuses that mean the site wants us to slow down
+BLOCKED_STATUSES = {403, 429, 503}
+
+class Request:
+    """
+    Outcome of one request made in a controller slot.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.blocked = False
+
+    def mark(self, status: Optional[int] = None, blocked: bool = False) -> None:
+        """
+        Record the response of the request.
+
+        Args:
+            status: HTTP status, if known
+            blocked: Whether the response was a block or captcha page
+        """
+        self.status = status
+        self.blocked = blocked or status in BLOCKED_STATUSES
+
+class PolitenessController:
+    """
+    AIMD controller of the request rate to one host.
+    """
+
+    def __init__(self, name: str, initial_delay: float = INITIAL_DELAY, max_concurrency: int = MAX_CONCURRENCY):
+        """
+        Args:
+            name: Host or other name the controller is shared under
+            initial_delay: Starting pause between request starts
+            max_concurrency: Upper bound of concurrent requests
+        """
+        self.name = name
+        self.limit = 1.0
+        self.delay = initial_delay
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.requests = 0
+        self.blocked = 0
+        self.increases = 0
+        self.decreases = 0
+
+        self._cond = threading.Condition()
+        self._next_start = 0.0
+        self._latencies = deque(maxlen=WINDOW)
+        self._outcomes = deque(maxlen=WINDOW)
+        self._since_adjust = 0
+        self._since_decrease = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[Request]:
+        """
+        Wait for a free slot and the pacing delay, then time the request.
+
+        Call mark() on the yielded Request with the response status or
+        block detection; an exception inside the block counts as an error.
+
+        Yields:
+            Request: Outcome holder
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            # Requests of all slots together start `delay` apart on average
+            self._next_start = start + self.delay / self.limit * random.uniform(0.8, 1.2)
+
+        if start > now:
+            time.sleep(start - now)
+
+        request = Request()
+        started = time.monotonic()
+        failed = False
+        try:
+            yield request
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(time.monotonic() - started, request.blocked or failed)
+
+    def wait(self) -> None:
+        """
+        Pause for the current delay, for waits between actions on a page.
+        """
+        time.sleep(self.delay * random.uniform(0.8, 1.2))
+
+    def _release(self, latency: float, error: bool) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            self.blocked += error
+            self._latencies.append(latency)
+            self._outcomes.append(error)
+            self._since_adjust += 1
+            self._since_decrease += 1
+
+            if error or self._since_adjust >= ADJUST_EVERY:
+                self._adjust(error)
+            self._cond.notify_all()
+
+    def _p95(self) -> float:
+        latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+
+    def _adjust(self, error: bool) -> None:
+        error_rate = sum(self._outcomes) / len(self._outcomes)
+        p95 = self._p95()
+
+        if error or error_rate > ERROR_TARGET or p95 > P95_TARGET:
+            # A block is reacted to at once, but only once per ADJUST_EVERY
+            # requests, so one burst of 429s does not collapse the rate
+            if self.decreases and self._since_decrease < ADJUST_EVERY:
+                return
+            self.limit = max(1.0, self.limit / 2)
+            self.delay = min(MAX_DELAY, self.delay * 2)
+            self.decreases += 1
+            self._since_decrease = 0
+            self._outcomes.clear()
+            self._latencies.clear()
+            logger.warning(
+                f"Backing off {self.name}: p95 {p95:.2f}s, blocked {error_rate:.0%}; "
+                f"concurrency {int(self.limit)}, delay {self.delay:.2f}s"
+            )
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1)
+            self.delay = max(MIN_DELAY, self.delay - DELAY_STEP)
+            self.increases += 1
+            logger.info(f"Speeding up {self.name}: concurrency {int(self.limit)}, delay {self.delay:.2f}s")
+        self._since_adjust = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the current state for metrics.
+
+        Returns:
+            Dict[str, Any]: Limits, counters and the measured p95 latency and
+                blocked rate
+        """
+        with self._cond:
+            return {
+                "concurrency": int(self.limit),
+                "delay_seconds": round(self.delay, 3),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "blocked": self.blocked,
+                "p95_latency_seconds": round(self._p95(), 3),
+                "blocked_rate": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+_controllers: Dict[str, PolitenessController] = {}
+_controllers_lock = threading.Lock()
+
+def get_controller(host: str, initial_delay: Optional[float] = None) -> PolitenessController:
+    """
+    Get the controller shared by every fetcher of a host.
+
+    Args:
+        host: Host name, e.g. "www.blocket.se"
+        initial_delay: Starting delay of the controller if it is created
+            by this call; INITIAL_DELAY when omitted
+
+    Returns:
+        PolitenessController: Controller of the host
+    """
+    with _controllers_lock:
+        if host not in _controllers:
+            _controllers[host] = PolitenessController(host, initial_delay if initial_delay is not None else INITIAL_DELAY)
+        return _controllers[host]
+
+def snapshot_all() -> Dict[str, Dict[str, Any]]:
+    """
+    Get the state of every controller, by host.
+    """
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+    return {controller.name: controller.snapshot() for controller in controllers}
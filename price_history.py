@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Append-only price and mileage history of car ads.
+An observation is written to a MongoDB time-series collection only when the
+price or mileage of an ad differs from what is stored, and every price drop
+is also kept in a small `price_drops` collection for fast queries.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Fields whose changes are tracked
+TRACKED_FIELDS = ["price", "mileage"]
+
+# Collections whose setup has already been done by this process
+_prepared_collections = set()
+
+def get_observations_collection(database: Database) -> Collection:
+    """
+    Get the price observation time-series collection, creating it if needed.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Observation collection
+    """
+    name = os.getenv('PRICE_HISTORY_COLLECTION_NAME', 'price_observations')
+    collection = database[name]
+    if collection.full_name in _prepared_collections:
+        return collection
+
+    if name not in database.list_collection_names():
+        try:
+            database.create_collection(
+                name,
+                timeseries={"timeField": "observed_at", "metaField": "ad_id", "granularity": "hours"}
+            )
+            logger.info(f"Created time-series collection '{name}'")
+        except CollectionInvalid:
+            # Created concurrently by another process
+            pass
+
+    collection.create_index([("ad_id", ASCENDING), ("observed_at", ASCENDING)])
+    _prepared_collections.add(collection.full_name)
+    return collection
+
+def get_price_drops_collection(database: Database) -> Collection:
+    """
+    Get the collection with the latest price drop of each ad.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Price drop collection
+    """
+    collection = database[os.getenv('PRICE_DROPS_COLLECTION_NAME', 'price_drops')]
+    if collection.full_name not in _prepared_collections:
+        collection.create_index("ad_id", unique=True)
+        collection.create_index([("dropped_at", DESCENDING), ("drop_percent", DESCENDING)])
+        _prepared_collections.add(collection.full_name)
+    return collection
+
+def load_current_values(collection: Collection, ads: List[Dict[str, Any]], extra_fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the stored price and mileage of ads before they are overwritten.
+
+    Args:
+        collection: Car ads collection
+        ads: Car ads about to be saved
+        extra_fields: Further fields to load, for other consumers of the
+            previous values
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Stored values by ad URL; new ads are missing
+    """
+    fields = TRACKED_FIELDS + (extra_fields or [])
+    projection = {"_id": 0, "url": 1, **{field: 1 for field in fields}}
+    cursor = collection.find({"url": {"$in": [ad["url"] for ad in ads]}}, projection)
+    return {doc["url"]: doc for doc in cursor}
+
+def _changed(old: Any, new: Any) -> bool:
+    # A missing new value is not a change
+    return new is not None and new != old
+
+def record_price_changes(database: Database, ads: List[Dict[str, Any]], previous: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Write observations for ads that are new or whose price or mileage changed.
+
+    A value that disappears from an ad, such as the price of a "Ring för
+    pris" listing, is not an observation, and a price that appears again
+    is observed but not reported as a price change.
+
+    Args:
+        database: MongoDB database
+        ads: Car ads that were saved
+        previous: Stored values from load_current_values()
+
+    Returns:
+        List[Dict[str, Any]]: Ads with a changed price (new ads excluded)
+    """
+    observations = []
+    drops = []
+    price_changed = []
+
+    for ad in ads:
+        old = previous.get(ad["url"])
+        if old is not None and not any(_changed(old.get(field), ad.get(field)) for field in TRACKED_FIELDS):
+            continue
+
+        observed_at = datetime.fromtimestamp(ad["scrape_timestamp"]) if ad.get("scrape_timestamp") else datetime.now()
+        observations.append({
+            "ad_id": ad["id"],
+            "observed_at": observed_at,
+            **{field: ad.get(field) for field in TRACKED_FIELDS}
+        })
+
+        if old is None or old.get("price") is None or not _changed(old.get("price"), ad.get("price")):
+            continue
+
+        price_changed.append(ad)
+        old_price, new_price = old.get("price"), ad.get("price")
+        if new_price < old_price:
+            drops.append(UpdateOne(
+                {"ad_id": ad["id"]},
+                {
+                    "$set": {
+                        "url": ad["url"],
+                        "title": ad.get("title"),
+                        "make": ad.get("make"),
+                        "model": ad.get("model"),
+                        "previous_price": old_price,
+                        "price": new_price,
+                        "drop": old_price - new_price,
+                        "drop_percent": round((old_price - new_price) * 100 / old_price, 2),
+                        "dropped_at": observed_at
+                    },
+                    "$setOnInsert": {"first_price": old_price}
+                },
+                upsert=True
+            ))
+
+    if observations:
+        get_observations_collection(database).insert_many(observations, ordered=False)
+    if drops:
+        get_price_drops_collection(database).bulk_write(drops, ordered=False)
+
+    if observations:
+        logger.info(f"Recorded {len(observations)} price observations, {len(drops)} price drops")
+    return price_changed
+
+def get_price_history(database: Database, ad_id: str) -> List[Dict[str, Any]]:
+    """
+    Get the observations of an ad, oldest first.
+
+    Args:
+        database: MongoDB database
+        ad_id: Ad ID
+
+    Returns:
+        List[Dict[str, Any]]: Observations with observed_at, price and mileage
+    """
+    cursor = get_observations_collection(database).find(
+        {"ad_id": ad_id},
+        {"_id": 0, "ad_id": 0}
+    ).sort("observed_at", ASCENDING)
+    return list(cursor)
+
+def get_price_drops(database: Database, days: int = 7, limit: int = 50, make: Optional[str] = None, model: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Get ads whose price dropped in the last `days` days, largest drop first.
+
+    Args:
+        database: MongoDB database
+        days: Number of days to look back
+        limit: Maximum number of results
+        make: Only return ads of this make
+        model: Only return ads of this model
+
+    Returns:
+        List[Dict[str, Any]]: Price drops
+    """
+    query = {"dropped_at": {"$gte": datetime.now() - timedelta(days=days)}}
+    if make:
+        query["make"] = make
+    if model:
+        query["model"] = model
+
+    cursor = get_price_drops_collection(database).find(query, {"_id": 0}).sort("drop_percent", DESCENDING).limit(limit)
+    return list(cursor)
+
+if __name__ == "__main__":
+    import argparse
+
+    from mongodb import get_mongodb_connection
+
+    parser = argparse.ArgumentParser(description="Show recent price drops")
+    parser.add_argument("--days", type=int, default=7, help="Number of days to look back")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of results")
+    args = parser.parse_args()
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise SystemExit("Failed to connect to MongoDB")
+
+    try:
+        for drop in get_price_drops(db, days=args.days, limit=args.limit):
+            print(f"{drop['drop_percent']:>6}%  {drop['previous_price']} -> {drop['price']} kr  {drop.get('title')}  {drop['url']}")
+    finally:
+        client.close()
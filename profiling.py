@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Opt-in sampling profiler for scrape, save and sync runs.
+Functions decorated with @profiled() run unchanged unless profiling is
+switched on with SCRAPER_PROFILE=1 or, for one request, with
+profiling_requested(). A profiled run has its thread's stack sampled
+every PROFILE_SAMPLE_INTERVAL seconds by a background thread. Each sample
+is attributed to a pipeline stage (the innermost function listed in
+STAGE_FUNCTIONS) and a component (the outermost library or module in
+COMPONENTS, e.g. chromedriver round trips or pymongo), and the run writes
+a collapsed-stack file for flamegraph.pl/speedscope and a JSON summary to
+PROFILE_DIR. The summary is also added to the run statistics under
+"profile".
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Profile every decorated run
+PROFILE_ENABLED = os.getenv('SCRAPER_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+# Output directory, seconds between samples and length of the top lists
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+TOP_N = int(os.getenv('PROFILE_TOP_N', 20))
+
+# Pipeline stages by function name; the innermost one on a stack wins
+STAGE_FUNCTIONS = {
+    "discover_ad_urls": "discover",
+    "scrape_individual_ad": "scrape_ad",
+    "load_current_values": "load_previous",
+    "save_batch": "save_batch",
+    "record_price_changes": "price_history",
+    "update_rollups": "market_stats",
+    "assign_clusters": "dedup",
+    "create_alerts": "alerts",
+    "generate_elasticsearch_actions": "prepare_documents",
+    "bulk": "es_bulk",
+}
+
+# Components by top-level package or module; the outermost one on a stack
+# wins, so urllib3 calls made by Selenium count as chromedriver time
+COMPONENTS = {
+    "politeness": "pacing",
+    "selenium": "chromedriver",
+    "bs4": "html_parse",
+    "pymongo": "mongodb",
+    "bson": "mongodb",
+    "elasticsearch": "elasticsearch",
+    "elastic_transport": "elasticsearch",
+    "PIL": "images",
+    "requests": "http",
+    "urllib3": "http",
+}
+
+_local = threading.local()
+
+def is_enabled() -> bool:
+    """
+    Whether runs started by the current thread are profiled.
+    """
+    return PROFILE_ENABLED or getattr(_local, "requested", False)
+
+@contextmanager
+def profiling_requested():
+    """
+    Profile the decorated runs started inside the block, e.g. for an API
+    request with profile=1.
+    """
+    previous = getattr(_local, "requested", False)
+    _local.requested = True
+    try:
+        yield
+    finally:
+        _local.requested = previous
+
+def _package(filename: str) -> Optional[str]:
+    # Top-level package of a file under site-packages
+    marker = "site-packages" + os.sep
+    position = filename.rfind(marker)
+    if position < 0:
+        return None
+    return filename[position + len(marker):].split(os.sep, 1)[0]
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread from a background thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        """
+        Args:
+            thread_id: ident of the thread to sample
+            interval: Seconds between samples
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self._labels: Dict[Any, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            if module == "__init__":
+                module = os.path.basename(os.path.dirname(code.co_filename))
+            package = _package(code.co_filename)
+            prefix = f"{package}." if package and package != module else ""
+            label = self._labels[code] = f"{prefix}{module}:{code.co_name}"
+        return label
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+            stack = tuple(codes)
+            self.stacks[stack] += 1
+            # Weigh samples by the time they stand for, so a late wake-up
+            # of this thread does not skew the totals
+            self.seconds[stack] += now - last
+            last = now
+
+    def _attribute(self, stack) -> Tuple[str, str]:
+        stage, component = "other", "python"
+        for code in stack:
+            stage = STAGE_FUNCTIONS.get(code.co_name, stage)
+        for code in stack:
+            package = _package(code.co_filename) or os.path.splitext(os.path.basename(code.co_filename))[0]
+            if package in COMPONENTS:
+                component = COMPONENTS[package]
+                break
+        return stage, component
+
+    def summary(self, top_n: int = TOP_N) -> Dict[str, Any]:
+        """
+        Summarize the samples.
+
+        Returns:
+            Dict[str, Any]: Sample count, seconds per stage, per component
+                and per stage/component, and the functions with the most
+                self and total time
+        """
+        stages, components, pairs = Counter(), Counter(), Counter()
+        self_time, total_time = Counter(), Counter()
+        for stack, seconds in self.seconds.items():
+            stage, component = self._attribute(stack)
+            stages[stage] += seconds
+            components[component] += seconds
+            pairs[f"{stage}/{component}"] += seconds
+            labels = [self._label(code) for code in stack]
+            self_time[labels[-1]] += seconds
+            for label in set(labels):
+                total_time[label] += seconds
+
+        def rounded(counter, n=None):
+            return {name: round(value, 3) for name, value in counter.most_common(n)}
+
+        return {
+            "samples": sum(self.stacks.values()),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "stages": rounded(stages),
+            "components": rounded(components),
+            "stage_components": rounded(pairs, top_n),
+            "top_self": rounded(self_time, top_n),
+            "top_total": rounded(total_time, top_n),
+        }
+
+    def write_collapsed(self, path: str) -> None:
+        """
+        Write the samples as collapsed stacks ("frame;frame;frame count"),
+        rooted at the stage and component of each sample.
+        """
+        lines = Counter()
+        for stack, count in self.stacks.items():
+            stage, component = self._attribute(stack)
+            frames = [f"[{stage}]", f"[{component}]"] + [self._label(code) for code in stack]
+            lines[";".join(frames)] += count
+        with open(path, "w", encoding="utf-8") as f:
+            for line, count in sorted(lines.items()):
+                f.write(f"{line} {count}\n")
+
+def _write_profile(profiler: SamplingProfiler, name: str) -> Dict[str, Any]:
+    summary = profiler.summary()
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        profiler.write_collapsed(f"{base}.collapsed")
+        summary["collapsed_file"] = f"{base}.collapsed"
+        summary["summary_file"] = f"{base}.json"
+        with open(summary["summary_file"], "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    except OSError as e:
+        logger.error(f"Error writing profile of {name}: {str(e)}")
+    return summary
+
+def profiled(name: str):
+    """
+    Decorate a run to be profiled when profiling is switched on.
+
+    Runs started inside a profiled run are not profiled again; their time
+    is part of the outer profile. A dict result gets the summary under
+    "profile".
+
+    Args:
+        name: Name of the run in the profile file names
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled() or getattr(_local, "active", False):
+                return func(*args, **kwargs)
+
+            profiler = SamplingProfiler(threading.get_ident())
+            _local.active = True
+            profiler.start()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.stop()
+                _local.active = False
+                summary = _write_profile(profiler, name)
+                logger.info(f"Profile of {name}: {summary['stage_components']}")
+            if isinstance(result, dict):
+                result["profile"] = summary
+            return result
+        return wrapper
+    return decorator
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a collapsed-stack profile")
+    parser.add_argument("path", help="File written by a profiled run")
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    roots, functions = Counter(), Counter()
+    with open(args.path, encoding="utf-8") as f:
+        for line in f:
+            stack, count = line.rsplit(" ", 1)
+            frames = stack.split(";")
+            roots[f"{frames[0]} {frames[1]}"] += int(count)
+            functions[frames[-1]] += int(count)
+    total = sum(roots.values()) or 1
+    for title, counter in (("Stages", roots), ("Self samples", functions)):
+        print(title)
+        for name, count in counter.most_common(args.top):
+            print(f"  {count / total:6.1%}  {name}")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Mark removed ads as inactive.
+Compares the ad IDs found by the latest full discovery pass with the IDs of
+the ads stored as active, flips the missing ones to inactive with a single
+update_many and propagates the change to Elasticsearch in bulk.
+"""
+
+import os
+import logging
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional
+
+from pymongo.collection import Collection
+
+from market_stats import CONTRIBUTION_FIELDS, record_deactivations
+
+logger = logging.getLogger(__name__)
+
+# Skip reconciliation when discovery found fewer than this share of the
+# active ads; a partial discovery pass would otherwise deactivate live ads
+MIN_SEEN_RATIO = float(os.getenv('RECONCILE_MIN_SEEN_RATIO', 0.5))
+
+# Delete inactive ads from Elasticsearch instead of flagging them
+DELETE_INACTIVE_FROM_ES = os.getenv('ELASTICSEARCH_DELETE_INACTIVE', 'false').lower() in ('1', 'true', 'yes')
+
+def _propagate_to_elasticsearch(es, index_name: str, ad_ids: list) -> int:
+    """
+    Flag or delete inactive ads in Elasticsearch with one bulk request.
+
+    Args:
+        es: Elasticsearch client
+        index_name: Index name
+        ad_ids: IDs of the ads that became inactive
+
+    Returns:
+        int: Number of failed actions
+    """
+    from elasticsearch.helpers import bulk
+
+    if DELETE_INACTIVE_FROM_ES:
+        actions = ({"_op_type": "delete", "_index": index_name, "_id": ad_id} for ad_id in ad_ids)
+    else:
+        actions = (
+            {"_op_type": "update", "_index": index_name, "_id": ad_id, "doc": {"active": False}}
+            for ad_id in ad_ids
+        )
+
+    # Ads that were never indexed answer with 404, which is fine here
+    success, errors = bulk(es, actions, raise_on_error=False, raise_on_exception=False)
+    failed = [error for error in errors if next(iter(error.values())).get("status") != 404]
+    logger.info(f"Propagated {success} inactive ads to Elasticsearch, {len(failed)} failed")
+    return len(failed)
+
+def reconcile_active_ads(collection: Collection, seen_ids: Iterable[str], es=None, index_name: Optional[str] = None, scope: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """
+    Mark stored active ads that were not seen by discovery as inactive.
+
+    When no Elasticsearch client is given, or the bulk request fails, the
+    deactivated ads are flagged for the next sync_to_elasticsearch run instead.
+
+    Args:
+        collection: Car ads collection
+        seen_ids: IDs of all ads found by a full discovery pass
+        es: Elasticsearch client, if available
+        index_name: Elasticsearch index; ELASTICSEARCH_INDEX when omitted
+        scope: Filter of the stored ads the discovery pass covered, e.g.
+            the ads of one source; all ads when omitted
+
+    Returns:
+        Dict[str, int]: Statistics about the reconciliation
+    """
+    seen = set(seen_ids)
+    query = {"active": True, **(scope or {})}
+    active = {doc["id"] for doc in collection.find(query, {"_id": 0, "id": 1}) if "id" in doc}
+    missing = list(active - seen)
+
+    stats = {"seen": len(seen), "active": len(active), "deactivated": 0, "es_errors": 0}
+
+    if not missing:
+        logger.info("No removed ads found")
+        return stats
+
+    if active and len(seen & active) < MIN_SEEN_RATIO * len(active):
+        logger.warning(
+            f"Discovery saw only {len(seen & active)} of {len(active)} active ads, "
+            "skipping reconciliation"
+        )
+        return stats
+
+    # Stored state of the removed ads, for the market statistics
+    projection = {"_id": 0, "first_seen_timestamp": 1, **{field: 1 for field in CONTRIBUTION_FIELDS}}
+    removed = list(collection.find({"id": {"$in": missing}, "active": True}, projection))
+
+    now = datetime.now()
+    result = collection.update_many(
+        {"id": {"$in": missing}, "active": True},
+        {"$set": {
+            "active": False,
+            "deactivated_at": now.isoformat(),
+            "deactivated_timestamp": int(now.timestamp()),
+            # Picked up by the next sync unless the bulk request below succeeds
+            "indexed": False
+        }}
+    )
+    stats["deactivated"] = result.modified_count
+    logger.info(f"Marked {result.modified_count} removed ads as inactive")
+
+    try:
+        record_deactivations(collection.database, removed, int(now.timestamp()))
+    except Exception as e:
+        logger.error(f"Error updating market statistics: {str(e)}")
+
+    if es is not None:
+        index_name = index_name or os.getenv('ELASTICSEARCH_INDEX', 'car_ads')
+        try:
+            stats["es_errors"] = _propagate_to_elasticsearch(es, index_name, missing)
+            if not stats["es_errors"]:
+                # last_indexed lets incremental readers such as the similar-cars
+                # index see the deactivation
+                collection.update_many(
+                    {"id": {"$in": missing}},
+                    {"$set": {"indexed": True, "last_indexed": datetime.now().isoformat()}}
+                )
+        except Exception as e:
+            logger.error(f"Failed to propagate inactive ads to Elasticsearch: {str(e)}")
+            stats["es_errors"] = len(missing)
+
+    return stats
+
+if __name__ == "__main__":
+    from mongodb import get_mongodb_connection
+    from frontier import get_frontier_collection, get_latest_run, get_run_urls, get_resumable_run
+    from schema import ad_id_from_url
+    from sync_to_elasticsearch import get_elasticsearch_connection
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise SystemExit("Failed to connect to MongoDB")
+
+    try:
+        frontier = get_frontier_collection(db)
+        run_id = get_latest_run(frontier)
+        if run_id is None:
+            raise SystemExit("No scrape run found")
+        if get_resumable_run(frontier) == run_id:
+            raise SystemExit(f"Run {run_id} has not finished yet")
+
+        seen_ids = [ad_id_from_url(url) for url in get_run_urls(frontier, run_id)]
+        stats = reconcile_active_ads(collection, seen_ids, es=get_elasticsearch_connection())
+        print(f"Reconciliation results for run {run_id}: {stats}")
+    finally:
+        client.close()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Typed car ad record passed between the pipeline stages.
+CarAd is a slotted dataclass with one attribute per known ad field, so a
+scraped ad costs a fraction of the memory of a dict and a misspelled or
+mistyped field fails where it is set instead of deep in a later stage.
+It supports the read and write operations of a dict (ad["price"],
+ad.get("make"), "coordinates" in ad, ad.update(...)), so the stages that
+consume ads work on it unchanged. Records are encoded to and decoded from
+BSON, JSON and msgpack; decoding validates the fields.
+"""
+
+import json
+import time
+import operator
+import logging
+import tracemalloc
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple, Union, get_args, get_origin, get_type_hints
+
+import bson
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+# Keys of stored documents that are not ad fields
+IGNORED_KEYS = {"_id"}
+
+@dataclass(slots=True)
+class CarAd:
+    """
+    A car ad. Unset optional fields are None and are left out when the
+    record is encoded.
+    """
+
+    # Core fields (always present)
+    url: str
+    id: str
+    scrape_date: str
+    scrape_timestamp: int
+    source: Optional[str] = None
+
+    # Elasticsearch and lifecycle flags
+    indexed: bool = False
+    active: bool = True
+
+    # Title and prices
+    title: Optional[str] = None
+    price: Optional[int] = None
+    price_text: Optional[str] = None
+    price_range: Optional[str] = None
+    vat_price: Optional[int] = None
+    vat_price_text: Optional[str] = None
+    financing_monthly: Optional[int] = None
+    financing_text: Optional[str] = None
+
+    # Location
+    location: Optional[str] = None
+    city: Optional[str] = None
+    region: Optional[str] = None
+    county: Optional[str] = None
+    coordinates: Optional[Dict[str, float]] = None
+    geo_precision: Optional[str] = None
+
+    # Car
+    make: Optional[str] = None
+    model: Optional[str] = None
+    variant: Optional[str] = None
+    year: Optional[int] = None
+    mileage: Optional[int] = None
+    fuel_type: Optional[str] = None
+    transmission: Optional[str] = None
+    engine: Optional[str] = None
+    color: Optional[str] = None
+    specifications: Optional[Dict[str, str]] = None
+    specs: Optional[Dict[str, str]] = None
+    tags: Optional[List[str]] = None
+
+    # Text and search fields
+    description: Optional[str] = None
+    description_length: Optional[int] = None
+    search_text: Optional[str] = None
+    keywords: Optional[List[str]] = None
+
+    # Seller and publication
+    seller: Optional[Dict[str, Any]] = None
+    seller_type: Optional[str] = None
+    publication_date: Optional[str] = None
+    publication_timestamp: Optional[int] = None
+
+    # Images
+    images: Optional[List[Dict[str, Any]]] = None
+    image_count: Optional[int] = None
+    has_images: Optional[bool] = None
+    primary_image: Optional[str] = None
+    primary_thumbnail: Optional[str] = None
+    image_urls: Optional[List[str]] = None
+
+    # Set by later stages on the stored document
+    cluster_id: Optional[str] = None
+    first_seen_timestamp: Optional[int] = None
+    deactivated_at: Optional[str] = None
+    deactivated_timestamp: Optional[int] = None
+    last_indexed: Optional[str] = None
+    schema_version: Optional[int] = None
+
+    # Written by versions before the compact storage schema
+    title_keyword: Optional[str] = None
+    location_keyword: Optional[str] = None
+    make_keyword: Optional[str] = None
+    model_keyword: Optional[str] = None
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in _FIELD_SET:
+            raise KeyError(f"CarAd has no field '{key}'")
+        if value is not None and not isinstance(value, _TYPES[key]):
+            raise TypeError(_type_error(key, value))
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELD_SET and getattr(self, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, value in zip(FIELDS, _values(self)) if value is not None)
+
+    def __len__(self) -> int:
+        return sum(value is not None for value in _values(self))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key) if key in _FIELD_SET else None
+        return default if value is None else value
+
+    def keys(self) -> List[str]:
+        return list(self)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(self.to_dict().items())
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for key, value in values.items():
+            self[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the set fields as a dict. Nested lists and dicts are shared
+        with the record, not copied.
+        """
+        return {name: value for name, value in zip(FIELDS, _values(self)) if value is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], strict: bool = True) -> "CarAd":
+        """
+        Create a record from a dict, such as a stored MongoDB document.
+
+        Args:
+            data: Ad fields; IGNORED_KEYS are skipped
+            strict: Reject unknown fields. Stored documents are decoded
+                with strict=False, so fields written by other versions or
+                tools are skipped instead of failing the read.
+
+        Returns:
+            CarAd: Record
+
+        Raises:
+            ValueError: If a field is unknown and strict is set, has the
+                wrong type, or a core field is missing
+        """
+        values = {}
+        for key, value in data.items():
+            if key in IGNORED_KEYS:
+                continue
+            if key not in _FIELD_SET:
+                if strict:
+                    raise ValueError(f"Unknown field '{key}'")
+                logger.debug(f"Skipping unknown field '{key}' of {data.get('url')}")
+                continue
+            if value is not None and not isinstance(value, _TYPES[key]):
+                raise ValueError(_type_error(key, value))
+            values[key] = value
+
+        missing = [name for name in REQUIRED_FIELDS if values.get(name) is None]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+        return cls(**values)
+
+    def to_bson(self) -> bytes:
+        return bson.encode(self.to_dict())
+
+    @classmethod
+    def from_bson(cls, data: bytes, strict: bool = True) -> "CarAd":
+        return cls.from_dict(bson.decode(data), strict)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes], strict: bool = True) -> "CarAd":
+        return cls.from_dict(json.loads(data), strict)
+
+    def to_msgpack(self) -> bytes:
+        return msgpack.packb(self.to_dict(), use_bin_type=True)
+
+    @classmethod
+    def from_msgpack(cls, data: bytes, strict: bool = True) -> "CarAd":
+        return cls.from_dict(msgpack.unpackb(data, raw=False), strict)
+
+def _runtime_types(hint) -> Tuple[type, ...]:
+    # Optional[List[str]] -> (list,); int values are accepted for floats
+    options = [arg for arg in get_args(hint) if arg is not type(None)] if get_origin(hint) is Union else [hint]
+    types = tuple(get_origin(option) or option for option in options)
+    return types + (int,) if float in types else types
+
+def _type_error(key: str, value: Any) -> str:
+    expected = " or ".join(t.__name__ for t in _TYPES[key])
+    return f"Field '{key}' must be {expected}, got {type(value).__name__}"
+
+# Field names in declaration order, and the types their values must have
+FIELDS = tuple(field.name for field in fields(CarAd))
+REQUIRED_FIELDS = ("url", "id", "scrape_date", "scrape_timestamp")
+_FIELD_SET = frozenset(FIELDS)
+_TYPES = {name: _runtime_types(hint) for name, hint in get_type_hints(CarAd).items()}
+_values = operator.attrgetter(*FIELDS)
+
+def sample_ads(count: int) -> List[Dict[str, Any]]:
+    # Synthetic ads with the fields a scraped Blocket ad usually has
+    ads = []
+    for i in range(count):
+        ads.append({
+            "url": f"https://www.blocket.se/annons/porsche_911/{100000 + i}",
+            "id": str(100000 + i),
+            "scrape_date": "2026-01-01T12:00:00",
+            "scrape_timestamp": 1767268800 + i,
+            "indexed": False,
+            "active": True,
+            "title": f"Porsche 911 Carrera {i % 7}",
+            "price": 400000 + i * 10,
+            "price_text": f"{400000 + i * 10} kr",
+            "price_range": "400,000 - 500,000 kr",
+            "location": "Stockholm, Stockholm",
+            "city": "Stockholm",
+            "region": "Stockholm",
+            "county": "Stockholms län",
+            "coordinates": {"lat": 59.33, "lon": 18.07},
+            "geo_precision": "city",
+            "make": "Porsche",
+            "model": "911",
+            "year": 2015 + i % 10,
+            "mileage": 1000 + i % 20000,
+            "fuel_type": "Bensin",
+            "transmission": "Automat",
+            "specifications": {"Årsmodell": "2019", "Miltal": "2 500 mil", "Bränsle": "Bensin"},
+            "tags": ["Servicebok", "Vinterhjul"],
+            "description": "Välskött bil med full servicehistorik. " * 5,
+            "description_length": 195,
+            "search_text": "porsche 911 carrera stockholm bensin automat",
+            "keywords": ["porsche", "911", "carrera"],
+            "seller": {"name": "Bilhandel AB", "type": "Företag"},
+            "seller_type": "dealer",
+            "images": [{"id": f"{i}-{n}", "url": f"https://img.blocket.se/{i}/{n}.jpg", "position": n} for n in range(8)],
+            "image_count": 8,
+            "has_images": True,
+            "primary_image": f"https://img.blocket.se/{i}/0.jpg",
+        })
+    return ads
+
+def _allocated(build) -> Tuple[Any, int]:
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def _per_record_us(func, items: Iterable[Any], count: int) -> float:
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return round((time.perf_counter() - started) * 1e6 / count, 2)
+
+def benchmark(count: int = 10000) -> Dict[str, Any]:
+    """
+    Compare the memory of records and dicts, and time each encoding.
+
+    Memory counts the top-level containers only; the field values are the
+    same objects either way.
+
+    Args:
+        count: Number of synthetic ads
+
+    Returns:
+        Dict[str, Any]: Bytes per ad and microseconds per encode/decode
+    """
+    dicts = sample_ads(count)
+    copies, dict_bytes = _allocated(lambda: [dict(ad) for ad in dicts])
+    records, record_bytes = _allocated(lambda: [CarAd.from_dict(ad) for ad in dicts])
+
+    results = {
+        "ads": count,
+        "dict_bytes": round(dict_bytes / count),
+        "record_bytes": round(record_bytes / count),
+        "from_dict_us": _per_record_us(CarAd.from_dict, dicts, count),
+    }
+    for name in ("json", "bson", "msgpack"):
+        encoded = [getattr(record, f"to_{name}")() for record in records]
+        results[f"{name}_bytes"] = round(sum(len(data) for data in encoded) / count)
+        results[f"{name}_encode_us"] = _per_record_us(getattr(CarAd, f"to_{name}"), records, count)
+        results[f"{name}_decode_us"] = _per_record_us(getattr(CarAd, f"from_{name}"), encoded, count)
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Car ad record tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    benchmark_parser = subparsers.add_parser("benchmark", help="Measure record memory and encoding speed")
+    benchmark_parser.add_argument("--ads", type=int, default=10000, help="Number of synthetic ads")
+    args = parser.parse_args()
+
+    print(f"Benchmark results: {benchmark(args.ads)}")
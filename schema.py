@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Compact storage schema for car ads.
+Fields that can be derived from other fields are not stored in MongoDB;
+expand_document() recreates them for consumers such as the Elasticsearch
+sync. Run this module with `migrate` to rewrite existing documents.
+"""
+
+import os
+import logging
+from typing import Dict, Any, List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Version of the stored document layout
+SCHEMA_VERSION = 2
+
+# Top-level fields that are derived on read instead of stored
+REDUNDANT_FIELDS = [
+    "title_keyword",     # Elasticsearch has title.keyword
+    "location_keyword",  # Elasticsearch has location.keyword
+    "make_keyword",      # Elasticsearch has make.keyword
+    "model_keyword",     # Elasticsearch has model.keyword
+    "specs",             # Normalized copy of specifications
+    "image_urls",        # Copy of images[].url
+]
+
+# Image fields that are derived from the ad and image IDs, or from the
+# variants of processed images
+REDUNDANT_IMAGE_FIELDS = ["filename", "local_path"]
+
+def ad_id_from_url(url: str) -> str:
+    """
+    Get the ad ID from an ad URL, e.g. ".../annons/porsche_911/1234" -> "1234".
+
+    Args:
+        url: Ad URL
+
+    Returns:
+        str: Ad ID
+    """
+    return url.rstrip('/').split('/')[-1]
+
+def normalize_spec_key(key: str) -> str:
+    """
+    Normalize a specification name, e.g. "Fuel type" -> "fuel_type".
+
+    Args:
+        key: Specification name as shown on the ad page
+
+    Returns:
+        str: Normalized specification name
+    """
+    return key.lower().replace(" ", "_").replace("-", "_")
+
+def image_filename(image_id: str) -> str:
+    """
+    Get the file name of a downloaded image.
+
+    Args:
+        image_id: Image ID
+
+    Returns:
+        str: File name
+    """
+    return f"{image_id}.jpg"
+
+def image_local_path(ad_id: str, image_id: str) -> str:
+    """
+    Get the local path of a downloaded image.
+
+    Args:
+        ad_id: Ad ID
+        image_id: Image ID
+
+    Returns:
+        str: Path relative to the working directory
+    """
+    return f"images/{ad_id}/{image_filename(image_id)}"
+
+def compact_images(images: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Remove derived fields from image objects.
+
+    Args:
+        images: Image objects
+
+    Returns:
+        List[Dict[str, Any]]: Compact image objects
+    """
+    return [
+        {key: value for key, value in image.items() if key not in REDUNDANT_IMAGE_FIELDS}
+        for image in images
+    ]
+
+def compact_document(ad: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a scraped ad to the compact storage layout.
+
+    Args:
+        ad: Car ad details
+
+    Returns:
+        Dict[str, Any]: Document to store in MongoDB
+    """
+    doc = {key: value for key, value in ad.items() if key not in REDUNDANT_FIELDS}
+    if "images" in doc:
+        doc["images"] = compact_images(doc["images"])
+    doc["schema_version"] = SCHEMA_VERSION
+    return doc
+
+def _expand_image(ad_id: str, image: Dict[str, Any]) -> Dict[str, Any]:
+    if "id" not in image:
+        return image
+
+    # Processed images live in the content-addressed store
+    original = (image.get("variants") or {}).get("original")
+    local_path = original or image_local_path(ad_id, image["id"])
+    return {
+        "filename": os.path.basename(local_path),
+        "local_path": local_path,
+        **image
+    }
+
+def expand_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Recreate the derived fields of a stored document.
+
+    Top-level fields are set on the document itself, which is also returned;
+    image objects are replaced rather than modified. Fields that are already
+    present, as in documents stored before the compact schema, are kept.
+
+    Args:
+        doc: MongoDB document
+
+    Returns:
+        Dict[str, Any]: Document with derived fields
+    """
+    if "specs" not in doc:
+        doc["specs"] = {
+            normalize_spec_key(key): value
+            for key, value in (doc.get("specifications") or {}).items()
+        }
+
+    images = [_expand_image(doc.get("id"), image) for image in doc.get("images") or []]
+    if images:
+        doc["images"] = images
+        thumbnail = (images[0].get("variants") or {}).get("thumb")
+        if thumbnail and "primary_thumbnail" not in doc:
+            doc["primary_thumbnail"] = thumbnail
+
+    if "image_urls" not in doc:
+        doc["image_urls"] = [image["url"] for image in images if image.get("url")]
+
+    return doc
+
+def migrate_collection(collection, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Rewrite documents stored with an older schema to the compact layout.
+
+    Documents are processed in batches ordered by _id, each with a single
+    bulk write, so the migration can be interrupted and run again.
+
+    Args:
+        collection: Car ads collection
+        batch_size: Number of documents per bulk write
+
+    Returns:
+        Dict[str, int]: Statistics about the migration
+    """
+    stats = {"migrated": 0, "batches": 0}
+    query = {"schema_version": {"$not": {"$gte": SCHEMA_VERSION}}}
+    projection = {"_id": 1, "images": 1}
+    last_id = None
+
+    while True:
+        batch_query = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        docs = list(collection.find(batch_query, projection).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+
+        operations = []
+        for doc in docs:
+            update = {
+                "$set": {"schema_version": SCHEMA_VERSION},
+                "$unset": {field: "" for field in REDUNDANT_FIELDS}
+            }
+            if doc.get("images"):
+                update["$set"]["images"] = compact_images(doc["images"])
+            operations.append(UpdateOne({"_id": doc["_id"]}, update))
+
+        collection.bulk_write(operations, ordered=False)
+        last_id = docs[-1]["_id"]
+        stats["migrated"] += len(docs)
+        stats["batches"] += 1
+        logger.info(f"Migrated {stats['migrated']} documents")
+
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+
+    from mongodb import get_mongodb_connection
+
+    parser = argparse.ArgumentParser(description="Car ads storage schema tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help=f"Rewrite documents to schema version {SCHEMA_VERSION}")
+    migrate_parser.add_argument("--batch-size", type=int, default=500, help="Number of documents per bulk write")
+    args = parser.parse_args()
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        raise SystemExit("Failed to connect to MongoDB")
+
+    try:
+        stats = migrate_collection(collection, batch_size=args.batch_size)
+        print(f"Migration results: {stats}")
+    finally:
+        client.close()
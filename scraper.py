@@ -2,8 +2,9 @@ import os
 import time
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Callable
 import re
+from urllib.parse import urlparse
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -12,15 +13,31 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
-from webdriver_manager.chrome import ChromeDriverManager
-from fake_useragent import UserAgent
-from pymongo import MongoClient
 from pymongo.collection import Collection
-from pymongo.database import Database
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-import requests
-from pathlib import Path
+
+from mongodb import get_mongodb_connection
+from frontier import (
+    get_frontier_collection, start_run, get_resumable_run, reset_in_progress,
+    get_pending_urls, get_run_urls, mark_in_progress, mark_done, mark_failed, requeue_url,
+    get_run_summary, PENDING, IN_PROGRESS
+)
+from pipeline import batched, ImageDownloadQueue
+from search_document import build_search_text, build_keywords
+from schema import normalize_spec_key, ad_id_from_url
+from records import CarAd
+from storage import Store, MongoStore, open_store, ensure_indexes, STORAGE_BACKEND
+from price_history import record_price_changes
+from alerts import create_alerts
+from reconcile import reconcile_active_ads
+from dedup import assign_clusters
+from market_stats import CONTRIBUTION_FIELDS, update_rollups
+from selector_stats import SelectorStats, get_selector_stats_collection, locator
+from politeness import get_controller, snapshot_all
+from taxonomy import match_ad
+from geo import geocode
+from profiling import profiled
+from sessions import SessionPool, BlockedPageError, EmptyPageError, classify_page, is_empty_ad, OK, MAX_BLOCK_RETRIES
 
 # Load environment variables
 load_dotenv()
@@ -32,49 +49,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_mongodb_connection() -> tuple[Optional[MongoClient], Optional[Database], Optional[Collection]]:
-    """
-    Establish connection to MongoDB Atlas.
-    
-    Returns:
-        tuple: (client, database, collection) or (None, None, None) if connection fails
-    """
-    try:
-        mongodb_uri = os.getenv('MONGODB_URI')
-        db_name = os.getenv('DATABASE_NAME', 'blocket_cars')
-        collection_name = os.getenv('COLLECTION_NAME', 'car_ads')
-        
-        if not mongodb_uri:
-            logger.error("MongoDB URI not found in environment variables")
-            return None, None, None
-            
-        # Connect to MongoDB with SSL certificate verification disabled
-        # Note: This is not recommended for production use, but helps during development
-        client = MongoClient(
-            mongodb_uri,
-            tlsAllowInvalidCertificates=True,  # Use this instead of ssl_cert_reqs
-            serverSelectionTimeoutMS=5000  # 5 second timeout
-        )
-        
-        database = client[db_name]
-        collection = database[collection_name]
-        
-        # Test connection
-        client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB")
-        
-        return client, database, collection
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {str(e)}")
-        return None, None, None
+# URL for Porsche cars with price over 400,000 SEK
+SEARCH_URL = "https://www.blocket.se/annonser/hela_sverige/fordon/bilar?cg=1020&q=porsche&r=11&r=10&r=9&r=8&r=7&r=6&r=5&r=4&r=3&r=2&r=1&mys=400000&st=s&ca=11&ca=10&ca=9&ca=8&ca=7&ca=6&ca=5&ca=4&ca=3&ca=2&ca=1&is=1&l=0&md=th"
+
+# Number of ads scraped between checkpoint flushes
+CHECKPOINT_EVERY = int(os.getenv('SCRAPER_CHECKPOINT_EVERY', 20))
 
-def setup_driver() -> webdriver.Chrome:
+# Source name of the ads scraped by this module, see sources.py
+BLOCKET = "blocket"
+
+# Maximum number of ads per bulk write and maximum age of a batch in seconds
+SAVE_BATCH_SIZE = int(os.getenv('SAVE_BATCH_SIZE', 100))
+SAVE_BATCH_MAX_WAIT = float(os.getenv('SAVE_BATCH_MAX_WAIT', 10))
+
+def setup_driver(user_agent: Optional[str] = None, proxy: Optional[str] = None) -> webdriver.Chrome:
     """
     Set up and configure Chrome WebDriver with Selenium.
     
+    Args:
+        user_agent: User agent to send; a random one when omitted
+        proxy: Proxy URL to connect through, if any
+    
     Returns:
         webdriver.Chrome: Configured Chrome WebDriver instance
     """
+    # Only needed when a browser is started
+    from fake_useragent import UserAgent
+    from webdriver_manager.chrome import ChromeDriverManager
+    
     # Set up Chrome options
     chrome_options = Options()
     chrome_options.add_argument("--headless")  # Run in headless mode
@@ -82,10 +84,13 @@ def setup_driver() -> webdriver.Chrome:
     chrome_options.add_argument("--disable-dev-shm-usage")
     
     # Use random user agent to avoid detection
-    ua = UserAgent()
-    user_agent = ua.random
+    if user_agent is None:
+        user_agent = UserAgent().random
     chrome_options.add_argument(f'--user-agent={user_agent}')
     
+    if proxy:
+        chrome_options.add_argument(f'--proxy-server={proxy}')
+    
     # Set up Chrome driver with specific options for Mac with Apple Silicon
     import platform
     import sys
@@ -97,7 +102,6 @@ def setup_driver() -> webdriver.Chrome:
         if is_mac_arm:
             # For Mac with Apple Silicon
             from selenium.webdriver.chrome.service import Service as ChromeService
-            from webdriver_manager.chrome import ChromeDriverManager
             from webdriver_manager.core.os_manager import ChromeType
             
             service = ChromeService(ChromeDriverManager().install())
@@ -120,14 +124,31 @@ def setup_driver() -> webdriver.Chrome:
             logger.error(f"Alternative setup also failed: {str(e2)}")
             raise
 
+def page_controller(url: str):
+    """
+    Get the politeness controller of the host of a page.
+    """
+    return get_controller(urlparse(url).netloc)
+
+def page_classification(driver: webdriver.Chrome) -> str:
+    """
+    Classify the current page as ok, soft block, captcha or hard block.
+    """
+    return classify_page(driver.title, driver.page_source)
+
 def scroll_to_bottom(driver: webdriver.Chrome, max_scrolls: int = 20) -> None:
     """
     Scroll to the bottom of the page to load all ads.
     
+    The pause after each scroll comes from the politeness controller of
+    the site, so it shortens while the site responds quickly and grows
+    when it starts throttling.
+    
     Args:
         driver: Chrome WebDriver instance
         max_scrolls: Maximum number of scrolls to perform
     """
+    controller = page_controller(driver.current_url)
     scroll_count = 0
     last_height = driver.execute_script("return document.body.scrollHeight")
     
@@ -136,7 +157,7 @@ def scroll_to_bottom(driver: webdriver.Chrome, max_scrolls: int = 20) -> None:
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
         
         # Wait to load page
-        time.sleep(2)
+        controller.wait()
         
         # Calculate new scroll height and compare with last scroll height
         new_height = driver.execute_script("return document.body.scrollHeight")
@@ -149,179 +170,431 @@ def scroll_to_bottom(driver: webdriver.Chrome, max_scrolls: int = 20) -> None:
         
         # Log progress
         logger.info(f"Scrolled {scroll_count} times")
-        
-        # Add a random delay to mimic human behavior
-        time.sleep(1.5 + (scroll_count % 2))
 
-def scrape_blocket() -> List[Dict[str, Any]]:
+def discover_ad_urls(driver: webdriver.Chrome) -> List[str]:
     """
-    Scrape Porsche car ads from Blocket.se with prices over 400,000 SEK.
-    Collects detailed information including images, specifications, and tags.
+    Open the search results page and collect the URLs of all car ads on it.
     
+    Args:
+        driver: Chrome WebDriver instance
+        
     Returns:
-        List[Dict[str, Any]]: List of car ad details
+        List[str]: Unique car ad URLs
+        
+    Raises:
+        BlockedPageError: If the search page was blocked
     """
-    # URL for Porsche cars with price over 400,000 SEK
-    url = "https://www.blocket.se/annonser/hela_sverige/fordon/bilar?cg=1020&q=porsche&r=11&r=10&r=9&r=8&r=7&r=6&r=5&r=4&r=3&r=2&r=1&mys=400000&st=s&ca=11&ca=10&ca=9&ca=8&ca=7&ca=6&ca=5&ca=4&ca=3&ca=2&ca=1&is=1&l=0&md=th"
+    logger.info(f"Starting to scrape Porsche cars over 400,000 SEK from {SEARCH_URL}")
     
-    driver = None
-    car_ads = []
+    # Navigate to the URL
+    logger.info("Navigating to the URL...")
+    with page_controller(SEARCH_URL).slot() as request:
+        driver.get(SEARCH_URL)
+        classification = page_classification(driver)
+        request.mark(blocked=classification != OK)
+    
+    # Wait for the page to load
+    logger.info("Waiting for the page to load...")
     
+    # Take a screenshot for debugging
     try:
-        logger.info(f"Starting to scrape Porsche cars over 400,000 SEK from {url}")
-        driver = setup_driver()
-        
-        # Set page load timeout
-        driver.set_page_load_timeout(60)  # Increased timeout
+        driver.save_screenshot("blocket_page.png")
+        logger.info("Screenshot saved as blocket_page.png")
+    except Exception as e:
+        logger.warning(f"Failed to save screenshot: {str(e)}")
+    
+    # Print page title and URL for debugging
+    logger.info(f"Page title: {driver.title}")
+    logger.info(f"Current URL: {driver.current_url}")
+    
+    # Accept cookies if the dialog appears
+    try:
+        logger.info("Looking for cookie consent dialog...")
+        cookie_selectors = [
+            "button[data-testid='accept-all-cookies-button']",
+            "button.cookie-consent-accept-button",
+            "button.accept-cookies",
+            "button[aria-label='Accept cookies']"
+        ]
         
-        # Navigate to the URL
-        logger.info("Navigating to the URL...")
-        driver.get(url)
+        for cookie_selector in cookie_selectors:
+            try:
+                cookie_button = WebDriverWait(driver, 2).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, cookie_selector))
+                )
+                logger.info(f"Cookie dialog found with selector: {cookie_selector}")
+                cookie_button.click()
+                logger.info("Cookies accepted")
+                time.sleep(2)
+                break
+            except TimeoutException:
+                continue
+    except Exception:
+        logger.info("No cookie dialog found or already accepted")
+    
+    # A block page has no ads; an empty result must not start a run
+    if classification == OK:
+        classification = page_classification(driver)
+    if classification != OK:
+        raise BlockedPageError(SEARCH_URL, classification)
+    
+    # Scroll to load all ads
+    logger.info("Scrolling to load all ads...")
+    scroll_to_bottom(driver, max_scrolls=5)  # Reduced max scrolls for testing
+    
+    # Find all car ad links directly
+    logger.info("Finding car ad links...")
+    
+    # Store all found ad URLs to avoid duplicates
+    ad_urls = set()
+    
+    # Method 1: Find links containing '/annons/' in the URL
+    try:
+        # Get the page source and use a more reliable method to extract links
+        page_source = driver.page_source
         
-        # Wait for the page to load
-        logger.info("Waiting for the page to load...")
+        # Use BeautifulSoup to parse the HTML and find links
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(page_source, 'html.parser')
         
-        # Take a screenshot for debugging
-        try:
-            driver.save_screenshot("blocket_page.png")
-            logger.info("Screenshot saved as blocket_page.png")
-        except Exception as e:
-            logger.warning(f"Failed to save screenshot: {str(e)}")
+        # Find all links
+        links = soup.find_all('a', href=True)
+        logger.info(f"Found {len(links)} links with BeautifulSoup")
         
-        # Print page title and URL for debugging
-        logger.info(f"Page title: {driver.title}")
-        logger.info(f"Current URL: {driver.current_url}")
+        # Filter links that might be car ads
+        for link in links:
+            href = link.get('href', '')
+            if '/annons/' in href and href.startswith('http'):
+                ad_urls.add(href)
         
-        # Accept cookies if the dialog appears
+        logger.info(f"Found {len(ad_urls)} potential car ad URLs with BeautifulSoup")
+    except Exception as e:
+        logger.error(f"Error finding links with BeautifulSoup: {str(e)}")
+    
+    # Method 2: Use Selenium to find links (as a backup)
+    if not ad_urls:
         try:
-            logger.info("Looking for cookie consent dialog...")
-            cookie_selectors = [
-                "button[data-testid='accept-all-cookies-button']",
-                "button.cookie-consent-accept-button",
-                "button.accept-cookies",
-                "button[aria-label='Accept cookies']"
-            ]
+            # Find all links on the page
+            link_elements = driver.find_elements(By.TAG_NAME, "a")
+            logger.info(f"Found {len(link_elements)} links with Selenium")
             
-            for cookie_selector in cookie_selectors:
+            # Extract and filter URLs
+            for link in link_elements:
                 try:
-                    cookie_button = WebDriverWait(driver, 2).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, cookie_selector))
-                    )
-                    logger.info(f"Cookie dialog found with selector: {cookie_selector}")
-                    cookie_button.click()
-                    logger.info("Cookies accepted")
-                    time.sleep(2)
-                    break
-                except TimeoutException:
+                    href = link.get_attribute("href")
+                    if href and '/annons/' in href:
+                        ad_urls.add(href)
+                except:
                     continue
-        except Exception:
-            logger.info("No cookie dialog found or already accepted")
-        
-        # Scroll to load all ads
-        logger.info("Scrolling to load all ads...")
-        scroll_to_bottom(driver, max_scrolls=5)  # Reduced max scrolls for testing
-        
-        # Find all car ad links directly
-        logger.info("Finding car ad links...")
+            
+            logger.info(f"Found {len(ad_urls)} potential car ad URLs with Selenium")
+        except Exception as e:
+            logger.error(f"Error finding links with Selenium: {str(e)}")
+    
+    return sorted(ad_urls)
+
+def discover_with_sessions(sessions: SessionPool, discover: Optional[Callable[[webdriver.Chrome], List[str]]] = None) -> List[str]:
+    """
+    Run discovery, moving on to the next identity when the search page is
+    blocked.
+    
+    Args:
+        sessions: Identity pool to scrape with
+        discover: Discovery of a source; discover_ad_urls() when omitted
         
-        # Store all found ad URLs to avoid duplicates
-        ad_urls = set()
+    Returns:
+        List[str]: Unique car ad URLs
         
-        # Method 1: Find links containing '/annons/' in the URL
+    Raises:
+        BlockedPageError: If the search page was blocked for every try
+    """
+    discover = discover or discover_ad_urls
+    for attempt in range(MAX_BLOCK_RETRIES):
         try:
-            # Get the page source and use a more reliable method to extract links
-            page_source = driver.page_source
-            
-            # Use BeautifulSoup to parse the HTML and find links
-            soup = BeautifulSoup(page_source, 'html.parser')
-            
-            # Find all links
-            links = soup.find_all('a', href=True)
-            logger.info(f"Found {len(links)} links with BeautifulSoup")
-            
-            # Filter links that might be car ads
-            for link in links:
-                href = link.get('href', '')
-                if '/annons/' in href and href.startswith('http'):
-                    ad_urls.add(href)
-            
-            logger.info(f"Found {len(ad_urls)} potential car ad URLs with BeautifulSoup")
-        except Exception as e:
-            logger.error(f"Error finding links with BeautifulSoup: {str(e)}")
+            ad_urls = discover(sessions.driver())
+            sessions.report(OK)
+            return ad_urls
+        except BlockedPageError as e:
+            sessions.report(e.classification)
+            if attempt == MAX_BLOCK_RETRIES - 1:
+                raise
+
+def iter_scraped_ads(sessions: SessionPool, ad_urls: Iterable[str], frontier: Optional[Collection] = None, stats: Optional[Dict[str, Any]] = None, selector_stats: Optional[SelectorStats] = None, scrape_page: Optional[Callable[..., Optional[CarAd]]] = None) -> Iterator[CarAd]:
+    """
+    Scrape ad pages one at a time and yield each record as soon as it is ready.
+    
+    A blocked page is retried with the next healthy identity of the pool.
+    When it stays blocked it is put back in the frontier for a later try
+    instead of being failed, and nothing is yielded, so a block page never
+    overwrites a stored ad.
+    
+    Args:
+        sessions: Identity pool to scrape with
+        ad_urls: URLs of the ad pages to scrape
+        frontier: Frontier collection to record URL states in, if any
+        stats: Run statistics; failed URLs are counted in `failed_urls`,
+            blocked page loads in `blocked_pages`, pages without ad content
+            in `empty_pages` and URLs put back in `requeued_urls`
+        selector_stats: Selector hit statistics shared by all pages; kept
+            in memory for this run when omitted
+        scrape_page: Called with a driver, a URL and the selector stats to
+            scrape one page of a source; scrape_individual_ad() when omitted
         
-        # Method 2: Use Selenium to find links (as a backup)
-        if not ad_urls:
-            try:
-                # Find all links on the page
-                link_elements = driver.find_elements(By.TAG_NAME, "a")
-                logger.info(f"Found {len(link_elements)} links with Selenium")
-                
-                # Extract and filter URLs
-                for link in link_elements:
-                    try:
-                        href = link.get_attribute("href")
-                        if href and '/annons/' in href:
-                            ad_urls.add(href)
-                    except:
-                        continue
-                
-                logger.info(f"Found {len(ad_urls)} potential car ad URLs with Selenium")
-            except Exception as e:
-                logger.error(f"Error finding links with Selenium: {str(e)}")
+    Yields:
+        CarAd: Car ad details
+    """
+    if selector_stats is None:
+        selector_stats = SelectorStats()
+    if stats is None:
+        stats = {}
+    scrape_page = scrape_page or scrape_individual_ad
+    
+    for ad_url in ad_urls:
+        logger.info(f"Processing ad URL: {ad_url}")
+        if frontier is not None:
+            mark_in_progress(frontier, ad_url)
         
-        # Process each unique ad URL
-        logger.info(f"Processing {len(ad_urls)} unique car ad URLs")
-        for ad_url in ad_urls:
+        ad_data = None
+        error = "Failed to load ad page"
+        blocked = None
+        for _ in range(MAX_BLOCK_RETRIES):
             try:
-                logger.info(f"Processing ad URL: {ad_url}")
-                
                 # Visit the individual ad page to get detailed information
-                ad_data = scrape_individual_ad(driver, ad_url)
+                ad_data = scrape_page(sessions.driver(), ad_url, selector_stats)
+                blocked = None
                 if ad_data:
-                    car_ads.append(ad_data)
-                    logger.info(f"Added ad from link: {ad_data.get('title', 'Unknown')}")
-                
+                    sessions.report(OK)
+                break
+            except BlockedPageError as e:
+                blocked = e.classification
+                stats["blocked_pages"] = stats.get("blocked_pages", 0) + 1
+                sessions.report(blocked)
+            except EmptyPageError as e:
+                # Not the identity's fault; another one would get the same
+                logger.warning(str(e))
+                error = str(e)
+                stats["empty_pages"] = stats.get("empty_pages", 0) + 1
+                break
             except Exception as e:
                 logger.error(f"Error processing URL {ad_url}: {str(e)}")
-                continue
+                error = str(e)
+                break
+        
+        selector_stats.page_done()
+        
+        if blocked:
+            if frontier is None or requeue_url(frontier, ad_url, blocked):
+                logger.warning(f"Putting {ad_url} back after {MAX_BLOCK_RETRIES} blocked tries ({blocked})")
+                stats["requeued_urls"] = stats.get("requeued_urls", 0) + 1
+            else:
+                stats["failed_urls"] = stats.get("failed_urls", 0) + 1
+            continue
+        
+        if not ad_data:
+            if frontier is not None:
+                mark_failed(frontier, ad_url, error)
+            stats["failed_urls"] = stats.get("failed_urls", 0) + 1
+            continue
+        
+        logger.info(f"Scraped ad: {ad_data.get('title', 'Unknown')}")
+        yield ad_data
+
+@profiled("scrape")
+def scrape_blocket() -> List[CarAd]:
+    """
+    Scrape Porsche car ads from Blocket.se with prices over 400,000 SEK.
+    Collects detailed information including images, specifications, and tags.
+    
+    This holds every ad in memory; long crawls should use
+    scrape_with_checkpoints(), which streams ads to MongoDB instead.
+    
+    Returns:
+        List[CarAd]: List of car ad details
+    """
+    sessions = SessionPool(setup_driver)
+    car_ads = []
+    
+    try:
+        ad_urls = discover_with_sessions(sessions)
+        
+        # Process each unique ad URL
+        logger.info(f"Processing {len(ad_urls)} unique car ad URLs")
+        car_ads.extend(iter_scraped_ads(sessions, ad_urls))
         
         logger.info(f"Found {len(car_ads)} car ads")
                 
     except Exception as e:
         logger.error(f"Error during scraping: {str(e)}")
     finally:
-        if driver:
-            driver.quit()
-            logger.info("WebDriver closed")
+        sessions.close()
+        logger.info("WebDriver closed")
         
     logger.info(f"Scraping completed. Found {len(car_ads)} car ads.")
     return car_ads
 
-def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
+@profiled("scrape")
+def scrape_with_checkpoints(resume: bool = False, checkpoint_every: int = CHECKPOINT_EVERY) -> Dict[str, Any]:
+    """
+    Scrape Blocket and stream the results to MongoDB in checkpoints.
+    
+    Discovered URLs are stored in a persistent frontier. Scraped ads flow
+    straight into save_to_mongo(), which writes them in batches of
+    `checkpoint_every` ads (or every SAVE_BATCH_MAX_WAIT seconds) and marks
+    their URLs as done, so memory use stays flat and an interrupted run
+    loses at most one batch of work. With `resume` the most recent
+    unfinished run is continued instead of starting a new discovery pass.
+    
+    Args:
+        resume: Continue the last unfinished run if there is one
+        checkpoint_every: Maximum number of ads per batch written to MongoDB
+        
+    Returns:
+        Dict[str, Any]: Statistics about the run
+    """
+    stats = {
+        "run_id": None,
+        "resumed": False,
+        "total_ads": 0,
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "price_changed": 0,
+        "duplicates": 0,
+        "alerts": 0,
+        "errors": 0,
+        "failed_urls": 0,
+        "blocked_pages": 0,
+        "empty_pages": 0,
+        "requeued_urls": 0,
+        "deactivated": 0,
+        "dropped_fields": [],
+        "politeness": {},
+        "sessions": {}
+    }
+    
+    client, db, collection = get_mongodb_connection()
+    
+    if client is None or db is None or collection is None:
+        logger.error("Failed to get MongoDB connection")
+        stats["errors"] += 1
+        return stats
+    
+    sessions = SessionPool(setup_driver)
+    selector_stats = None
+    
+    try:
+        ensure_indexes(collection)
+        frontier = get_frontier_collection(db)
+        selector_stats = SelectorStats(get_selector_stats_collection(db))
+        
+        run_id = get_resumable_run(frontier, BLOCKET) if resume else None
+        if run_id:
+            requeued = reset_in_progress(frontier, run_id)
+            logger.info(f"Resuming run {run_id} ({requeued} interrupted URLs requeued)")
+            stats["resumed"] = True
+        elif resume:
+            logger.info("No unfinished run found, starting a new run")
+        
+        if not run_id:
+            run_id = start_run(frontier, discover_with_sessions(sessions), source=BLOCKET)
+        stats["run_id"] = run_id
+        
+        pending_urls = get_pending_urls(frontier, run_id)
+        logger.info(f"Processing {len(pending_urls)} pending car ad URLs")
+        
+        save_stats = save_to_mongo(
+            iter_scraped_ads(sessions, pending_urls, frontier=frontier, stats=stats, selector_stats=selector_stats),
+            collection=collection,
+            batch_size=checkpoint_every,
+            on_batch=lambda batch: mark_done(frontier, [ad["url"] for ad in batch])
+        )
+        for key in ("total_ads", "inserted", "updated", "unchanged", "price_changed", "duplicates", "alerts", "errors"):
+            stats[key] += save_stats[key]
+        
+        summary = get_run_summary(frontier, run_id)
+        logger.info(f"Run {run_id} finished: {summary}")
+        
+        # Ads that discovery no longer finds have been removed from the site
+        if not summary[IN_PROGRESS] and not summary[PENDING]:
+            seen_ids = [ad_id_from_url(url) for url in get_run_urls(frontier, run_id)]
+            # Only Blocket is crawled here; ads of other sources are left alone
+            scope = {"source": {"$in": [BLOCKET, None]}}
+            stats["deactivated"] = reconcile_active_ads(collection, seen_ids, scope=scope)["deactivated"]
+    except Exception as e:
+        logger.error(f"Error during checkpointed scrape: {str(e)}")
+        stats["errors"] += 1
+    finally:
+        if selector_stats is not None:
+            selector_stats.flush()
+            report = selector_stats.report()
+            stats["dropped_fields"] = report["dropped_fields"]
+            if report["skipped_selectors"]:
+                logger.info(f"Skipped selectors: {report['skipped_selectors']}")
+        stats["politeness"] = snapshot_all()
+        stats["sessions"] = sessions.snapshot()
+        sessions.close()
+        logger.info("WebDriver closed")
+        client.close()
+        logger.info("MongoDB connection closed")
+    
+    return stats
+
+def scrape_individual_ad(driver: webdriver.Chrome, url: str, selector_stats: Optional[SelectorStats] = None) -> Optional[CarAd]:
     """
     Scrape detailed information from an individual car ad page.
     Optimized for Elasticsearch with structured data for low latency.
     
+    The driver is left on the ad page afterwards; the list of ad URLs is
+    collected up front, so there is no need to navigate back to the
+    search results between ads.
+    
     Args:
         driver: Chrome WebDriver instance
         url: URL of the individual ad page
+        selector_stats: Selector hit statistics that decide the order the
+            selectors of each field are tried in; kept for this page only
+            when omitted
         
     Returns:
-        Dict[str, Any]: Detailed car ad data
+        Optional[CarAd]: Detailed car ad data, or None if the page could
+            not be loaded
+        
+    Raises:
+        BlockedPageError: If the page was a block, captcha or consent wall
+        EmptyPageError: If nothing that makes up an ad could be extracted
+            from the page
     """
     logger.info(f"Visiting individual ad page: {url}")
     
-    # Store the current URL to return to the search results later
-    current_url = driver.current_url
+    if not load_ad_page(driver, url):
+        return None
+    return normalize_ad(extract_ad(driver, url, selector_stats))
+
+def load_ad_page(driver: webdriver.Chrome, url: str) -> bool:
+    """
+    Open an ad page, paced by the site's politeness controller, and accept
+    the cookie dialog.
     
-    # Navigate to the individual ad page
+    Args:
+        driver: Chrome WebDriver instance
+        url: URL of the individual ad page
+        
+    Returns:
+        bool: False if the page could not be loaded
+        
+    Raises:
+        BlockedPageError: If the page was a block, captcha or consent wall
+    """
+    # Navigate to the individual ad page, paced by the site's controller
     try:
-        driver.get(url)
-        # Wait for the page to load
-        WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
-        time.sleep(2)  # Additional wait to ensure page is fully loaded
+        with page_controller(url).slot() as request:
+            driver.get(url)
+            # Wait for the page to load
+            WebDriverWait(driver, 15).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
+            )
+            classification = page_classification(driver)
+            request.mark(blocked=classification != OK)
         
         # Handle cookie consent if it appears
         try:
@@ -351,86 +624,108 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             
     except Exception as e:
         logger.error(f"Error navigating to individual ad page: {str(e)}")
-        # Try to go back to the search results
-        driver.get(current_url)
-        return None
+        return False
+    
+    # A consent wall that is still there after accepting counts as a block
+    if classification == OK:
+        classification = page_classification(driver)
+    if classification != OK:
+        raise BlockedPageError(url, classification)
+    
+    return True
+
+def extract_ad(driver: webdriver.Chrome, url: str, selector_stats: Optional[SelectorStats] = None) -> CarAd:
+    """
+    Extract the fields of the Blocket ad page the driver is on.
+    
+    Args:
+        driver: Chrome WebDriver instance on the ad page
+        url: URL of the ad page
+        selector_stats: Selector hit statistics that decide the order the
+            selectors of each field are tried in; kept for this page only
+            when omitted
+        
+    Returns:
+        CarAd: Extracted ad fields
+        
+    Raises:
+        EmptyPageError: If nothing that makes up an ad could be extracted
+    """
+    if selector_stats is None:
+        selector_stats = SelectorStats()
     
     # Initialize ad data with the URL and scrape date
     timestamp = datetime.now()
     
-    ad_data = {
+    ad_data = CarAd(
         # Core fields (always present)
-        "url": url,
-        "id": url.split('/')[-1],  # Extract ID from URL for easier reference
-        "scrape_date": timestamp.isoformat(),
-        "scrape_timestamp": int(timestamp.timestamp()),  # Unix timestamp for easier date math
+        url=url,
+        id=ad_id_from_url(url),  # Extract ID from URL for easier reference
+        scrape_date=timestamp.isoformat(),
+        scrape_timestamp=int(timestamp.timestamp()),  # Unix timestamp for easier date math
         
         # Elasticsearch-specific fields
-        "indexed": False,  # Flag to track if the document has been indexed in Elasticsearch
-        "active": True,    # Flag to track if the ad is still active
-        
-        # Search optimization fields
-        "search_text": "",  # Will concatenate all searchable text
-        "keywords": [],     # Will extract important keywords
-    }
+        indexed=False,  # Flag to track if the document has been indexed in Elasticsearch
+        active=True,    # Flag to track if the ad is still active
+    )
     
     try:
         # Extract title
         try:
             title_selectors = ["h1", "h1.title", "h1[data-testid='ad-title']"]
-            for selector in title_selectors:
-                try:
-                    title_element = WebDriverWait(driver, 5).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                    )
-                    title = title_element.text.strip()
-                    ad_data["title"] = title
-                    ad_data["title_keyword"] = title  # For exact matching
-                    ad_data["search_text"] += f" {title}"
-                    logger.info(f"Title: {title}")
-                    break
-                except:
-                    continue
+            with selector_stats.field("title", title_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        title_element = WebDriverWait(driver, 5).until(
+                            EC.presence_of_element_located(locator(selector))
+                        )
+                        title = title_element.text.strip()
+                        ad_data["title"] = title
+                        logger.info(f"Title: {title}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract title: {str(e)}")
             ad_data["title"] = "Unknown Title"
-            ad_data["title_keyword"] = "Unknown Title"
         
         # Extract price information
         try:
             # Regular price
             price_selectors = ["p.price", "span.price", "[data-testid='price-tag']", ".price-tag"]
-            for selector in price_selectors:
-                try:
-                    price_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    price_text = price_element.text.strip()
-                    ad_data["price_text"] = price_text
-                    ad_data["search_text"] += f" {price_text}"
+            with selector_stats.field("price", price_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        price_element = driver.find_element(*locator(selector))
+                        price_text = price_element.text.strip()
+                        ad_data["price_text"] = price_text
                     
-                    # Clean price (remove "kr" and spaces)
-                    price = ''.join(filter(str.isdigit, price_text))
-                    ad_data["price"] = int(price) if price else None
+                        # Clean price (remove "kr" and spaces)
+                        price = ''.join(filter(str.isdigit, price_text))
+                        ad_data["price"] = int(price) if price else None
                     
-                    # Add price ranges for faceted search
-                    if ad_data["price"]:
-                        price_val = ad_data["price"]
-                        if price_val < 100000:
-                            ad_data["price_range"] = "Under 100,000 kr"
-                        elif price_val < 200000:
-                            ad_data["price_range"] = "100,000 - 200,000 kr"
-                        elif price_val < 300000:
-                            ad_data["price_range"] = "200,000 - 300,000 kr"
-                        elif price_val < 500000:
-                            ad_data["price_range"] = "300,000 - 500,000 kr"
-                        elif price_val < 1000000:
-                            ad_data["price_range"] = "500,000 - 1,000,000 kr"
-                        else:
-                            ad_data["price_range"] = "Over 1,000,000 kr"
+                        # Add price ranges for faceted search
+                        if ad_data["price"]:
+                            price_val = ad_data["price"]
+                            if price_val < 100000:
+                                ad_data["price_range"] = "Under 100,000 kr"
+                            elif price_val < 200000:
+                                ad_data["price_range"] = "100,000 - 200,000 kr"
+                            elif price_val < 300000:
+                                ad_data["price_range"] = "200,000 - 300,000 kr"
+                            elif price_val < 500000:
+                                ad_data["price_range"] = "300,000 - 500,000 kr"
+                            elif price_val < 1000000:
+                                ad_data["price_range"] = "500,000 - 1,000,000 kr"
+                            else:
+                                ad_data["price_range"] = "Over 1,000,000 kr"
                     
-                    logger.info(f"Price: {price_text}")
-                    break
-                except:
-                    continue
+                        logger.info(f"Price: {price_text}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract price: {str(e)}")
             ad_data["price_text"] = "Unknown Price"
@@ -441,25 +736,27 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             vat_selectors = [
                 ".vat-price", 
                 "[data-testid='vat-price']", 
-                "span:contains('Moms')", 
-                "span:contains('moms')",
-                "div:contains('inkl. moms')"
+                # :contains() is not CSS, so text matches are XPath
+                "//span[contains(., 'Moms') or contains(., 'moms')]",
+                "//div[contains(text(), 'inkl. moms')]"
             ]
             
-            for selector in vat_selectors:
-                try:
-                    vat_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    vat_text = vat_element.text.strip()
-                    ad_data["vat_price_text"] = vat_text
+            with selector_stats.field("vat_price", vat_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        vat_element = driver.find_element(*locator(selector))
+                        vat_text = vat_element.text.strip()
+                        ad_data["vat_price_text"] = vat_text
                     
-                    # Extract numeric value if possible
-                    vat_price = ''.join(filter(str.isdigit, vat_text))
-                    ad_data["vat_price"] = int(vat_price) if vat_price else None
+                        # Extract numeric value if possible
+                        vat_price = ''.join(filter(str.isdigit, vat_text))
+                        ad_data["vat_price"] = int(vat_price) if vat_price else None
                     
-                    logger.info(f"VAT Price: {vat_text}")
-                    break
-                except:
-                    continue
+                        logger.info(f"VAT Price: {vat_text}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract VAT price: {str(e)}")
             # VAT price is optional, so we don't set default values
@@ -469,25 +766,27 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             financing_selectors = [
                 ".financing", 
                 "[data-testid='financing']", 
-                "span:contains('Finansiering')", 
-                "div:contains('kr/mån')",
+                "//span[contains(., 'Finansiering')]",
+                "//div[contains(text(), 'kr/mån')]",
                 ".monthly-payment"
             ]
             
-            for selector in financing_selectors:
-                try:
-                    financing_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    financing_text = financing_element.text.strip()
-                    ad_data["financing_text"] = financing_text
+            with selector_stats.field("financing", financing_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        financing_element = driver.find_element(*locator(selector))
+                        financing_text = financing_element.text.strip()
+                        ad_data["financing_text"] = financing_text
                     
-                    # Extract numeric value if possible
-                    financing_amount = ''.join(filter(str.isdigit, financing_text))
-                    ad_data["financing_monthly"] = int(financing_amount) if financing_amount else None
+                        # Extract numeric value if possible
+                        financing_amount = ''.join(filter(str.isdigit, financing_text))
+                        ad_data["financing_monthly"] = int(financing_amount) if financing_amount else None
                     
-                    logger.info(f"Monthly Financing: {financing_text}")
-                    break
-                except:
-                    continue
+                        logger.info(f"Monthly Financing: {financing_text}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract financing information: {str(e)}")
             # Financing info is optional, so we don't set default values
@@ -495,63 +794,57 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
         # Extract location
         try:
             location_selectors = [".location", "span.location", "[data-testid='location']"]
-            for selector in location_selectors:
-                try:
-                    location_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    location = location_element.text.strip()
-                    ad_data["location"] = location
-                    ad_data["location_keyword"] = location  # For exact matching
-                    ad_data["search_text"] += f" {location}"
+            with selector_stats.field("location", location_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        location_element = driver.find_element(*locator(selector))
+                        location = location_element.text.strip()
+                        ad_data["location"] = location
                     
-                    # Try to extract city and region for better filtering
-                    location_parts = location.split(',')
-                    if len(location_parts) >= 1:
-                        ad_data["city"] = location_parts[0].strip()
-                    if len(location_parts) >= 2:
-                        ad_data["region"] = location_parts[1].strip()
+                        # Try to extract city and region for better filtering
+                        location_parts = location.split(',')
+                        if len(location_parts) >= 1:
+                            ad_data["city"] = location_parts[0].strip()
+                        if len(location_parts) >= 2:
+                            ad_data["region"] = location_parts[1].strip()
                         
-                    logger.info(f"Location: {location}")
-                    break
-                except:
-                    continue
+                        logger.info(f"Location: {location}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract location: {str(e)}")
             ad_data["location"] = "Unknown Location"
-            ad_data["location_keyword"] = "Unknown Location"
         
         # Extract images
         try:
             image_selectors = ["img.image", "img[data-testid='image']", ".gallery img", ".carousel img"]
             images = []
-            image_urls = []
             
-            for selector in image_selectors:
-                try:
-                    image_elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                    if image_elements:
-                        for img in image_elements:
-                            src = img.get_attribute("src")
-                            if src and src.startswith("http"):
-                                # Store both the URL and a structured object with metadata
-                                image_urls.append(src)
-                                
-                                # Create a structured image object
-                                image_id = f"{ad_data['id']}_{len(images) + 1}"
-                                image_obj = {
-                                    "id": image_id,
-                                    "url": src,
-                                    "position": len(images) + 1,
-                                    "is_primary": len(images) == 0,  # First image is primary
-                                    "filename": f"{image_id}.jpg",
-                                    "local_path": f"images/{ad_data['id']}/{image_id}.jpg",
-                                    "downloaded": False
-                                }
-                                images.append(image_obj)
-                        break
-                except:
-                    continue
+            with selector_stats.field("images", image_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        image_elements = driver.find_elements(*locator(selector))
+                        if image_elements:
+                            for img in image_elements:
+                                src = img.get_attribute("src")
+                                if src and src.startswith("http"):
+                                    # Create a structured image object
+                                    image_id = f"{ad_data['id']}_{len(images) + 1}"
+                                    image_obj = {
+                                        "id": image_id,
+                                        "url": src,
+                                        "position": len(images) + 1,
+                                        "is_primary": len(images) == 0,  # First image is primary
+                                        "downloaded": False
+                                    }
+                                    images.append(image_obj)
+                            attempt.hit(selector)
+                            break
+                    except:
+                        continue
             
-            ad_data["image_urls"] = image_urls  # Simple list of URLs
             ad_data["images"] = images  # Structured image objects
             ad_data["image_count"] = len(images)
             ad_data["has_images"] = len(images) > 0
@@ -563,7 +856,6 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             logger.info(f"Found {len(images)} images")
         except Exception as e:
             logger.warning(f"Failed to extract images: {str(e)}")
-            ad_data["image_urls"] = []
             ad_data["images"] = []
             ad_data["image_count"] = 0
             ad_data["has_images"] = False
@@ -571,17 +863,18 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
         # Extract description
         try:
             description_selectors = [".description", "[data-testid='description']", ".body-text"]
-            for selector in description_selectors:
-                try:
-                    description_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    description = description_element.text.strip()
-                    ad_data["description"] = description
-                    ad_data["description_length"] = len(description)
-                    ad_data["search_text"] += f" {description}"
-                    logger.info(f"Description length: {len(description)}")
-                    break
-                except:
-                    continue
+            with selector_stats.field("description", description_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        description_element = driver.find_element(*locator(selector))
+                        description = description_element.text.strip()
+                        ad_data["description"] = description
+                        ad_data["description_length"] = len(description)
+                        logger.info(f"Description length: {len(description)}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract description: {str(e)}")
             ad_data["description"] = ""
@@ -599,55 +892,54 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
                 "dl.specs"
             ]
             
-            for selector in spec_selectors:
-                try:
-                    spec_elements = driver.find_elements(By.CSS_SELECTOR, f"{selector} dt, {selector} dd")
-                    if spec_elements and len(spec_elements) > 1:
-                        for i in range(0, len(spec_elements), 2):
-                            if i + 1 < len(spec_elements):
-                                key = spec_elements[i].text.strip()
-                                value = spec_elements[i+1].text.strip()
-                                if key and value:
-                                    specs[key] = value
-                                    
-                                    # Add to search text
-                                    ad_data["search_text"] += f" {key} {value}"
+            with selector_stats.field("specifications", spec_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        spec_elements = driver.find_elements(By.CSS_SELECTOR, f"{selector} dt, {selector} dd")
+                        if spec_elements and len(spec_elements) > 1:
+                            for i in range(0, len(spec_elements), 2):
+                                if i + 1 < len(spec_elements):
+                                    key = spec_elements[i].text.strip()
+                                    value = spec_elements[i+1].text.strip()
+                                    if key and value:
+                                        specs[key] = value
                                     
-                                    # Normalize common specifications
-                                    norm_key = key.lower().replace(" ", "_").replace("-", "_")
-                                    normalized_specs[norm_key] = value
+                                        # Normalize common specifications
+                                        norm_key = normalize_spec_key(key)
+                                        normalized_specs[norm_key] = value
                                     
-                                    # Extract specific fields for filtering
-                                    if "year" in key.lower() or "årsmodell" in key.lower():
-                                        try:
-                                            year_match = re.search(r'\d{4}', value)
-                                            if year_match:
-                                                ad_data["year"] = int(year_match.group(0))
-                                        except:
-                                            pass
+                                        # Extract specific fields for filtering
+                                        if "year" in key.lower() or "årsmodell" in key.lower():
+                                            try:
+                                                year_match = re.search(r'\d{4}', value)
+                                                if year_match:
+                                                    ad_data["year"] = int(year_match.group(0))
+                                            except:
+                                                pass
                                     
-                                    if "mileage" in key.lower() or "miltal" in key.lower():
-                                        try:
-                                            mileage = ''.join(filter(str.isdigit, value))
-                                            if mileage:
-                                                ad_data["mileage"] = int(mileage)
-                                        except:
-                                            pass
+                                        if "mileage" in key.lower() or "miltal" in key.lower():
+                                            try:
+                                                mileage = ''.join(filter(str.isdigit, value))
+                                                if mileage:
+                                                    ad_data["mileage"] = int(mileage)
+                                            except:
+                                                pass
                                     
-                                    if "fuel" in key.lower() or "bränsle" in key.lower():
-                                        ad_data["fuel_type"] = value
+                                        if "fuel" in key.lower() or "bränsle" in key.lower():
+                                            ad_data["fuel_type"] = value
                                     
-                                    if "transmission" in key.lower() or "växellåda" in key.lower():
-                                        ad_data["transmission"] = value
+                                        if "transmission" in key.lower() or "växellåda" in key.lower():
+                                            ad_data["transmission"] = value
                                     
-                                    if "engine" in key.lower() or "motor" in key.lower():
-                                        ad_data["engine"] = value
+                                        if "engine" in key.lower() or "motor" in key.lower():
+                                            ad_data["engine"] = value
                                     
-                                    if "color" in key.lower() or "färg" in key.lower():
-                                        ad_data["color"] = value
-                        break
-                except:
-                    continue
+                                        if "color" in key.lower() or "färg" in key.lower():
+                                            ad_data["color"] = value
+                            attempt.hit(selector)
+                            break
+                    except:
+                        continue
             
             # If no specs found with the above method, try another approach
             if not specs:
@@ -662,14 +954,13 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
                             value = value_element.text.strip()
                             if key and value:
                                 specs[key] = value
-                                ad_data["search_text"] += f" {key} {value}"
                         except:
                             continue
                 except:
                     pass
             
             ad_data["specifications"] = specs
-            ad_data["specs"] = normalized_specs  # Shorter name for normalized specs
+            ad_data["specs"] = normalized_specs  # Used below, not stored (see schema.py)
             logger.info(f"Found {len(specs)} specifications")
         except Exception as e:
             logger.warning(f"Failed to extract specifications: {str(e)}")
@@ -681,18 +972,19 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             tags = []
             tag_selectors = [".tags", ".tag", "[data-testid='tags']", ".badges"]
             
-            for selector in tag_selectors:
-                try:
-                    tag_elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                    if tag_elements:
-                        for tag_element in tag_elements:
-                            tag = tag_element.text.strip()
-                            if tag:
-                                tags.append(tag)
-                                ad_data["search_text"] += f" {tag}"
-                        break
-                except:
-                    continue
+            with selector_stats.field("tags", tag_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        tag_elements = driver.find_elements(*locator(selector))
+                        if tag_elements:
+                            for tag_element in tag_elements:
+                                tag = tag_element.text.strip()
+                                if tag:
+                                    tags.append(tag)
+                            attempt.hit(selector)
+                            break
+                    except:
+                        continue
             
             ad_data["tags"] = tags
             logger.info(f"Found {len(tags)} tags")
@@ -705,40 +997,41 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
             seller = {}
             seller_selectors = [".seller", "[data-testid='seller']", ".contact-info"]
             
-            for selector in seller_selectors:
-                try:
-                    seller_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    if seller_element:
-                        seller_text = seller_element.text.strip()
-                        seller["info"] = seller_text
-                        ad_data["search_text"] += f" {seller_text}"
+            with selector_stats.field("seller", seller_selectors) as attempt:
+                for selector in attempt:
+                    try:
+                        seller_element = driver.find_element(*locator(selector))
+                        if seller_element:
+                            seller_text = seller_element.text.strip()
+                            seller["info"] = seller_text
                         
-                        # Try to extract seller name
-                        try:
-                            name_element = seller_element.find_element(By.CSS_SELECTOR, ".name, .seller-name")
-                            seller["name"] = name_element.text.strip()
-                        except:
-                            pass
+                            # Try to extract seller name
+                            try:
+                                name_element = seller_element.find_element(By.CSS_SELECTOR, ".name, .seller-name")
+                                seller["name"] = name_element.text.strip()
+                            except:
+                                pass
                         
-                        # Try to extract seller type (private/dealer)
-                        try:
-                            type_element = seller_element.find_element(By.CSS_SELECTOR, ".type, .seller-type")
-                            seller_type = type_element.text.strip()
-                            seller["type"] = seller_type
+                            # Try to extract seller type (private/dealer)
+                            try:
+                                type_element = seller_element.find_element(By.CSS_SELECTOR, ".type, .seller-type")
+                                seller_type = type_element.text.strip()
+                                seller["type"] = seller_type
                             
-                            # Add a normalized seller type for filtering
-                            if "privat" in seller_type.lower():
-                                ad_data["seller_type"] = "private"
-                            elif "handel" in seller_type.lower() or "dealer" in seller_type.lower():
-                                ad_data["seller_type"] = "dealer"
-                            else:
-                                ad_data["seller_type"] = "unknown"
-                        except:
-                            pass
+                                # Add a normalized seller type for filtering
+                                if "privat" in seller_type.lower():
+                                    ad_data["seller_type"] = "private"
+                                elif "handel" in seller_type.lower() or "dealer" in seller_type.lower():
+                                    ad_data["seller_type"] = "dealer"
+                                else:
+                                    ad_data["seller_type"] = "unknown"
+                            except:
+                                pass
                         
-                        break
-                except:
-                    continue
+                            attempt.hit(selector)
+                            break
+                    except:
+                        continue
             
             ad_data["seller"] = seller
             logger.info(f"Found seller information: {seller}")
@@ -749,273 +1042,234 @@ def scrape_individual_ad(driver: webdriver.Chrome, url: str) -> Dict[str, Any]:
         # Extract publication date
         try:
             date_selectors = [".date", "[data-testid='publication-date']", ".publication-date"]
-            for selector in date_selectors:
-                try:
-                    date_element = driver.find_element(By.CSS_SELECTOR, selector)
-                    publication_date = date_element.text.strip()
-                    ad_data["publication_date"] = publication_date
-                    
-                    # Try to parse the date for better filtering
+            with selector_stats.field("publication_date", date_selectors) as attempt:
+                for selector in attempt:
                     try:
-                        # Common Swedish date formats
-                        date_formats = [
-                            "%Y-%m-%d",
-                            "%d/%m/%Y",
-                            "%d-%m-%Y",
-                            "%d %B %Y",
-                            "%d %b %Y"
-                        ]
+                        date_element = driver.find_element(*locator(selector))
+                        publication_date = date_element.text.strip()
+                        ad_data["publication_date"] = publication_date
+                    
+                        # Try to parse the date for better filtering
+                        try:
+                            # Common Swedish date formats
+                            date_formats = [
+                                "%Y-%m-%d",
+                                "%d/%m/%Y",
+                                "%d-%m-%Y",
+                                "%d %B %Y",
+                                "%d %b %Y"
+                            ]
                         
-                        parsed_date = None
-                        for fmt in date_formats:
-                            try:
-                                parsed_date = datetime.strptime(publication_date, fmt)
-                                break
-                            except:
-                                continue
+                            parsed_date = None
+                            for fmt in date_formats:
+                                try:
+                                    parsed_date = datetime.strptime(publication_date, fmt)
+                                    break
+                                except:
+                                    continue
                         
-                        if parsed_date:
-                            ad_data["publication_timestamp"] = int(parsed_date.timestamp())
-                    except:
-                        pass
+                            if parsed_date:
+                                ad_data["publication_timestamp"] = int(parsed_date.timestamp())
+                        except:
+                            pass
                     
-                    logger.info(f"Publication date: {publication_date}")
-                    break
-                except:
-                    continue
+                        logger.info(f"Publication date: {publication_date}")
+                        attempt.hit(selector)
+                        break
+                    except:
+                        continue
         except Exception as e:
             logger.warning(f"Failed to extract publication date: {str(e)}")
             ad_data["publication_date"] = "Unknown"
         
-        # Extract car make and model from title or specifications
-        try:
-            # Try to extract from specifications first
-            make = None
-            model = None
-            
-            if "make" in ad_data.get("specs", {}) or "märke" in ad_data.get("specs", {}):
-                make = ad_data["specs"].get("make") or ad_data["specs"].get("märke")
-            
-            if "model" in ad_data.get("specs", {}) or "modell" in ad_data.get("specs", {}):
-                model = ad_data["specs"].get("model") or ad_data["specs"].get("modell")
-            
-            # If not found in specs, try to extract from title
-            if not make or not model:
-                title = ad_data.get("title", "")
-                
-                # Common car makes
-                car_makes = ["Volvo", "Saab", "BMW", "Audi", "Mercedes", "Volkswagen", "VW", 
-                             "Toyota", "Honda", "Mazda", "Ford", "Opel", "Peugeot", "Renault",
-                             "Porsche", "Ferrari", "Lamborghini", "Maserati", "Bentley", "Rolls-Royce"]
-                
-                for car_make in car_makes:
-                    if car_make.lower() in title.lower():
-                        make = car_make
-                        # Try to extract model after make
-                        make_index = title.lower().find(car_make.lower())
-                        if make_index >= 0:
-                            rest_of_title = title[make_index + len(car_make):].strip()
-                            # Extract first word or number as model
-                            model_match = re.search(r'[A-Za-z0-9]+', rest_of_title)
-                            if model_match:
-                                model = model_match.group(0)
-                        break
-            
-            if make:
-                ad_data["make"] = make
-                ad_data["make_keyword"] = make  # For exact matching
-            
-            if model:
-                ad_data["model"] = model
-                ad_data["model_keyword"] = model  # For exact matching
-                
-        except Exception as e:
-            logger.warning(f"Failed to extract car make and model: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error scraping individual ad: {str(e)}")
+    
+    # A block page that was not recognized, or a changed layout, yields an
+    # ad without title, price or specifications; saving it would overwrite
+    # the stored ad
+    if is_empty_ad(ad_data):
+        raise EmptyPageError(url)
+    
+    return ad_data
+
+def normalize_ad(ad_data: CarAd) -> CarAd:
+    """
+    Derive the fields every source shares from the extracted ones: make,
+    model and variant, coordinates and the search fields.
+    
+    Args:
+        ad_data: Extracted ad fields
         
-        # Generate keywords for better search
-        try:
-            keywords = set()
-            
-            # Add make and model
-            if "make" in ad_data:
-                keywords.add(ad_data["make"].lower())
-            if "model" in ad_data:
-                keywords.add(ad_data["model"].lower())
-            
-            # Add year
-            if "year" in ad_data:
-                keywords.add(str(ad_data["year"]))
-            
-            # Add fuel type
-            if "fuel_type" in ad_data:
-                keywords.add(ad_data["fuel_type"].lower())
-            
-            # Add transmission
-            if "transmission" in ad_data:
-                keywords.add(ad_data["transmission"].lower())
-            
-            # Add color
-            if "color" in ad_data:
-                keywords.add(ad_data["color"].lower())
-            
-            # Add seller type
-            if "seller_type" in ad_data:
-                keywords.add(ad_data["seller_type"])
-            
-            # Add tags
-            for tag in ad_data.get("tags", []):
-                keywords.add(tag.lower())
-            
-            ad_data["keywords"] = list(keywords)
-            
-        except Exception as e:
-            logger.warning(f"Failed to generate keywords: {str(e)}")
-            ad_data["keywords"] = []
+    Returns:
+        CarAd: The same ad, completed
+    """
+    # Extract car make, model and variant from title and specifications
+    try:
+        taxonomy = match_ad(ad_data.get("title", ""), ad_data.get("specs", {}))
         
+        for field in ("make", "model", "variant"):
+            if taxonomy[field]:
+                ad_data[field] = taxonomy[field]
+            
     except Exception as e:
-        logger.error(f"Error scraping individual ad: {str(e)}")
+        logger.warning(f"Failed to extract car make and model: {str(e)}")
+    
+    # Coordinates for distance search
+    if "coordinates" not in ad_data and (ad_data.get("city") or ad_data.get("region")):
+        geo = geocode(ad_data.get("city"), ad_data.get("region"))
+        if geo:
+            ad_data.update(geo)
     
-    # Go back to the search results
+    # Build the search fields once from everything extracted above
     try:
-        driver.get(current_url)
-        # Wait for the search results page to load
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
+        ad_data["search_text"] = build_search_text(ad_data)
+        ad_data["keywords"] = build_keywords(ad_data)
     except Exception as e:
-        logger.error(f"Error returning to search results: {str(e)}")
+        logger.warning(f"Failed to build search fields: {str(e)}")
+        ad_data["search_text"] = ""
+        ad_data["keywords"] = []
     
     return ad_data
 
-def save_to_mongo(car_ads: List[Dict[str, Any]]) -> Dict[str, int]:
+def _update_derived(collection: Collection, saved: List[CarAd], previous: Dict[str, Dict[str, Any]], stats: Dict[str, int]) -> None:
     """
-    Save scraped car ads to MongoDB.
+    Bring the collections derived from the car ads up to date with a saved
+    batch: price history, saved-search alerts, market statistics and
+    duplicate clusters.
+    
+    Args:
+        collection: Car ads collection
+        saved: Ads that were written successfully
+        previous: Stored values of the ads before the batch was written
+        stats: Save statistics, updated in place
+    """
+    # Append to the price history of new and changed ads
+    price_changed = []
+    try:
+        price_changed = record_price_changes(collection.database, saved, previous)
+        stats["price_changed"] += len(price_changed)
+    except Exception as e:
+        logger.error(f"Error recording price history: {str(e)}")
+    
+    # Alert saved searches about new and repriced ads
+    try:
+        new_ads = [ad for ad in saved if ad["url"] not in previous]
+        stats["alerts"] += create_alerts(collection.database, new_ads, price_changed)
+    except Exception as e:
+        logger.error(f"Error creating saved-search alerts: {str(e)}")
+    
+    # Keep the per-segment market statistics current
+    try:
+        update_rollups(collection.database, saved, previous)
+    except Exception as e:
+        logger.error(f"Error updating market statistics: {str(e)}")
+    
+    # Group relisted and cross-listed cars
+    try:
+        stats["duplicates"] += assign_clusters(collection, saved)["duplicates"]
+    except Exception as e:
+        logger.error(f"Error assigning duplicate clusters: {str(e)}")
+
+@profiled("save")
+def save_to_mongo(car_ads: Iterable[CarAd], collection: Optional[Collection] = None, batch_size: int = SAVE_BATCH_SIZE, on_batch: Optional[Callable[[List[CarAd]], None]] = None, store: Optional[Store] = None) -> Dict[str, int]:
+    """
+    Save scraped car ads to MongoDB, or to the store configured with
+    STORAGE_BACKEND.
     Handles detailed car information including images, specifications, and tags.
     Optimized for Elasticsearch with structured data for low latency.
     
+    `car_ads` may be a generator: ads are consumed and written in bounded
+    batches with one bulk write each, and their images are handed to
+    background download workers, so only one batch is held in memory.
+    Price history, alerts, market statistics, duplicate clusters and
+    images are only updated in a MongoDB store.
+    
     Args:
-        car_ads: List of car ad details
+        car_ads: Car ad details, as a list or an iterator
+        collection: Existing collection to write to
+        batch_size: Maximum number of ads per bulk write
+        on_batch: Called with the successfully written ads of every batch
+        store: Existing store to write to. When neither a store nor a
+            collection is given, the configured store is opened, with
+            indexes, and closed afterwards.
         
     Returns:
         Dict[str, int]: Statistics about the operation
     """
     stats = {
-        "total_ads": len(car_ads),
+        "total_ads": 0,
         "inserted": 0,
         "updated": 0,
         "unchanged": 0,
+        "price_changed": 0,
+        "duplicates": 0,
+        "alerts": 0,
         "errors": 0
     }
     
-    client, db, collection = get_mongodb_connection()
+    owned = store is None and collection is None
+    if collection is not None:
+        store = MongoStore(collection)
+    elif store is None:
+        store = open_store()
+        
+        if store is None:
+            logger.error("Failed to get MongoDB connection")
+            stats["errors"] = len(car_ads) if isinstance(car_ads, list) else 1
+            return stats
     
-    if client is None or db is None or collection is None:
-        logger.error("Failed to get MongoDB connection")
-        stats["errors"] = len(car_ads)
-        return stats
+    image_queue = ImageDownloadQueue(store.collection) if store.collection is not None else None
     
     try:
-        # Create indexes for better performance
-        try:
-            # Create a text index on searchable fields
-            collection.create_index([
-                ("title", "text"), 
-                ("description", "text"),
-                ("search_text", "text")
-            ])
+        for batch in batched(car_ads, batch_size, SAVE_BATCH_MAX_WAIT):
+            stats["total_ads"] += len(batch)
+            if image_queue:
+                image_queue.attach_processed(batch)
+            previous = store.load_current_values(batch, CONTRIBUTION_FIELDS)
+            saved = store.save_batch(batch, stats)
             
-            # Create indexes for common query fields
-            collection.create_index("url", unique=True)  # Unique constraint on URL
-            collection.create_index("id", unique=True)   # Unique constraint on ID
-            collection.create_index("price")             # For price filtering and sorting
-            collection.create_index("year")              # For year filtering and sorting
-            collection.create_index("mileage")           # For mileage filtering and sorting
-            collection.create_index("make")              # For make filtering
-            collection.create_index("model")             # For model filtering
-            collection.create_index("fuel_type")         # For fuel type filtering
-            collection.create_index("transmission")      # For transmission filtering
-            collection.create_index("seller_type")       # For seller type filtering
-            collection.create_index("scrape_timestamp")  # For recency filtering
-            collection.create_index("publication_timestamp")  # For publication date filtering
-            collection.create_index("indexed")           # For tracking Elasticsearch indexing
-            collection.create_index("active")            # For tracking active ads
+            if store.collection is not None:
+                _update_derived(store.collection, saved, previous, stats)
             
-            logger.info("Created MongoDB indexes")
-        except Exception as e:
-            logger.warning(f"Failed to create indexes: {str(e)}")
-        
-        for ad in car_ads:
-            try:
-                # Use URL as unique identifier
-                result = collection.update_one(
-                    {"url": ad["url"]},
-                    {"$set": ad},
-                    upsert=True
-                )
-                
-                if result.matched_count == 0 and result.upserted_id:
-                    stats["inserted"] += 1
-                    logger.info(f"Inserted new ad: {ad.get('title', 'Unknown')}")
-                elif result.modified_count > 0:
-                    stats["updated"] += 1
-                    logger.info(f"Updated existing ad: {ad.get('title', 'Unknown')}")
-                else:
-                    stats["unchanged"] += 1
-                    logger.info(f"Ad unchanged: {ad.get('title', 'Unknown')}")
-                
-                # Download images if available
-                if ad.get("images") and len(ad["images"]) > 0:
-                    try:
-                        # Create directory for images if it doesn't exist
-                        ad_id = ad.get("id")
-                        image_dir = Path(f"images/{ad_id}")
-                        image_dir.mkdir(parents=True, exist_ok=True)
-                        
-                        # Download each image
-                        for img in ad["images"]:
-                            img_url = img.get("url")
-                            img_path = img.get("local_path")
-                            
-                            if img_url and img_path and not os.path.exists(img_path):
-                                try:
-                                    # Download the image
-                                    response = requests.get(img_url, stream=True, timeout=10)
-                                    if response.status_code == 200:
-                                        with open(img_path, 'wb') as f:
-                                            for chunk in response.iter_content(1024):
-                                                f.write(chunk)
-                                        
-                                        # Update the image object
-                                        img["downloaded"] = True
-                                        logger.info(f"Downloaded image: {img_path}")
-                                        
-                                        # Update the image in MongoDB
-                                        collection.update_one(
-                                            {"url": ad["url"]},
-                                            {"$set": {f"images.$[elem].downloaded": True}},
-                                            array_filters=[{"elem.url": img_url}]
-                                        )
-                                except Exception as img_err:
-                                    logger.error(f"Error downloading image {img_url}: {str(img_err)}")
-                    except Exception as img_dir_err:
-                        logger.error(f"Error setting up image directory: {str(img_dir_err)}")
-                
-            except Exception as e:
-                logger.error(f"Error saving ad to MongoDB: {str(e)}")
-                stats["errors"] += 1
+            # Download and process new images in the background
+            if image_queue:
+                for ad in saved:
+                    image_queue.enqueue(ad)
+            
+            if on_batch and saved:
+                on_batch(saved)
                 
     except Exception as e:
         logger.error(f"Error saving to MongoDB: {str(e)}")
         stats["errors"] += 1
     finally:
-        if client:
-            client.close()
-            logger.info("MongoDB connection closed")
+        if image_queue:
+            image_queue.close()
+        if owned:
+            store.close()
             
     return stats
 
 if __name__ == "__main__":
-    # For testing locally
-    car_ads = scrape_blocket()
-    stats = save_to_mongo(car_ads)
-    print(f"Scraping results: {stats}") 
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Scrape car ads from Blocket and save them to MongoDB")
+    parser.add_argument("--resume", action="store_true", help="Continue the last unfinished run")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="Number of ads to scrape between flushes to MongoDB")
+    args = parser.parse_args()
+    
+    if STORAGE_BACKEND == "sqlite":
+        # The frontier lives in MongoDB; a local run is a single pass
+        sessions = SessionPool(setup_driver)
+        try:
+            stats = save_to_mongo(
+                iter_scraped_ads(sessions, discover_with_sessions(sessions)),
+                batch_size=args.checkpoint_every
+            )
+        finally:
+            sessions.close()
+    else:
+        stats = scrape_with_checkpoints(resume=args.resume, checkpoint_every=args.checkpoint_every)
+    print(f"Scraping results: {stats}")
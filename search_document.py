@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Build the search fields of a car ad.
+The free-text `search_text` field and the `keywords` list are assembled once
+from the scraped fields instead of being concatenated piece by piece.
+"""
+
+import re
+from typing import Dict, Any, List, Iterator
+
+# Word tokens, including Swedish letters and digits
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Fields that get their own keyword entry
+KEYWORD_FIELDS = ["make", "model", "variant", "year", "fuel_type", "transmission", "color", "seller_type"]
+
+def _search_text_parts(ad: Dict[str, Any]) -> Iterator[str]:
+    """
+    Yield the text fragments that make up the search text of an ad.
+
+    Title and description are left out: both are indexed as fields of their
+    own in MongoDB, and Elasticsearch copies them into `search_text` with
+    `copy_to`, so storing them again here would only duplicate them.
+    """
+    for field in ("price_text", "location"):
+        if ad.get(field):
+            yield ad[field]
+
+    for key, value in (ad.get("specifications") or {}).items():
+        yield key
+        yield value
+
+    yield from ad.get("tags") or []
+
+    seller_info = (ad.get("seller") or {}).get("info")
+    if seller_info:
+        yield seller_info
+
+def build_search_text(ad: Dict[str, Any]) -> str:
+    """
+    Build the search text of an ad from its fields.
+
+    Tokens are deduplicated case-insensitively, keeping the first occurrence,
+    so repeated words from specs, tags and seller info are stored once.
+
+    Args:
+        ad: Car ad details
+
+    Returns:
+        str: Space separated unique tokens
+    """
+    seen = set()
+    tokens = []
+
+    for part in _search_text_parts(ad):
+        for token in TOKEN_PATTERN.findall(str(part)):
+            folded = token.lower()
+            if folded not in seen:
+                seen.add(folded)
+                tokens.append(token)
+
+    return " ".join(tokens)
+
+def build_keywords(ad: Dict[str, Any]) -> List[str]:
+    """
+    Build the list of exact-match keywords of an ad.
+
+    Args:
+        ad: Car ad details
+
+    Returns:
+        List[str]: Unique lowercase keywords
+    """
+    keywords = []
+
+    for field in KEYWORD_FIELDS:
+        if ad.get(field):
+            keywords.append(str(ad[field]).lower())
+
+    for tag in ad.get("tags") or []:
+        keywords.append(tag.lower())
+
+    # Remove duplicates while keeping the order stable between scrapes
+    return list(dict.fromkeys(keywords))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Hit statistics for the CSS selectors of the ad page extractor.
+Every field of scrape_individual_ad() has a list of candidate selectors.
+SelectorStats remembers which of them matched, tries the historically best
+one first, stops trying selectors that keep missing and warns when the
+success rate of a field falls, which usually means Blocket changed its
+page layout. The counters are kept in MongoDB so they carry over between
+runs.
+"""
+
+import os
+import logging
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from selenium.webdriver.common.by import By
+
+logger = logging.getLogger(__name__)
+
+# Skip a selector after this many misses in a row
+MAX_CONSECUTIVE_MISSES = int(os.getenv('SELECTOR_MAX_MISSES', 25))
+
+# Try skipped selectors again every this many pages, in case they recover
+RETRY_SKIPPED_EVERY = int(os.getenv('SELECTOR_RETRY_EVERY', 100))
+
+# Number of recent pages the success rate of a field is measured over
+DROP_WINDOW = int(os.getenv('SELECTOR_DROP_WINDOW', 20))
+
+# Warn when the recent success rate of a field is this much below its
+# historical rate
+DROP_THRESHOLD = float(os.getenv('SELECTOR_DROP_THRESHOLD', 0.4))
+
+# Write the counters to MongoDB every this many pages
+FLUSH_EVERY = 20
+
+# Selector name used for the per-field counters
+FIELD_TOTAL = "*"
+
+def get_selector_stats_collection(database: Database) -> Collection:
+    """
+    Get the selector statistics collection.
+
+    Args:
+        database: MongoDB database
+
+    Returns:
+        Collection: Selector statistics collection
+    """
+    return database[os.getenv('SELECTOR_STATS_COLLECTION_NAME', 'selector_stats')]
+
+def locator(selector: str) -> Tuple[str, str]:
+    """
+    Get the Selenium locator of a selector.
+
+    Selectors starting with "/" are XPath expressions, which can match on
+    text; everything else is CSS.
+
+    Args:
+        selector: CSS selector or XPath expression
+
+    Returns:
+        Tuple[str, str]: Locator for find_element() and expected conditions
+    """
+    return (By.XPATH, selector) if selector.startswith("/") else (By.CSS_SELECTOR, selector)
+
+class FieldAttempt:
+    """
+    Extraction of one field on one page.
+
+    Iterate over it to get the selectors to try, in order, and call hit()
+    with the selector that worked. Selectors handed out before the hit
+    count as misses when the `with` block ends.
+    """
+
+    def __init__(self, stats: "SelectorStats", field: str, selectors: List[str]):
+        self._stats = stats
+        self._field = field
+        self._selectors = selectors
+        self._tried = []
+        self._hit = None
+
+    def __enter__(self) -> "FieldAttempt":
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        for selector in self._stats.order(self._field, self._selectors):
+            self._tried.append(selector)
+            yield selector
+
+    def hit(self, selector: str) -> None:
+        self._hit = selector
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self._stats.record(self._field, self._tried, self._hit)
+        return False
+
+class SelectorStats:
+    """
+    Persistent per-field, per-selector hit counters.
+    """
+
+    def __init__(self, collection: Optional[Collection] = None):
+        """
+        Args:
+            collection: Collection to load and store the counters in; the
+                counters only live in memory when omitted
+        """
+        self.collection = collection
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0, "consecutive_misses": 0})
+        self.pending = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.recent = defaultdict(lambda: deque(maxlen=DROP_WINDOW))
+        self.dropped_fields = set()
+        self.pages = 0
+
+        if collection is not None:
+            for doc in collection.find({}):
+                self.counters[(doc["field"], doc["selector"])].update({
+                    "hits": doc.get("hits", 0),
+                    "misses": doc.get("misses", 0),
+                    "consecutive_misses": doc.get("consecutive_misses", 0),
+                })
+
+    def field(self, field: str, selectors: List[str]) -> FieldAttempt:
+        """
+        Start extracting a field.
+
+        Args:
+            field: Field name
+            selectors: Candidate selectors in their default order
+
+        Returns:
+            FieldAttempt: Context manager yielding the selectors to try
+        """
+        return FieldAttempt(self, field, selectors)
+
+    def _rate(self, field: str, selector: str) -> float:
+        counter = self.counters[(field, selector)]
+        # Smoothed, so untried selectors start at 0.5
+        return (counter["hits"] + 1) / (counter["hits"] + counter["misses"] + 2)
+
+    def order(self, field: str, selectors: List[str]) -> List[str]:
+        """
+        Sort selectors by hit rate and leave out the ones that keep missing.
+
+        Args:
+            field: Field name
+            selectors: Candidate selectors in their default order
+
+        Returns:
+            List[str]: Selectors to try, best first
+        """
+        retry = RETRY_SKIPPED_EVERY and self.pages % RETRY_SKIPPED_EVERY == 0
+        active = [
+            selector for selector in selectors
+            if retry or self.counters[(field, selector)]["consecutive_misses"] < MAX_CONSECUTIVE_MISSES
+        ]
+        # Never give up on a field entirely
+        return sorted(active or selectors, key=lambda selector: -self._rate(field, selector))
+
+    def record(self, field: str, tried: List[str], hit: Optional[str]) -> None:
+        """
+        Count the outcome of a field extraction.
+
+        Args:
+            field: Field name
+            tried: Selectors that were tried, in order
+            hit: Selector that matched, or None
+        """
+        for selector in tried:
+            counter = self.counters[(field, selector)]
+            if selector == hit:
+                counter["hits"] += 1
+                counter["consecutive_misses"] = 0
+                self.pending[(field, selector)]["hits"] += 1
+            else:
+                counter["misses"] += 1
+                counter["consecutive_misses"] += 1
+                self.pending[(field, selector)]["misses"] += 1
+                if counter["consecutive_misses"] == MAX_CONSECUTIVE_MISSES:
+                    logger.warning(f"Selector {selector!r} for {field} missed {MAX_CONSECUTIVE_MISSES} times in a row, skipping it")
+
+        # Historical rate before this page, then the per-field counter
+        total = self.counters[(field, FIELD_TOTAL)]
+        tries = total["hits"] + total["misses"]
+        baseline = total["hits"] / tries if tries else None
+
+        key = "hits" if hit else "misses"
+        total[key] += 1
+        self.pending[(field, FIELD_TOTAL)][key] += 1
+
+        recent = self.recent[field]
+        recent.append(hit is not None)
+        if baseline is not None and len(recent) == DROP_WINDOW and field not in self.dropped_fields:
+            recent_rate = sum(recent) / len(recent)
+            if recent_rate < baseline - DROP_THRESHOLD:
+                self.dropped_fields.add(field)
+                logger.warning(
+                    f"Success rate of {field} dropped to {recent_rate:.0%} over the last {DROP_WINDOW} pages "
+                    f"(historically {baseline:.0%}); the page layout may have changed"
+                )
+
+    def page_done(self) -> None:
+        """
+        Count a scraped page and write the counters periodically.
+        """
+        self.pages += 1
+        if self.pages % FLUSH_EVERY == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the counters collected since the last flush to MongoDB.
+        """
+        if self.collection is None or not self.pending:
+            return
+
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {"_id": f"{field}|{selector}"},
+                {
+                    "$inc": increments,
+                    "$set": {
+                        "field": field,
+                        "selector": selector,
+                        "consecutive_misses": self.counters[(field, selector)]["consecutive_misses"],
+                        "updated_at": now
+                    }
+                },
+                upsert=True
+            )
+            for (field, selector), increments in self.pending.items()
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            self.pending.clear()
+        except Exception as e:
+            logger.error(f"Error saving selector statistics: {str(e)}")
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Summarize fields whose success rate dropped and skipped selectors.
+
+        Returns:
+            Dict[str, Any]: Dropped fields and skipped selectors per field
+        """
+        skipped = defaultdict(list)
+        for (field, selector), counter in self.counters.items():
+            if selector != FIELD_TOTAL and counter["consecutive_misses"] >= MAX_CONSECUTIVE_MISSES:
+                skipped[field].append(selector)
+
+        return {"dropped_fields": sorted(self.dropped_fields), "skipped_selectors": dict(skipped)}
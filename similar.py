@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""
+"Similar cars" lookup over an in-memory nearest-neighbour index.
+Every active ad is turned into a feature vector: scaled log price, year
+and log mileage, and weighted one-hots of make, model, fuel type and
+transmission. The vectors are held in a NumPy-backed ball tree. Ads that
+the Elasticsearch sync indexed after the tree was built are kept in a
+small buffer that is searched by brute force, and the tree is rebuilt
+once the buffer and removed ads exceed a share of it, so refreshing after
+a sync only reads the ads that sync touched.
+"""
+
+import os
+import math
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+import numpy as np
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for ads indexed by a sync
+REFRESH_SECONDS = float(os.getenv('SIMILAR_REFRESH_SECONDS', 60))
+
+# Share of the tree size that new and removed ads may reach before a rebuild
+REBUILD_RATIO = float(os.getenv('SIMILAR_REBUILD_RATIO', 0.2))
+
+# Points per ball tree leaf and the number of leaves a lookup visits; more
+# leaves give exact results more often at a higher latency
+LEAF_SIZE = 32
+MAX_LEAVES = int(os.getenv('SIMILAR_MAX_LEAVES', 64))
+
+DEFAULT_K = 8
+MAX_K = 50
+
+# Change of a numeric feature that counts as one unit of distance
+NUMERIC_SCALES = {
+    "price": 0.4,    # log price, about 50%
+    "year": 4.0,     # years
+    "mileage": 1.0,  # log mileage, about 170%
+}
+
+# Distance between two ads that differ in a categorical feature; another
+# model of the same make is rarely closer than the same model
+CATEGORY_WEIGHTS = {
+    "model": 3.0,
+    "make": 2.0,
+    "fuel_type": 1.0,
+    "transmission": 0.7,
+}
+
+# Fields read from MongoDB and returned for each similar ad
+LISTING_FIELDS = [
+    "id", "url", "title", "make", "model", "year", "mileage", "price", "price_text",
+    "fuel_type", "transmission", "city", "region", "primary_thumbnail", "cluster_id",
+]
+
+def _numeric(ad: Dict[str, Any], name: str) -> Optional[float]:
+    value = ad.get(name)
+    if not isinstance(value, (int, float)) or value <= 0:
+        return None
+    if name == "year":
+        return float(value)
+    return math.log1p(value)
+
+def _category(ad: Dict[str, Any], name: str) -> Optional[str]:
+    if name == "model":
+        # Models are only comparable within a make
+        if not ad.get("make") or not ad.get("model"):
+            return None
+        return f"{ad['make']}/{ad['model']}".lower()
+    value = ad.get(name)
+    return str(value).lower() if value else None
+
+class FeatureBuilder:
+    """
+    Turns ads into feature vectors.
+
+    The vocabularies of the categorical features and the values used for
+    missing numbers are taken from the ads the builder is fitted on;
+    categories seen later get an all-zero one-hot until the next fit.
+    """
+
+    def __init__(self, ads: Iterable[Dict[str, Any]]):
+        """
+        Args:
+            ads: Ads to fit the vocabularies and medians on
+        """
+        values = {name: [] for name in NUMERIC_SCALES}
+        categories = {name: set() for name in CATEGORY_WEIGHTS}
+        for ad in ads:
+            for name in NUMERIC_SCALES:
+                value = _numeric(ad, name)
+                if value is not None:
+                    values[name].append(value)
+            for name in CATEGORY_WEIGHTS:
+                value = _category(ad, name)
+                if value is not None:
+                    categories[name].add(value)
+
+        self.medians = {name: float(np.median(found)) if found else 0.0 for name, found in values.items()}
+        self.offsets = {}
+        offset = len(NUMERIC_SCALES)
+        for name in CATEGORY_WEIGHTS:
+            self.offsets[name] = {value: offset + i for i, value in enumerate(sorted(categories[name]))}
+            offset += len(categories[name])
+        self.dimensions = offset
+
+    def vector(self, ad: Dict[str, Any]) -> np.ndarray:
+        """
+        Build the feature vector of an ad.
+
+        Args:
+            ad: Car ad
+
+        Returns:
+            np.ndarray: float32 vector of length `dimensions`
+        """
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for i, (name, scale) in enumerate(NUMERIC_SCALES.items()):
+            value = _numeric(ad, name)
+            vector[i] = (self.medians[name] if value is None else value) / scale
+        for name, weight in CATEGORY_WEIGHTS.items():
+            column = self.offsets[name].get(_category(ad, name))
+            if column is not None:
+                # Two different one-hots are `weight` apart
+                vector[column] = weight / math.sqrt(2)
+        return vector
+
+    def group(self, ad: Dict[str, Any]) -> int:
+        """
+        Get the group of an ad in the ball tree: its model column, or -1.
+        """
+        return self.offsets["model"].get(_category(ad, "model"), -1)
+
+class BallTree:
+    """
+    Ball tree over the rows of a matrix.
+
+    Nodes are stored in flat arrays: a center and radius per node and the
+    range of the node in the permuted row order.
+    """
+
+    def __init__(self, points: np.ndarray, groups: Optional[np.ndarray] = None, group_distance: float = 0.0,
+                 leaf_size: int = LEAF_SIZE):
+        """
+        Args:
+            points: One row per point
+            groups: Group code per row, -1 for none. Nodes are split
+                between groups before they are split geometrically, so
+                every node holds a contiguous range of groups.
+            group_distance: Least distance between two points of different
+                groups, used to skip nodes without the group of the query
+            leaf_size: Maximum number of points per leaf
+        """
+        self.points = points
+        self.order = np.arange(len(points))
+        self.group_distance = group_distance
+        centers, radii, ranges, children, group_ranges = [], [], [], [], []
+
+        stack = [(0, len(points), -1, 0)]
+        while stack:
+            start, end, parent, side = stack.pop()
+            node = len(centers)
+            if parent >= 0:
+                children[parent][side] = node
+
+            rows = self.order[start:end]
+            block = points[rows]
+            center = block.mean(axis=0)
+            centers.append(center)
+            radii.append(float(np.sqrt(((block - center) ** 2).sum(axis=1).max())) if len(rows) else 0.0)
+            ranges.append((start, end))
+            children.append([-1, -1])
+            codes = groups[rows] if groups is not None and len(rows) else None
+            group_ranges.append((int(codes.min()), int(codes.max())) if codes is not None else (-1, -1))
+            if end - start <= leaf_size:
+                continue
+
+            half = (end - start) // 2
+            if codes is not None and codes.min() != codes.max():
+                # Split at the group boundary closest to the middle
+                split = np.argsort(codes, kind="stable")
+                boundaries = np.flatnonzero(np.diff(codes[split])) + 1
+                half = int(boundaries[np.abs(boundaries - half).argmin()])
+            else:
+                # Split along the line between two far apart points
+                far_a = block[((block - center) ** 2).sum(axis=1).argmax()]
+                far_b = block[((block - far_a) ** 2).sum(axis=1).argmax()]
+                split = np.argpartition(block @ (far_b - far_a), half)
+            self.order[start:end] = rows[split]
+            stack.append((start, start + half, node, 0))
+            stack.append((start + half, end, node, 1))
+
+        self.centers = np.array(centers, dtype=np.float32)
+        self.radii = np.array(radii, dtype=np.float32)
+        self.ranges = ranges
+        self.children = children
+        self.group_ranges = group_ranges
+
+    def query(self, x: np.ndarray, k: int, accept, group: int = -1,
+              max_leaves: Optional[int] = MAX_LEAVES) -> List[Tuple[float, int]]:
+        """
+        Find the nearest points to x, visiting the closest balls first.
+
+        Args:
+            x: Query vector
+            k: Number of neighbours
+            group: Group code of the query, -1 for none
+            accept: Called with an array of rows, returns a boolean mask
+                of the rows that may be returned
+            max_leaves: Stop after this many leaves; None for an exact search
+
+        Returns:
+            List[Tuple[float, int]]: (distance, row), nearest first
+        """
+        best: List[Tuple[float, int]] = []  # max-heap of (-distance, row)
+        leaves = 0
+        frontier = [(0.0, 0)]
+        while frontier:
+            bound, node = heapq.heappop(frontier)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+
+            left, right = self.children[node]
+            if left >= 0:
+                pair = [left, right]
+                gaps = np.sqrt(((self.centers[pair] - x) ** 2).sum(axis=1)) - self.radii[pair]
+                for child, gap in zip(pair, gaps.tolist()):
+                    low, high = self.group_ranges[child]
+                    if group >= 0 and low >= 0 and not low <= group <= high:
+                        gap = max(gap, self.group_distance)
+                    if len(best) < k or gap < -best[0][0]:
+                        heapq.heappush(frontier, (max(gap, 0.0), child))
+                continue
+
+            start, end = self.ranges[node]
+            rows = self.order[start:end]
+            rows = rows[accept(rows)]
+            distances = np.sqrt(((self.points[rows] - x) ** 2).sum(axis=1))
+            for distance, row in zip(distances.tolist(), rows.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, row))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, row))
+
+            leaves += 1
+            if max_leaves is not None and leaves >= max_leaves:
+                break
+        return sorted((-distance, row) for distance, row in best)
+
+class SimilarIndex:
+    """
+    Nearest-neighbour index over active ads.
+    """
+
+    def __init__(self, ads: List[Dict[str, Any]], watermark: Optional[str] = None):
+        """
+        Args:
+            ads: Active ads with LISTING_FIELDS
+            watermark: Latest `last_indexed` of the ads
+        """
+        self.watermark = watermark
+        self._build(ads)
+
+    def _build(self, ads: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        self.builder = FeatureBuilder(ads)
+        self.ads = list(ads)
+        self.vectors = np.zeros((max(len(ads), 1) * 2, self.builder.dimensions), dtype=np.float32)
+        for row, ad in enumerate(self.ads):
+            self.vectors[row] = self.builder.vector(ad)
+        self.alive = np.ones(len(self.vectors), dtype=bool)
+        self.rows = {ad["id"]: row for row, ad in enumerate(self.ads)}
+        self.tree_size = len(self.ads)
+        self.removed = 0
+        groups = np.array([self.builder.group(ad) for ad in self.ads], dtype=np.int32)
+        self.tree = BallTree(self.vectors[:self.tree_size], groups, CATEGORY_WEIGHTS["model"]) if self.ads else None
+        logger.info(f"Built similar-cars index over {len(self.ads)} ads in {time.perf_counter() - started:.2f}s")
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def update(self, ads: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Add, replace or remove ads after a sync.
+
+        Args:
+            ads: Changed ads; ads with `active` False are removed
+
+        Returns:
+            Dict[str, int]: Statistics about the update
+        """
+        stats = {"added": 0, "removed": 0, "rebuilt": 0}
+        for ad in ads:
+            row = self.rows.pop(ad["id"], None)
+            if row is not None:
+                self.alive[row] = False
+                self.removed += 1
+                stats["removed"] += 1
+            if ad.get("active") is False:
+                continue
+
+            row = len(self.ads)
+            if row == len(self.vectors):
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+                self.alive = np.concatenate([self.alive, np.ones(len(self.alive), dtype=bool)])
+            self.vectors[row] = self.builder.vector(ad)
+            self.alive[row] = True
+            self.ads.append({field: ad.get(field) for field in LISTING_FIELDS})
+            self.rows[ad["id"]] = row
+            stats["added"] += 1
+
+        pending = len(self.ads) - self.tree_size + self.removed
+        if pending > REBUILD_RATIO * max(self.tree_size, 1):
+            self._build([self.ads[row] for row in self.rows.values()])
+            stats["rebuilt"] = 1
+        return stats
+
+    def similar(self, ad_id: str, k: int = DEFAULT_K, exact: bool = False) -> List[Dict[str, Any]]:
+        """
+        Find the active ads most similar to an ad.
+
+        Ads in the same duplicate cluster as the ad are left out.
+
+        Args:
+            ad_id: ID of the ad
+            k: Number of ads
+            exact: Search the whole tree instead of MAX_LEAVES leaves
+
+        Returns:
+            List[Dict[str, Any]]: Similar ads, closest first, with their distance
+
+        Raises:
+            KeyError: If the ad is not in the index
+        """
+        row = self.rows[ad_id]
+        x = self.vectors[row]
+        cluster = self.ads[row].get("cluster_id")
+
+        def accept(rows):
+            mask = self.alive[rows] & (rows != row)
+            if cluster:
+                mask &= np.array([self.ads[r].get("cluster_id") != cluster for r in rows.tolist()], dtype=bool)
+            return mask
+
+        found = []
+        if self.tree:
+            found = self.tree.query(x, k, accept, self.builder.group(self.ads[row]), None if exact else MAX_LEAVES)
+
+        # Ads added since the last build
+        extra = np.arange(self.tree_size, len(self.ads))
+        if len(extra):
+            extra = extra[accept(extra)]
+            distances = np.sqrt(((self.vectors[extra] - x) ** 2).sum(axis=1))
+            found = sorted(found + list(zip(distances.tolist(), extra.tolist())))[:k]
+
+        return [{**self.ads[r], "distance": round(distance, 3)} for distance, r in found]
+
+def _active_ads(collection: Collection, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    projection = {field: 1 for field in LISTING_FIELDS + ["active", "last_indexed"]}
+    projection["_id"] = 0
+    return list(collection.find(query, projection))
+
+def load_index(collection: Collection) -> SimilarIndex:
+    """
+    Build the index over the active ads that the sync has indexed.
+
+    Args:
+        collection: Car ads collection
+
+    Returns:
+        SimilarIndex: New index
+    """
+    ads = _active_ads(collection, {"active": {"$ne": False}, "indexed": True})
+    watermark = max((ad["last_indexed"] for ad in ads if ad.get("last_indexed")), default=None)
+    return SimilarIndex([{field: ad.get(field) for field in LISTING_FIELDS} for ad in ads], watermark)
+
+def refresh_index(index: SimilarIndex, collection: Collection) -> Dict[str, int]:
+    """
+    Apply the ads that were indexed since the index was built or refreshed.
+
+    Args:
+        index: Index to update
+        collection: Car ads collection
+
+    Returns:
+        Dict[str, int]: Statistics about the update
+    """
+    query = {"indexed": True}
+    if index.watermark:
+        query["last_indexed"] = {"$gt": index.watermark}
+    changed = _active_ads(collection, query)
+    if not changed:
+        return {"added": 0, "removed": 0, "rebuilt": 0}
+
+    index.watermark = max(ad.get("last_indexed") or "" for ad in changed) or index.watermark
+    stats = index.update(changed)
+    logger.info(f"Refreshed similar-cars index: {stats}")
+    return stats
+
+_index: Optional[SimilarIndex] = None
+_refreshed_at = 0.0
+_index_lock = threading.Lock()
+
+def get_similar_index(collection: Optional[Collection] = None) -> SimilarIndex:
+    """
+    Get the index shared by all requests of this process, applying the
+    latest sync at most every REFRESH_SECONDS.
+
+    Args:
+        collection: Car ads collection; a shared connection is opened when
+            omitted
+
+    Returns:
+        SimilarIndex: Shared index
+    """
+    global _index, _refreshed_at
+    with _index_lock:
+        if _index is not None and time.monotonic() - _refreshed_at < REFRESH_SECONDS:
+            return _index
+
+        if collection is None:
+            collection = _get_collection()
+        if _index is None:
+            _index = load_index(collection)
+        else:
+            try:
+                refresh_index(_index, collection)
+            except Exception as e:
+                logger.error(f"Error refreshing similar-cars index: {str(e)}")
+        _refreshed_at = time.monotonic()
+        return _index
+
+_collection = None
+
+def _get_collection() -> Collection:
+    global _collection
+    if _collection is None:
+        from mongodb import get_mongodb_connection
+
+        client, _, collection = get_mongodb_connection()
+        if client is None:
+            raise ConnectionError("Failed to connect to MongoDB")
+        _collection = collection
+    return _collection
+
+def find_similar(ad_id: str, k: int = DEFAULT_K, collection: Optional[Collection] = None) -> Dict[str, Any]:
+    """
+    Find the active ads most similar to an ad.
+
+    Args:
+        ad_id: ID of the ad
+        k: Number of ads (max MAX_K)
+        collection: Car ads collection; the shared connection is used when
+            omitted
+
+    Returns:
+        Dict[str, Any]: Response with the similar ads and the lookup time
+
+    Raises:
+        ValueError: If k is invalid
+        LookupError: If the ad is not an indexed active ad
+        ConnectionError: If MongoDB is not reachable
+    """
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"k must be between 1 and {MAX_K}")
+
+    index = get_similar_index(collection)
+    started = time.perf_counter()
+    try:
+        results = index.similar(str(ad_id), k)
+    except KeyError:
+        raise LookupError(f"Ad {ad_id} is not an indexed active ad")
+    return {
+        "success": True,
+        "ad_id": str(ad_id),
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+def benchmark(ads: int = 50000, lookups: int = 1000, k: int = DEFAULT_K) -> Dict[str, float]:
+    """
+    Time building the index over random ads and looking up similar ads.
+
+    Args:
+        ads: Number of ads
+        lookups: Number of lookups
+        k: Number of similar ads per lookup
+
+    Returns:
+        Dict[str, float]: Build seconds, lookup milliseconds and the share
+            of lookups whose result equals an exact search
+    """
+    import json
+
+    from taxonomy import TAXONOMY_PATH
+
+    with open(TAXONOMY_PATH, encoding="utf-8") as f:
+        catalogue = json.load(f)["makes"]
+    models = [(make, model) for make, entry in catalogue.items() for model in entry["models"]]
+    rng = np.random.default_rng(1)
+
+    new_prices = rng.lognormal(13.0, 0.5, size=len(models))
+
+    sample = []
+    for i in range(ads):
+        choice = rng.integers(len(models))
+        make, model = models[choice]
+        age = int(rng.integers(0, 30))
+        sample.append({
+            "id": str(i), "make": make, "model": model, "year": 2025 - age,
+            "price": int(new_prices[choice] * 0.88 ** age * rng.lognormal(0, 0.2)),
+            "mileage": int(rng.integers(500, 2000) * max(age, 1)),
+            "fuel_type": ["Bensin", "Diesel", "El", "Hybrid"][rng.integers(4)],
+            "transmission": ["Automat", "Manuell"][rng.integers(2)],
+        })
+
+    started = time.perf_counter()
+    index = SimilarIndex(sample)
+    build_seconds = time.perf_counter() - started
+
+    queries = [str(i) for i in rng.integers(ads, size=lookups)]
+    started = time.perf_counter()
+    results = [index.similar(ad_id, k) for ad_id in queries]
+    elapsed = time.perf_counter() - started
+
+    exact = sum(
+        [ad["id"] for ad in found] == [ad["id"] for ad in index.similar(ad_id, k, exact=True)]
+        for ad_id, found in zip(queries[:200], results)
+    )
+    return {
+        "build_seconds": round(build_seconds, 2),
+        "lookup_ms": round(elapsed / lookups * 1000, 2),
+        "exact_share": round(exact / min(lookups, 200), 3),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Similar cars lookup")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    lookup_parser = subparsers.add_parser("lookup", help="Find ads similar to an ad")
+    lookup_parser.add_argument("ad_id")
+    lookup_parser.add_argument("-k", type=int, default=DEFAULT_K)
+    bench_parser = subparsers.add_parser("benchmark", help="Time the index on random ads")
+    bench_parser.add_argument("--ads", type=int, default=50000)
+    bench_parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        print(f"Benchmark results: {benchmark(args.ads, args.lookups)}")
+    else:
+        for ad in find_similar(args.ad_id, args.k)["results"]:
+            print(f"{ad['distance']:6.3f}  {ad['title']}  {ad.get('price')} kr  {ad['url']}")
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Marketplace source adapters and a scheduler that crawls them side by side.
+A source knows how to discover ad URLs, load and extract an ad page, and
+how to turn an ad URL into an ID in its own namespace. run_sources()
+crawls every source in its own thread, with its own identity pool and
+per-host politeness controllers, and merges the ads into a single
+save_to_mongo() stage. Every source therefore shares the normalisation,
+bulk save, price history, dedup, alerts and Elasticsearch sync stages.
+"""
+
+import os
+import queue
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Iterator
+
+from selenium import webdriver
+from pymongo.collection import Collection
+
+from scraper import (
+    BLOCKET, setup_driver, discover_ad_urls, load_ad_page, extract_ad, normalize_ad,
+    discover_with_sessions, iter_scraped_ads, save_to_mongo, ensure_indexes,
+)
+from frontier import (
+    get_frontier_collection, start_run, get_resumable_run, reset_in_progress,
+    get_pending_urls, get_run_urls, get_run_summary, mark_done, PENDING, IN_PROGRESS
+)
+from schema import ad_id_from_url
+from records import CarAd
+from reconcile import reconcile_active_ads
+from selector_stats import SelectorStats, get_selector_stats_collection
+from politeness import get_controller, snapshot_all
+from profiling import profiled
+from sessions import SessionPool
+
+logger = logging.getLogger(__name__)
+
+# Sources crawled by default, comma-separated
+DEFAULT_SOURCES = os.getenv('SCRAPER_SOURCES', 'blocket')
+
+# Scraped ads waiting for the save stage; crawlers wait when it is full
+SOURCE_QUEUE_SIZE = int(os.getenv('SOURCE_QUEUE_SIZE', 200))
+
+class Source(ABC):
+    """
+    A marketplace to crawl.
+
+    Subclasses implement discover(), fetch() and extract(); the ads they
+    extract are completed by normalize_ad() like the ads of every source.
+    """
+
+    # Name of the source, also the namespace of its ad IDs
+    name = ""
+    # Hosts of the source, each paced by its own politeness controller
+    hosts: List[str] = []
+    # Starting delay between requests to the hosts; INITIAL_DELAY when None
+    initial_delay: Optional[float] = None
+
+    @abstractmethod
+    def discover(self, driver: webdriver.Chrome) -> List[str]:
+        """
+        Collect the URLs of the ads to scrape.
+
+        Raises:
+            BlockedPageError: If the search page was blocked
+        """
+
+    @abstractmethod
+    def fetch(self, driver: webdriver.Chrome, url: str) -> bool:
+        """
+        Load an ad page.
+
+        Returns:
+            bool: False if the page could not be loaded
+
+        Raises:
+            BlockedPageError: If the page was blocked
+        """
+
+    @abstractmethod
+    def extract(self, driver: webdriver.Chrome, url: str, selector_stats: SelectorStats) -> CarAd:
+        """
+        Extract the fields of the loaded ad page.
+
+        Returns:
+            CarAd: Extracted ad fields
+
+        Raises:
+            EmptyPageError: If nothing that makes up an ad was found
+        """
+
+    def native_id(self, url: str) -> str:
+        """
+        Get the ID the marketplace gives an ad.
+        """
+        return ad_id_from_url(url)
+
+    def ad_id(self, url: str) -> str:
+        """
+        Get the stored ID of an ad, e.g. "bytbil:1234".
+        """
+        return f"{self.name}:{self.native_id(url)}"
+
+    def scope(self) -> Dict[str, Any]:
+        """
+        Get the filter of the stored ads of this source.
+        """
+        return {"source": self.name}
+
+    def create_driver(self, user_agent: Optional[str] = None, proxy: Optional[str] = None) -> webdriver.Chrome:
+        """
+        Start a browser for one identity of the source's pool.
+        """
+        return setup_driver(user_agent, proxy)
+
+    def selector_stats(self, database) -> SelectorStats:
+        """
+        Get the selector statistics of the source; in memory only unless
+        a source stores them.
+        """
+        return SelectorStats()
+
+    def scrape(self, driver: webdriver.Chrome, url: str, selector_stats: Optional[SelectorStats] = None) -> Optional[CarAd]:
+        """
+        Load, extract and normalize one ad page.
+
+        Returns:
+            Optional[CarAd]: Car ad, or None if the page could not
+                be loaded
+        """
+        if not self.fetch(driver, url):
+            return None
+        ad_data = self.extract(driver, url, selector_stats or SelectorStats())
+        ad_data["id"] = self.ad_id(url)
+        ad_data["source"] = self.name
+        return normalize_ad(ad_data)
+
+class BlocketSource(Source):
+    """
+    Blocket.se car ads.
+    """
+
+    name = BLOCKET
+    hosts = ["www.blocket.se"]
+
+    def discover(self, driver: webdriver.Chrome) -> List[str]:
+        return discover_ad_urls(driver)
+
+    def fetch(self, driver: webdriver.Chrome, url: str) -> bool:
+        return load_ad_page(driver, url)
+
+    def extract(self, driver: webdriver.Chrome, url: str, selector_stats: SelectorStats) -> CarAd:
+        return extract_ad(driver, url, selector_stats)
+
+    def ad_id(self, url: str) -> str:
+        # Blocket ads were stored before there were other sources and keep
+        # their bare IDs
+        return self.native_id(url)
+
+    def scope(self) -> Dict[str, Any]:
+        return {"source": {"$in": [self.name, None]}}
+
+    def selector_stats(self, database) -> SelectorStats:
+        return SelectorStats(get_selector_stats_collection(database))
+
+# Source name -> adapter class
+SOURCES = {
+    BlocketSource.name: BlocketSource,
+}
+
+def get_sources(names: Optional[str] = None) -> List[Source]:
+    """
+    Create the adapters of the named sources.
+
+    Args:
+        names: Comma-separated source names; SCRAPER_SOURCES when omitted
+
+    Returns:
+        List[Source]: Source adapters
+
+    Raises:
+        ValueError: If a source is unknown
+    """
+    sources = []
+    for name in (names or DEFAULT_SOURCES).split(","):
+        name = name.strip()
+        if name not in SOURCES:
+            raise ValueError(f"Unknown source '{name}', expected one of {', '.join(SOURCES)}")
+        sources.append(SOURCES[name]())
+    return sources
+
+# Put on the ad queue by a crawler that has finished
+_FINISHED = object()
+
+def crawl_source(source: Source, frontier: Collection, ads: "queue.Queue", stats: Dict[str, Any],
+                 stop: threading.Event, resume: bool = False) -> None:
+    """
+    Discover and scrape the ads of one source onto a shared queue.
+
+    Args:
+        source: Source to crawl
+        frontier: Frontier collection
+        ads: Queue of the save stage; _FINISHED is put last
+        stats: Statistics of this source
+        stop: Set when the save stage has stopped
+        resume: Continue the source's last unfinished run if there is one
+    """
+    for host in source.hosts:
+        get_controller(host, source.initial_delay)
+    sessions = SessionPool(source.create_driver)
+    selector_stats = source.selector_stats(frontier.database)
+
+    try:
+        run_id = get_resumable_run(frontier, source.name) if resume else None
+        if run_id:
+            requeued = reset_in_progress(frontier, run_id)
+            logger.info(f"Resuming {source.name} run {run_id} ({requeued} interrupted URLs requeued)")
+            stats["resumed"] = True
+        else:
+            run_id = start_run(frontier, discover_with_sessions(sessions, source.discover), source=source.name)
+        stats["run_id"] = run_id
+
+        pending_urls = get_pending_urls(frontier, run_id)
+        logger.info(f"Processing {len(pending_urls)} pending {source.name} URLs")
+        for ad in iter_scraped_ads(sessions, pending_urls, frontier=frontier, stats=stats,
+                                   selector_stats=selector_stats, scrape_page=source.scrape):
+            if stop.is_set():
+                break
+            ads.put(ad)
+            stats["scraped"] += 1
+    except Exception as e:
+        logger.error(f"Error crawling {source.name}: {str(e)}")
+        stats["errors"] += 1
+    finally:
+        selector_stats.flush()
+        stats["dropped_fields"] = selector_stats.report()["dropped_fields"]
+        stats["sessions"] = sessions.snapshot()
+        sessions.close()
+        ads.put(_FINISHED)
+
+def _stop_crawlers(ads: "queue.Queue", crawlers: List[threading.Thread], stop: threading.Event) -> None:
+    # Empty the queue until every crawler has finished, so none stays
+    # blocked on a full queue once the save stage has stopped
+    stop.set()
+    while any(crawler.is_alive() for crawler in crawlers):
+        try:
+            ads.get(timeout=1)
+        except queue.Empty:
+            pass
+
+def _merged(ads: "queue.Queue", crawlers: int) -> Iterator[CarAd]:
+    finished = 0
+    while finished < crawlers:
+        ad = ads.get()
+        if ad is _FINISHED:
+            finished += 1
+        else:
+            yield ad
+
+@profiled("scrape")
+def run_sources(sources: Optional[List[Source]] = None, resume: bool = False, checkpoint_every: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Crawl several sources in parallel into one save stage.
+
+    Each source is crawled in its own thread with its own identities, so
+    a slow or blocked marketplace does not hold up the others. When the
+    run of a source has no unfinished URLs left, its stored ads that
+    discovery no longer found are deactivated.
+
+    Args:
+        sources: Sources to crawl; SCRAPER_SOURCES when omitted
+        resume: Continue each source's last unfinished run if there is one
+        checkpoint_every: Maximum number of ads per bulk write
+
+    Returns:
+        Dict[str, Any]: Statistics of the save stage, and per source
+    """
+    from mongodb import get_mongodb_connection
+    from scraper import CHECKPOINT_EVERY
+
+    sources = sources if sources is not None else get_sources()
+    stats: Dict[str, Any] = {"sources": {}, "errors": 0}
+
+    client, db, collection = get_mongodb_connection()
+    if client is None:
+        logger.error("Failed to get MongoDB connection")
+        stats["errors"] += 1
+        return stats
+
+    ads = queue.Queue(maxsize=SOURCE_QUEUE_SIZE)
+    stop = threading.Event()
+    crawlers = []
+    try:
+        ensure_indexes(collection)
+        frontier = get_frontier_collection(db)
+
+        for source in sources:
+            source_stats = stats["sources"][source.name] = {
+                "run_id": None, "resumed": False, "scraped": 0, "failed_urls": 0,
+                "blocked_pages": 0, "empty_pages": 0, "requeued_urls": 0, "deactivated": 0, "errors": 0,
+            }
+            crawler = threading.Thread(
+                target=crawl_source, args=(source, frontier, ads, source_stats, stop, resume),
+                name=f"crawl-{source.name}", daemon=True
+            )
+            crawler.start()
+            crawlers.append(crawler)
+
+        save_stats = save_to_mongo(
+            _merged(ads, len(crawlers)),
+            collection=collection,
+            batch_size=checkpoint_every or CHECKPOINT_EVERY,
+            on_batch=lambda batch: mark_done(frontier, [ad["url"] for ad in batch])
+        )
+        stats.update({key: value for key, value in save_stats.items() if key != "errors"})
+        stats["errors"] += save_stats["errors"]
+
+        _stop_crawlers(ads, crawlers, stop)
+
+        for source in sources:
+            source_stats = stats["sources"][source.name]
+            run_id = source_stats["run_id"]
+            if not run_id:
+                continue
+            summary = get_run_summary(frontier, run_id)
+            logger.info(f"{source.name} run {run_id} finished: {summary}")
+            if not summary[IN_PROGRESS] and not summary[PENDING]:
+                seen_ids = [source.ad_id(url) for url in get_run_urls(frontier, run_id)]
+                source_stats["deactivated"] = reconcile_active_ads(collection, seen_ids, scope=source.scope())["deactivated"]
+    except Exception as e:
+        logger.error(f"Error running sources: {str(e)}")
+        stats["errors"] += 1
+    finally:
+        _stop_crawlers(ads, crawlers, stop)
+        stats["politeness"] = snapshot_all()
+        client.close()
+        logger.info("MongoDB connection closed")
+
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crawl marketplaces in parallel into MongoDB")
+    parser.add_argument("--sources", default=DEFAULT_SOURCES, help=f"Comma-separated sources out of {', '.join(SOURCES)}")
+    parser.add_argument("--resume", action="store_true", help="Continue each source's last unfinished run")
+    parser.add_argument("--checkpoint-every", type=int, help="Number of ads per bulk write")
+    args = parser.parse_args()
+
+    print(f"Scraping results: {run_sources(get_sources(args.sources), args.resume, args.checkpoint_every)}")
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Storage backends for car ads.
+save_to_mongo() and the Elasticsearch sync read and write ads through a
+store. MongoStore wraps the Atlas collection. SQLiteStore keeps the same
+documents in a local SQLite file in WAL mode, one transaction per batch,
+with indexes on the fields MongoDB indexes, so single-node runs,
+benchmarks and offline analysis work at disk speed without a network
+round trip per batch. A local database can be exported to MongoDB later.
+Price history, alerts, market statistics, duplicate clusters and image
+assets live in further MongoDB collections and are only kept up to date
+when saving to MongoDB.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Iterator
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+from schema import compact_document
+from price_history import TRACKED_FIELDS, load_current_values
+from records import CarAd, FIELDS
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Backend used when no store is given: mongodb or sqlite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongodb')
+
+# Database file of the sqlite backend
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'car_ads.db')
+
+# Documents read per query when paging through the sqlite backend
+SQLITE_PAGE_SIZE = 500
+
+# Fields that later stages write and a scraped ad never has; every other
+# field an ad is saved without is dropped from the stored ad, such as a
+# price taken off the ad, derived fields left over from older versions
+# and the deactivation time of ads that are listed again
+KEPT_ON_SAVE = ["first_seen_timestamp", "cluster_id", "last_indexed"]
+
+# Ads that still have to be sent to Elasticsearch
+UNINDEXED_QUERY = {"$or": [{"indexed": {"$ne": True}}, {"indexed": {"$exists": False}}]}
+
+# Columns of the sqlite backend generated from the stored document, each
+# indexed like the MongoDB field of the same name
+SQLITE_COLUMNS = {
+    "id": ("TEXT", "json_extract(doc, '$.id')"),
+    "price": ("INTEGER", "json_extract(doc, '$.price')"),
+    "year": ("INTEGER", "json_extract(doc, '$.year')"),
+    "mileage": ("INTEGER", "json_extract(doc, '$.mileage')"),
+    "make": ("TEXT", "json_extract(doc, '$.make')"),
+    "model": ("TEXT", "json_extract(doc, '$.model')"),
+    "fuel_type": ("TEXT", "json_extract(doc, '$.fuel_type')"),
+    "transmission": ("TEXT", "json_extract(doc, '$.transmission')"),
+    "seller_type": ("TEXT", "json_extract(doc, '$.seller_type')"),
+    "scrape_timestamp": ("INTEGER", "json_extract(doc, '$.scrape_timestamp')"),
+    "publication_timestamp": ("INTEGER", "json_extract(doc, '$.publication_timestamp')"),
+    "indexed": ("INTEGER", "coalesce(json_extract(doc, '$.indexed'), 0)"),
+    "active": ("INTEGER", "json_extract(doc, '$.active')"),
+    "cluster_id": ("TEXT", "json_extract(doc, '$.cluster_id')"),
+}
+
+def removed_fields(doc: Dict[str, Any]) -> List[str]:
+    """
+    Get the fields a save of a document removes from the stored ad.
+
+    Args:
+        doc: Compact document of a scraped ad
+
+    Returns:
+        List[str]: Ad fields that are not set in the document, except
+            KEPT_ON_SAVE
+    """
+    return [field for field in FIELDS if field not in doc and field not in KEPT_ON_SAVE]
+
+def ensure_indexes(collection: Collection) -> None:
+    """
+    Create the indexes used for searching and syncing car ads.
+
+    Args:
+        collection: Car ads collection
+    """
+    try:
+        # Create a text index on searchable fields
+        collection.create_index([
+            ("title", "text"),
+            ("description", "text"),
+            ("search_text", "text")
+        ])
+
+        # Create indexes for common query fields
+        collection.create_index("url", unique=True)  # Unique constraint on URL
+        collection.create_index("id", unique=True)   # Unique constraint on ID
+        collection.create_index("price")             # For price filtering and sorting
+        collection.create_index("year")              # For year filtering and sorting
+        collection.create_index("mileage")           # For mileage filtering and sorting
+        collection.create_index("make")              # For make filtering
+        collection.create_index("model")             # For model filtering
+        collection.create_index("fuel_type")         # For fuel type filtering
+        collection.create_index("transmission")      # For transmission filtering
+        collection.create_index("seller_type")       # For seller type filtering
+        collection.create_index("scrape_timestamp")  # For recency filtering
+        collection.create_index("publication_timestamp")  # For publication date filtering
+        collection.create_index("indexed")           # For tracking Elasticsearch indexing
+        collection.create_index("active")            # For tracking active ads
+        collection.create_index("cluster_id")        # For grouping duplicate listings
+
+        logger.info("Created MongoDB indexes")
+    except Exception as e:
+        logger.warning(f"Failed to create indexes: {str(e)}")
+
+class Store(ABC):
+    """
+    Where car ads are saved and read back for the Elasticsearch sync.
+    """
+
+    # MongoDB database and collection for the stages that need them; None
+    # for backends without MongoDB
+    database = None
+    collection = None
+
+    @abstractmethod
+    def load_current_values(self, ads: List[CarAd], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the stored values of ads before they are overwritten.
+
+        Args:
+            ads: Car ads about to be saved
+            fields: Fields to load besides the price history fields
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Stored values by ad URL; new ads are
+                missing
+        """
+
+    @abstractmethod
+    def save_batch(self, batch: List[CarAd], stats: Dict[str, int]) -> List[CarAd]:
+        """
+        Upsert a batch of car ads by URL in the compact layout.
+
+        Args:
+            batch: Car ad details
+            stats: Save statistics, updated in place
+
+        Returns:
+            List[CarAd]: Ads that were written successfully
+        """
+
+    @abstractmethod
+    def count_unindexed(self) -> int:
+        """
+        Count the stored ads that still have to be sent to Elasticsearch.
+        """
+
+    @abstractmethod
+    def iter_unindexed(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the stored ads that still have to be sent to
+        Elasticsearch.
+        """
+
+    @abstractmethod
+    def mark_indexed(self, doc: Dict[str, Any], last_indexed: str) -> None:
+        """
+        Flag a document from iter_unindexed() as sent to Elasticsearch.
+        """
+
+    def close(self) -> None:
+        pass
+
+class MongoStore(Store):
+    """
+    Car ads in a MongoDB collection.
+    """
+
+    def __init__(self, collection: Collection, client=None):
+        """
+        Args:
+            collection: Car ads collection
+            client: Client to close with the store, if the store owns it
+        """
+        self.collection = collection
+        self.database = collection.database
+        self.client = client
+
+    def load_current_values(self, ads: List[CarAd], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        return load_current_values(self.collection, ads, fields)
+
+    def save_batch(self, batch: List[CarAd], stats: Dict[str, int]) -> List[CarAd]:
+        # One bulk write per batch
+        operations = []
+        for ad in batch:
+            doc = compact_document(ad)
+            operations.append(UpdateOne(
+                {"url": ad["url"]},
+                {
+                    "$set": doc,
+                    "$unset": {field: "" for field in removed_fields(doc)},
+                    # Start of the listing, for days-on-market statistics
+                    "$setOnInsert": {"first_seen_timestamp": ad["scrape_timestamp"]}
+                },
+                upsert=True
+            ))
+
+        try:
+            details = self.collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                logger.error(f"Error saving ad to MongoDB: {write_error.get('errmsg')}")
+
+        failed = {write_error["index"] for write_error in details.get("writeErrors", [])}
+        inserted = details.get("nUpserted", 0)
+        updated = details.get("nModified", 0)
+
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["unchanged"] += len(batch) - len(failed) - inserted - updated
+        stats["errors"] += len(failed)
+        logger.info(f"Saved batch of {len(batch)} ads: {inserted} inserted, {updated} updated, {len(failed)} failed")
+
+        return [ad for i, ad in enumerate(batch) if i not in failed]
+
+    def count_unindexed(self) -> int:
+        return self.collection.count_documents(UNINDEXED_QUERY)
+
+    def iter_unindexed(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.collection.find(UNINDEXED_QUERY))
+
+    def mark_indexed(self, doc: Dict[str, Any], last_indexed: str) -> None:
+        self.collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"indexed": True, "last_indexed": last_indexed}}
+        )
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            logger.info("MongoDB connection closed")
+
+class SQLiteStore(Store):
+    """
+    Car ads in a local SQLite database, one JSON document per ad.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        """
+        Args:
+            path: Database file, created if missing
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        # Readers do not block the writer, and a commit does not wait for
+        # the disk; a crash can lose the last transactions but not corrupt
+        # the database
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        columns = ",\n".join(
+            f"{name} {column_type} GENERATED ALWAYS AS ({expression}) VIRTUAL"
+            for name, (column_type, expression) in SQLITE_COLUMNS.items()
+        )
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS car_ads (\nurl TEXT PRIMARY KEY,\ndoc TEXT NOT NULL,\n{columns})")
+            for name in SQLITE_COLUMNS:
+                unique = "UNIQUE " if name == "id" else ""
+                self.connection.execute(f"CREATE {unique}INDEX IF NOT EXISTS car_ads_{name} ON car_ads ({name})")
+
+    def _load(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        docs = {}
+        for i in range(0, len(urls), SQLITE_PAGE_SIZE):
+            chunk = urls[i:i + SQLITE_PAGE_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            for url, doc in self.connection.execute(f"SELECT url, doc FROM car_ads WHERE url IN ({placeholders})", chunk):
+                docs[url] = json.loads(doc)
+        return docs
+
+    def load_current_values(self, ads: List[CarAd], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        names = TRACKED_FIELDS + (fields or [])
+        return {
+            url: {"url": url, **{name: doc[name] for name in names if name in doc}}
+            for url, doc in self._load([ad["url"] for ad in ads]).items()
+        }
+
+    def save_batch(self, batch: List[CarAd], stats: Dict[str, int]) -> List[CarAd]:
+        # The same update as the MongoDB upsert, in one transaction per batch
+        stored = self._load([ad["url"] for ad in batch])
+        saved = []
+        inserted = updated = failed = 0
+
+        with self.connection:
+            for ad in batch:
+                doc = compact_document(ad)
+                old = stored.get(ad["url"])
+                if old is None:
+                    doc["first_seen_timestamp"] = ad["scrape_timestamp"]
+                else:
+                    removed = set(removed_fields(doc))
+                    doc = {**{key: value for key, value in old.items() if key not in removed}, **doc}
+                    if doc == old:
+                        saved.append(ad)
+                        continue
+
+                try:
+                    self.connection.execute(
+                        "INSERT INTO car_ads (url, doc) VALUES (?, ?) ON CONFLICT (url) DO UPDATE SET doc = excluded.doc",
+                        (ad["url"], json.dumps(doc, ensure_ascii=False))
+                    )
+                except sqlite3.IntegrityError as e:
+                    logger.error(f"Error saving ad to SQLite: {str(e)}")
+                    failed += 1
+                    continue
+
+                if old is None:
+                    inserted += 1
+                else:
+                    updated += 1
+                stored[ad["url"]] = doc
+                saved.append(ad)
+
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["unchanged"] += len(batch) - failed - inserted - updated
+        stats["errors"] += failed
+        logger.info(f"Saved batch of {len(batch)} ads: {inserted} inserted, {updated} updated, {failed} failed")
+        return saved
+
+    def _pages(self, where: str) -> Iterator[List[Dict[str, Any]]]:
+        # Page by rowid, which updates of the documents do not change
+        last_rowid = 0
+        while True:
+            rows = self.connection.execute(
+                f"SELECT rowid, doc FROM car_ads WHERE {where} AND rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, SQLITE_PAGE_SIZE)
+            ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield [json.loads(doc) for _, doc in rows]
+
+    def count_unindexed(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM car_ads WHERE indexed = 0").fetchone()[0]
+
+    def iter_unindexed(self) -> Iterator[Dict[str, Any]]:
+        for page in self._pages("indexed = 0"):
+            yield from page
+            # Commit the flags set by mark_indexed() for this page
+            self.connection.commit()
+        self.connection.commit()
+
+    def mark_indexed(self, doc: Dict[str, Any], last_indexed: str) -> None:
+        self.connection.execute(
+            "UPDATE car_ads SET doc = json_set(doc, '$.indexed', json('true'), '$.last_indexed', ?) WHERE url = ?",
+            (last_indexed, doc["url"])
+        )
+
+    def iter_documents(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Iterate over all stored documents, a page at a time.
+        """
+        return self._pages("1 = 1")
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+def open_store(backend: Optional[str] = None, path: Optional[str] = None) -> Optional[Store]:
+    """
+    Open the configured store; a MongoDB collection gets its indexes.
+
+    Args:
+        backend: mongodb or sqlite; STORAGE_BACKEND when omitted
+        path: Database file of the sqlite backend; SQLITE_PATH when omitted
+
+    Returns:
+        Optional[Store]: Store, or None if MongoDB could not be reached
+
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        return SQLiteStore(path or SQLITE_PATH)
+    if backend != "mongodb":
+        raise ValueError(f"Unknown storage backend '{backend}', expected mongodb or sqlite")
+
+    from mongodb import get_mongodb_connection
+
+    client, _, collection = get_mongodb_connection()
+    if client is None:
+        return None
+    ensure_indexes(collection)
+    return MongoStore(collection, client)
+
+def export_to_mongo(store: SQLiteStore, collection: Collection) -> Dict[str, int]:
+    """
+    Copy the ads of a local database to MongoDB, one bulk write per page.
+
+    Stored ads are upserted by URL with every field of the local document,
+    including the indexed flag, so ads that were already synced from the
+    local database are not sent to Elasticsearch again.
+
+    Args:
+        store: Local database
+        collection: Car ads collection
+
+    Returns:
+        Dict[str, int]: Statistics about the export
+    """
+    stats = {"exported": 0, "batches": 0, "errors": 0}
+    for docs in store.iter_documents():
+        operations = [UpdateOne({"url": doc["url"]}, {"$set": doc}, upsert=True) for doc in docs]
+        try:
+            collection.bulk_write(operations, ordered=False)
+            failed = 0
+        except BulkWriteError as e:
+            failed = len(e.details.get("writeErrors", []))
+            for write_error in e.details.get("writeErrors", []):
+                logger.error(f"Error exporting ad to MongoDB: {write_error.get('errmsg')}")
+        stats["exported"] += len(docs) - failed
+        stats["errors"] += failed
+        stats["batches"] += 1
+        logger.info(f"Exported {stats['exported']} ads")
+    return stats
+
+def benchmark(count: int = 10000, batch_size: int = 100, path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Time saving synthetic ads to a local database and reading them back
+    for the Elasticsearch sync.
+
+    Args:
+        count: Number of ads
+        batch_size: Ads per transaction
+        path: Database file; a temporary file when omitted
+
+    Returns:
+        Dict[str, Any]: Ads per second for each phase
+    """
+    from records import sample_ads
+
+    ads = [CarAd.from_dict(ad) for ad in sample_ads(count)]
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(path or os.path.join(directory, "benchmark.db"))
+        results = {"ads": count, "batch_size": batch_size}
+        try:
+            for phase in ("insert", "unchanged"):
+                stats = {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0}
+                started = time.perf_counter()
+                for i in range(0, count, batch_size):
+                    batch = ads[i:i + batch_size]
+                    store.load_current_values(batch)
+                    store.save_batch(batch, stats)
+                results[f"{phase}_ads_per_second"] = round(count / (time.perf_counter() - started))
+
+            started = time.perf_counter()
+            for doc in store.iter_unindexed():
+                store.mark_indexed(doc, "2026-01-01T00:00:00")
+            results["sync_read_ads_per_second"] = round(count / (time.perf_counter() - started))
+            results["unindexed_after_sync"] = store.count_unindexed()
+        finally:
+            store.close()
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Car ads storage tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Copy a local database to MongoDB")
+    export_parser.add_argument("--path", default=SQLITE_PATH, help="Database file")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Time a local database with synthetic ads")
+    benchmark_parser.add_argument("--ads", type=int, default=10000, help="Number of synthetic ads")
+    benchmark_parser.add_argument("--batch-size", type=int, default=100, help="Ads per transaction")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from mongodb import get_mongodb_connection
+
+        client, db, collection = get_mongodb_connection()
+        if client is None:
+            raise SystemExit("Failed to connect to MongoDB")
+
+        store = SQLiteStore(args.path)
+        try:
+            ensure_indexes(collection)
+            print(f"Export results: {export_to_mongo(store, collection)}")
+        finally:
+            store.close()
+            client.close()
+    else:
+        print(f"Benchmark results: {benchmark(args.ads, args.batch_size)}")
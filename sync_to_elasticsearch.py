@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 """
 Sync car ads data from MongoDB to Elasticsearch.
-This script reads car ads from MongoDB and indexes them in Elasticsearch.
+This script reads car ads from MongoDB, or from the local database with
+STORAGE_BACKEND=sqlite, and indexes them in Elasticsearch.
 """
 
 import os
 import json
 import logging
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any
 
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk
 
+from schema import expand_document
+from records import CarAd
+from storage import Store, open_store
+from reconcile import DELETE_INACTIVE_FROM_ES
+from profiling import profiled
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,40 +31,6 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-def get_mongodb_connection():
-    """
-    Establish connection to MongoDB Atlas.
-    
-    Returns:
-        tuple: (client, database, collection) or (None, None, None) if connection fails
-    """
-    try:
-        mongodb_uri = os.getenv('MONGODB_URI')
-        db_name = os.getenv('DATABASE_NAME', 'blocket_cars')
-        collection_name = os.getenv('COLLECTION_NAME', 'car_ads')
-        
-        if not mongodb_uri:
-            logger.error("MongoDB URI not found in environment variables")
-            return None, None, None
-            
-        client = MongoClient(
-            mongodb_uri,
-            tlsAllowInvalidCertificates=True,
-            serverSelectionTimeoutMS=5000
-        )
-        
-        database = client[db_name]
-        collection = database[collection_name]
-        
-        # Test connection
-        client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB")
-        
-        return client, database, collection
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {str(e)}")
-        return None, None, None
-
 def get_elasticsearch_connection():
     """
     Establish connection to Elasticsearch.
@@ -91,7 +63,7 @@ def get_elasticsearch_connection():
         logger.error(f"Failed to connect to Elasticsearch: {str(e)}")
         return None
 
-def prepare_document_for_elasticsearch(doc: Dict[str, Any]) -> Dict[str, Any]:
+def prepare_document_for_elasticsearch(doc: Dict[str, Any]) -> CarAd:
     """
     Prepare a MongoDB document for Elasticsearch indexing.
     
@@ -99,14 +71,17 @@ def prepare_document_for_elasticsearch(doc: Dict[str, Any]) -> Dict[str, Any]:
         doc: MongoDB document
         
     Returns:
-        Dict[str, Any]: Document prepared for Elasticsearch
+        CarAd: Ad prepared for Elasticsearch
+        
+    Raises:
+        ValueError: If the document has mistyped fields
     """
-    # Create a copy of the document to avoid modifying the original
-    es_doc = doc.copy()
+    # Decode into a record, which leaves the original, the MongoDB _id and
+    # fields the record does not know out without copying the document
+    es_doc = CarAd.from_dict(doc, strict=False)
     
-    # Remove MongoDB _id field
-    if '_id' in es_doc:
-        del es_doc['_id']
+    # Recreate the fields that the compact storage schema does not store
+    expand_document(es_doc)
     
     # Set indexed flag to True
     es_doc['indexed'] = True
@@ -114,52 +89,52 @@ def prepare_document_for_elasticsearch(doc: Dict[str, Any]) -> Dict[str, Any]:
     
     return es_doc
 
-def generate_elasticsearch_actions(collection, index_name: str, batch_size: int = 100):
+def generate_elasticsearch_actions(store: Store, index_name: str, batch_size: int = 100):
     """
     Generate actions for bulk indexing in Elasticsearch.
     
     Args:
-        collection: MongoDB collection
+        store: Store of the car ads
         index_name: Elasticsearch index name
-        batch_size: Number of documents to process in each batch
+        batch_size: Number of documents between progress reports
         
     Yields:
         Dict[str, Any]: Action for Elasticsearch bulk API
     """
-    # Find documents that haven't been indexed yet or need updating
-    query = {
-        "$or": [
-            {"indexed": {"$ne": True}},
-            {"indexed": {"$exists": False}}
-        ]
-    }
-    
     # Get total count for progress reporting
-    total_docs = collection.count_documents(query)
+    total_docs = store.count_unindexed()
     logger.info(f"Found {total_docs} documents to index")
     
-    # Process documents in batches
+    # Find documents that haven't been indexed yet or need updating
     processed = 0
-    cursor = collection.find(query)
     
-    for doc in cursor:
-        # Prepare document for Elasticsearch
-        es_doc = prepare_document_for_elasticsearch(doc)
+    for doc in store.iter_unindexed():
+        # Prepare document for Elasticsearch; an invalid one stays unindexed
+        try:
+            es_doc = prepare_document_for_elasticsearch(doc)
+        except ValueError as e:
+            logger.error(f"Skipping invalid document {doc.get('url')}: {str(e)}")
+            continue
         
         # Create action for bulk API
-        action = {
-            "_index": index_name,
-            "_id": es_doc.get("id") or es_doc.get("url"),
-            "_source": es_doc
-        }
+        if DELETE_INACTIVE_FROM_ES and es_doc.get("active") is False:
+            action = {
+                "_op_type": "delete",
+                "_index": index_name,
+                "_id": es_doc.get("id") or es_doc.get("url")
+            }
+        else:
+            action = {
+                "_index": index_name,
+                "_id": es_doc.get("id") or es_doc.get("url"),
+                # Encoded once here; the client sends strings as they are
+                "_source": es_doc.to_json()
+            }
         
         yield action
         
-        # Update document in MongoDB to mark as indexed
-        collection.update_one(
-            {"_id": doc["_id"]},
-            {"$set": {"indexed": True, "last_indexed": es_doc["last_indexed"]}}
-        )
+        # Update the stored document to mark it as indexed
+        store.mark_indexed(doc, es_doc["last_indexed"])
         
         processed += 1
         if processed % batch_size == 0:
@@ -195,47 +170,45 @@ def create_elasticsearch_index(es, index_name: str, mapping_file: str) -> bool:
         logger.error(f"Failed to create index '{index_name}': {str(e)}")
         return False
 
+@profiled("sync")
 def sync_to_elasticsearch():
     """
-    Sync data from MongoDB to Elasticsearch.
+    Sync data from the configured store (MongoDB by default) to Elasticsearch.
     """
-    # Connect to MongoDB
-    mongo_client, mongo_db, mongo_collection = get_mongodb_connection()
-    if not mongo_collection:
+    # Open the store
+    store = open_store()
+    if store is None:
         logger.error("Failed to connect to MongoDB")
         return
     
-    # Connect to Elasticsearch
-    es = get_elasticsearch_connection()
-    if not es:
-        logger.error("Failed to connect to Elasticsearch")
-        return
-    
-    # Get index name from environment variable or use default
-    index_name = os.getenv('ELASTICSEARCH_INDEX', 'car_ads')
-    
-    # Create index with mapping if it doesn't exist
-    mapping_file = os.getenv('ELASTICSEARCH_MAPPING_FILE', 'elasticsearch_mapping.json')
-    if not create_elasticsearch_index(es, index_name, mapping_file):
-        logger.error("Failed to create Elasticsearch index")
-        return
-    
-    # Sync data from MongoDB to Elasticsearch
     try:
+        # Connect to Elasticsearch
+        es = get_elasticsearch_connection()
+        if not es:
+            logger.error("Failed to connect to Elasticsearch")
+            return
+        
+        # Get index name from environment variable or use default
+        index_name = os.getenv('ELASTICSEARCH_INDEX', 'car_ads')
+        
+        # Create index with mapping if it doesn't exist
+        mapping_file = os.getenv('ELASTICSEARCH_MAPPING_FILE', 'elasticsearch_mapping.json')
+        if not create_elasticsearch_index(es, index_name, mapping_file):
+            logger.error("Failed to create Elasticsearch index")
+            return
+        
         # Generate actions for bulk API
-        actions = generate_elasticsearch_actions(mongo_collection, index_name)
+        actions = generate_elasticsearch_actions(store, index_name)
         
-        # Perform bulk indexing
-        success, failed = bulk(es, actions, stats_only=True)
+        # Perform bulk indexing; deleting an ad that was never indexed is not an error
+        success, failed = bulk(es, actions, stats_only=True, ignore_status=(404,) if DELETE_INACTIVE_FROM_ES else ())
         
         logger.info(f"Indexed {success} documents, {failed} failed")
     except Exception as e:
         logger.error(f"Failed to sync data to Elasticsearch: {str(e)}")
     finally:
         # Close connections
-        if mongo_client:
-            mongo_client.close()
-            logger.info("MongoDB connection closed")
+        store.close()
 
 if __name__ == "__main__":
     sync_to_elasticsearch() 
\ No newline at end of file
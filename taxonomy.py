@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Make, model and variant recognition with an Aho-Corasick automaton.
+Every name and alias in car_taxonomy.json, plus the misspellings of the
+Elasticsearch synonym filter, is compiled into one automaton over words,
+so the title and the make/model specifications of an ad are matched in a
+single pass, however large the catalogue grows. Run this module with
+`backfill` to re-derive make, model and variant of the stored ads.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import unicodedata
+from collections import deque
+from typing import Dict, Any, List, Iterable, Iterator, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from schema import normalize_spec_key
+from search_document import KEYWORD_FIELDS, build_search_text, build_keywords
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TAXONOMY_PATH = os.getenv('CAR_TAXONOMY_PATH', os.path.join(ROOT, 'car_taxonomy.json'))
+MAPPING_PATH = os.path.join(ROOT, 'elasticsearch_mapping.json')
+
+# Specifications that name the make or the model
+MAKE_SPEC_KEYS = ["make", "märke"]
+MODEL_SPEC_KEYS = ["model", "modell"]
+
+# Model names shorter than this (e.g. "e", "GT") and model years do not
+# identify a make on their own
+MIN_INFERENCE_LENGTH = 3
+YEAR_PATTERN = re.compile(r"^(19|20)\d\d$")
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+MAKE, MODEL, VARIANT = "make", "model", "variant"
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase words without accents,
+    e.g. "Mercedes-Benz GLC 300e" -> ["mercedes", "benz", "glc", "300e"].
+
+    Args:
+        text: Text to split
+
+    Returns:
+        List[str]: Normalized words
+    """
+    folded = unicodedata.normalize("NFKD", text or "")
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return WORD_PATTERN.findall(folded.lower())
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over words.
+
+    Patterns are word sequences; find() reports every occurrence of every
+    pattern in one left-to-right pass over the words of a text.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._patterns: List[List[Tuple[int, Any]]] = [[]]
+        self._output: List[List[Tuple[int, Any]]] = [[]]
+        self._built = False
+
+    def add(self, words: List[str], payload: Any) -> None:
+        """
+        Add a pattern.
+
+        Args:
+            words: Words of the pattern
+            payload: Value reported with every occurrence
+        """
+        state = 0
+        for word in words:
+            if word not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._patterns.append([])
+                self._output.append([])
+                self._goto[state][word] = len(self._goto) - 1
+            state = self._goto[state][word]
+        self._patterns[state].append((len(words), payload))
+        self._built = False
+
+    def build(self) -> None:
+        """
+        Compute the failure links; called by find() when needed.
+        """
+        self._output = [list(patterns) for patterns in self._patterns]
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(word, 0)
+                # Failure links point to shallower states, which BFS has
+                # completed already
+                self._output[child].extend(self._output[self._fail[child]])
+                queue.append(child)
+        self._built = True
+
+    def find(self, words: List[Optional[str]]) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Find all pattern occurrences; None words separate texts.
+
+        Args:
+            words: Words of the text
+
+        Yields:
+            Tuple[int, int, Any]: Start and end word index and payload
+        """
+        if not self._built:
+            self.build()
+
+        state = 0
+        for index, word in enumerate(words):
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            for length, payload in self._output[state]:
+                yield index + 1 - length, index + 1, payload
+
+class TaxonomyMatcher:
+    """
+    Recognizes make, model and variant in ad titles and specifications.
+    """
+
+    def __init__(self, taxonomy: Dict[str, Any], synonym_groups: Iterable[List[str]] = ()):
+        """
+        Args:
+            taxonomy: Catalogue in the layout of car_taxonomy.json
+            synonym_groups: Groups of equivalent terms; groups that name a
+                make or model of the catalogue add aliases to it
+        """
+        self.automaton = AhoCorasick()
+        self.patterns = 0
+        self._names: Dict[Tuple[str, ...], List[Tuple]] = {}
+
+        for make, make_entry in taxonomy["makes"].items():
+            self._add([make] + make_entry.get("aliases", []), (MAKE, make, None))
+            for model, model_entry in make_entry.get("models", {}).items():
+                self._add([model] + model_entry.get("aliases", []), (MODEL, make, model))
+                for variant in model_entry.get("variants", []):
+                    self._add([variant], (VARIANT, make, model, variant))
+
+        for group in synonym_groups:
+            known = [self._names[tuple(tokenize(term))] for term in group if tuple(tokenize(term)) in self._names]
+            for payloads in known:
+                for payload in payloads:
+                    if payload[0] in (MAKE, MODEL):
+                        self._add(group, payload)
+
+        self.automaton.build()
+
+    def _add(self, names: List[str], payload: Tuple) -> None:
+        for name in names:
+            words = tuple(tokenize(name))
+            if not words or payload in self._names.get(words, []):
+                continue
+            self._names.setdefault(words, []).append(payload)
+            self.automaton.add(list(words), payload)
+            self.patterns += 1
+
+    def match(self, title: str, spec_values: Iterable[str] = ()) -> Dict[str, Optional[str]]:
+        """
+        Recognize make, model and variant.
+
+        Specification values are matched before the title, so a make or
+        model given in the specifications wins over one in the title.
+
+        Args:
+            title: Ad title
+            spec_values: Make and model specification values
+
+        Returns:
+            Dict[str, Optional[str]]: Canonical make, model and variant; a
+                model outside the catalogue is the word after the make
+        """
+        words: List[Optional[str]] = []
+        for text in list(spec_values) + [title]:
+            words.extend(tokenize(text))
+            words.append(None)
+
+        hits = {MAKE: [], MODEL: [], VARIANT: []}
+        for start, end, payload in self.automaton.find(words):
+            hits[payload[0]].append((start, end, payload))
+
+        # Earliest, then longest mention wins for make and model; the
+        # longest for the variant ("Carrera 4S" over "Carrera")
+        earliest = lambda hit: (hit[0], hit[0] - hit[1])
+        longest = lambda hit: (hit[0] - hit[1], hit[0])
+
+        make = None
+        make_end = None
+        if hits[MAKE]:
+            _, make_end, payload = min(hits[MAKE], key=earliest)
+            make = payload[1]
+        else:
+            make = self._unique(words, hits[MODEL], lambda payload: payload[1])
+
+        model = None
+        models = [hit for hit in hits[MODEL] if hit[2][1] == make]
+        if models:
+            model = min(models, key=earliest)[2][2]
+        elif make:
+            variants = [hit for hit in hits[VARIANT] if hit[2][1] == make]
+            model = self._unique(words, variants, lambda payload: payload[2])
+            if model is None and make_end is not None and words[make_end]:
+                model = _display_word(words[make_end])
+
+        variant = None
+        variants = [hit for hit in hits[VARIANT] if hit[2][1] == make and hit[2][2] == model]
+        if variants:
+            variant = min(variants, key=longest)[2][3]
+
+        return {"make": make, "model": model, "variant": variant}
+
+    @staticmethod
+    def _unique(words: List[Optional[str]], hits: List[Tuple[int, int, Tuple]], key) -> Optional[str]:
+        # A name that belongs to one make (or model) only identifies it,
+        # e.g. "XC90" -> Volvo or "Carrera" -> 911; "Leon" (Seat and Cupra),
+        # "GT" and model years do not
+        owners: Dict[Tuple[int, int], set] = {}
+        for start, end, payload in hits:
+            owners.setdefault((start, end), set()).add(key(payload))
+
+        best = None
+        for (start, end), keys in owners.items():
+            text = "".join(words[start:end])
+            if len(keys) != 1 or len(text) < MIN_INFERENCE_LENGTH or YEAR_PATTERN.match(text):
+                continue
+            if best is None or (len(text), -start) > (best[0], -best[1]):
+                best = (len(text), start, next(iter(keys)))
+        return best[2] if best else None
+
+def _display_word(word: str) -> str:
+    # Words with digits are model codes ("v70" -> "V70"), others names
+    return word.upper() if any(char.isdigit() for char in word) else word.capitalize()
+
+_matcher: Optional[TaxonomyMatcher] = None
+
+def load_synonym_groups(path: str = MAPPING_PATH) -> List[List[str]]:
+    """
+    Read the synonym groups of the car_synonym filter of the mapping.
+
+    Args:
+        path: Path of elasticsearch_mapping.json
+
+    Returns:
+        List[List[str]]: Groups of equivalent terms
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            mapping = json.load(f)
+        synonyms = mapping["settings"]["analysis"]["filter"]["car_synonym"]["synonyms"]
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"No synonyms loaded from {path}: {str(e)}")
+        return []
+    return [[term.strip() for term in line.split(",")] for line in synonyms]
+
+def get_matcher() -> TaxonomyMatcher:
+    """
+    Get the matcher of the catalogue, compiling it on first use.
+
+    Returns:
+        TaxonomyMatcher: Shared matcher
+    """
+    global _matcher
+    if _matcher is None:
+        with open(TAXONOMY_PATH, encoding="utf-8") as f:
+            taxonomy = json.load(f)
+        _matcher = TaxonomyMatcher(taxonomy, load_synonym_groups())
+        logger.info(f"Compiled {_matcher.patterns} taxonomy patterns")
+    return _matcher
+
+def match_ad(title: str, specs: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Recognize make, model and variant of an ad.
+
+    Specification values outside the catalogue are kept as they are.
+
+    Args:
+        title: Ad title
+        specs: Specifications keyed by normalized name
+
+    Returns:
+        Dict[str, Optional[str]]: Make, model and variant
+    """
+    spec_make = next((specs[key] for key in MAKE_SPEC_KEYS if specs.get(key)), None)
+    spec_model = next((specs[key] for key in MODEL_SPEC_KEYS if specs.get(key)), None)
+
+    result = get_matcher().match(title, [value for value in (spec_make, spec_model) if value])
+    result["make"] = result["make"] or spec_make
+    result["model"] = result["model"] or spec_model
+    return result
+
+def backfill(collection: Collection, batch_size: int = 1000, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Re-derive make, model and variant of every stored ad.
+
+    Changed ads get their search fields rebuilt and are flagged for the
+    next Elasticsearch sync.
+
+    Args:
+        collection: Car ads collection
+        batch_size: Number of updates per bulk write
+        dry_run: Count the changes without writing them
+
+    Returns:
+        Dict[str, Any]: Statistics about the backfill
+    """
+    stats = {"ads": 0, "changed": 0, "unmatched": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    # Everything the search fields are built from
+    fields = ["url", "title", "specifications", "price_text", "location", "tags", "seller", *KEYWORD_FIELDS]
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+
+    operations = []
+    for doc in collection.find({}, projection):
+        stats["ads"] += 1
+        specs = {normalize_spec_key(key): value for key, value in (doc.get("specifications") or {}).items()}
+        result = match_ad(doc.get("title", ""), specs)
+        if not result["make"]:
+            stats["unmatched"] += 1
+
+        changes = {field: value for field, value in result.items() if value and doc.get(field) != value}
+        if changes:
+            stats["changed"] += 1
+            doc.update(changes)
+            changes["search_text"] = build_search_text(doc)
+            changes["keywords"] = build_keywords(doc)
+            operations.append(UpdateOne({"url": doc["url"]}, {"$set": {**changes, "indexed": False}}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations and not dry_run:
+        collection.bulk_write(operations, ordered=False)
+
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    rate = stats["ads"] / stats["seconds"] if stats["seconds"] else 0
+    logger.info(f"Backfilled taxonomy of {stats['ads']} ads in {stats['seconds']}s ({rate:.0f} ads/s): {stats}")
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+
+    from mongodb import get_mongodb_connection
+
+    parser = argparse.ArgumentParser(description="Car make/model/variant taxonomy")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    match_parser = subparsers.add_parser("match", help="Match a title")
+    match_parser.add_argument("title")
+    backfill_parser = subparsers.add_parser("backfill", help="Re-derive make, model and variant of stored ads")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="Count changes without writing them")
+    args = parser.parse_args()
+
+    if args.command == "match":
+        print(get_matcher().match(args.title))
+    else:
+        client, db, collection = get_mongodb_connection()
+        if client is None:
+            raise SystemExit("Failed to connect to MongoDB")
+        try:
+            print(f"Backfill results: {backfill(collection, dry_run=args.dry_run)}")
+            if not args.dry_run:
+                print("Segments may have changed; run `python market_stats.py rebuild`")
+        finally:
+            client.close()
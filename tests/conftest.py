@@ -0,0 +1,30 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+# The pipeline modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient()["car_ads_test"]
+
+class FakeSessions:
+    """Identity pool without browsers, for scrapes whose pages are faked."""
+
+    def __init__(self, create_driver=None):
+        self.reports = []
+
+    def driver(self):
+        return None
+
+    def report(self, classification):
+        self.reports.append(classification)
+
+    def snapshot(self):
+        return {}
+
+    def close(self):
+        pass
@@ -0,0 +1,37 @@
+import pytest
+
+from alerts import AlertIndex, IntervalTree, normalize_criteria
+
+def test_interval_tree_stab():
+    tree = IntervalTree([(0, 10, 1), (5, 15, 2), (20, 30, 3), (float("-inf"), 5, 4)])
+    assert sorted(tree.stab(5)) == [1, 2, 4]
+    assert sorted(tree.stab(12)) == [2]
+    assert tree.stab(17) == []
+    assert sorted(tree.stab(30)) == [3]
+
+def index_of(*criteria):
+    return AlertIndex([{"_id": i, "user_id": "u", "criteria": normalize_criteria(c)} for i, c in enumerate(criteria)])
+
+def matched_ids(index, ad):
+    return sorted(search["_id"] for search in index.match(ad))
+
+def test_price_and_year_ranges():
+    index = index_of(
+        {"make": "Porsche", "price_max": 500000},
+        {"make": "Porsche", "price_min": 400000, "year_min": 2018},
+        {"make": "Volvo"},
+        {},
+    )
+    assert matched_ids(index, {"make": "Porsche", "price": 450000, "year": 2019}) == [0, 1, 3]
+    assert matched_ids(index, {"make": "Porsche", "price": 600000, "year": 2015}) == [3]
+    assert matched_ids(index, {"make": "Volvo", "price": 100000}) == [2, 3]
+
+def test_ad_without_value_only_matches_open_ranges():
+    index = index_of({"mileage_max": 5000}, {"price_max": 500000})
+    assert matched_ids(index, {"make": "Porsche", "price": 450000}) == [1]
+
+def test_invalid_criteria():
+    with pytest.raises(ValueError):
+        normalize_criteria({"price_min": 500000, "price_max": 400000})
+    with pytest.raises(ValueError):
+        normalize_criteria({"colour": "red"})
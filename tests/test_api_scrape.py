@@ -0,0 +1,84 @@
+import http.client
+import importlib.util
+import json
+import os
+import threading
+
+import pytest
+
+import scraper
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_api_module():
+    # api/ is not a package; Vercel loads each file on its own
+    spec = importlib.util.spec_from_file_location("api_scrape", os.path.join(ROOT, "api", "scrape.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def server():
+    api = load_api_module()
+    httpd = api.ScrapeServer(("localhost", 0), api.Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield api, httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+def request(port, method, path):
+    connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    try:
+        connection.request(method, path)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, dict(response.getheaders()), json.loads(body) if body else None
+    finally:
+        connection.close()
+
+def test_health(server):
+    _, port = server
+    status, _, body = request(port, "GET", "/api/scrape/health")
+    assert status == 200
+    assert (body["status"], body["running_scrapes"]) == ("ok", 0)
+
+def test_preflight(server):
+    _, port = server
+    status, headers, body = request(port, "OPTIONS", "/api/scrape")
+    assert status == 200 and body is None
+    assert headers["Access-Control-Allow-Origin"] == "*"
+    assert headers["Access-Control-Allow-Methods"] == "GET"
+
+def test_health_is_answered_during_a_scrape(server, monkeypatch):
+    api, port = server
+    started, release = threading.Event(), threading.Event()
+
+    def slow_scrape(resume=False):
+        started.set()
+        release.wait(10)
+        return {"inserted": 1}
+
+    monkeypatch.setattr(scraper, "scrape_with_checkpoints", slow_scrape)
+    results = []
+    scrape = threading.Thread(target=lambda: results.append(request(port, "GET", "/api/scrape")))
+    scrape.start()
+    assert started.wait(10)
+
+    assert request(port, "GET", "/api/scrape/health")[2]["running_scrapes"] == 1
+    status, _, body = request(port, "GET", "/api/scrape")
+    assert (status, body["message"]) == (409, "A scrape is already running")
+
+    release.set()
+    scrape.join(10)
+    status, _, body = results[0]
+    assert (status, body["stats"]) == (200, {"inserted": 1})
+    assert api.jobs.running == 0
+
+def test_draining_refuses_new_scrapes(server):
+    api, port = server
+    assert api.jobs.drain(0)
+
+    assert request(port, "GET", "/api/scrape/health")[2]["status"] == "draining"
+    status, _, body = request(port, "GET", "/api/scrape")
+    assert (status, body["message"]) == (409, "Server is shutting down")
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+import car_search
+from car_search import ResponseCache, normalize_params, build_query, encode_cursor, decode_cursor, search_cars
+
+def test_equivalent_requests_normalise_equally():
+    a = normalize_params({"q": ["  Carrera  4S "], "make": ["Porsche,Audi"], "price_max": ["900000"], "size": ["500"]})
+    b = normalize_params({"make": "Audi, Porsche", "q": "carrera 4s", "price_max": "900000", "size": "100", "sort": "newest"})
+    assert a == b == {"q": "carrera 4s", "make": ["Audi", "Porsche"], "price_max": 900000, "sort": "newest", "size": 100}
+
+def test_defaults():
+    assert normalize_params({}) == {"sort": "newest", "size": car_search.DEFAULT_PAGE_SIZE}
+    assert normalize_params({"size": "-5"})["size"] == 1
+
+@pytest.mark.parametrize("params", [
+    {"price_min": "cheap"},
+    {"sort": "random"},
+    {"sort": "distance"},
+    {"lat": "59.3"},
+    {"lat": "95", "lon": "18"},
+    {"radius_km": "50"},
+    {"lat": "59.3", "lon": "18", "radius_km": "5000"},
+    {"near": "Qwxzvb"},
+])
+def test_invalid_params(params):
+    with pytest.raises(ValueError):
+        normalize_params(params)
+
+def test_place_and_coordinates_share_a_cache_key():
+    by_name = normalize_params({"near": "Stockholm", "radius_km": "50"})
+    assert by_name == normalize_params({"lat": by_name["lat"], "lon": by_name["lon"], "radius_km": "50.0"})
+
+def test_build_query_filters():
+    body = build_query(normalize_params({"make": "Porsche", "year_min": "2015", "year_max": "2020", "q": "4S"}))
+    filters = body["query"]["bool"]["filter"]
+
+    assert {"term": {"active": True}} in filters
+    assert {"terms": {"make.keyword": ["Porsche"]}} in filters
+    assert {"range": {"year": {"gte": 2015, "lte": 2020}}} in filters
+    assert body["query"]["bool"]["must"] == [{"match": {"search_text": {"query": "4s", "operator": "and"}}}]
+    assert body["sort"] == car_search.SORT_ORDERS["newest"]
+
+def test_first_page_counts_and_aggregates():
+    body = build_query(normalize_params({}))
+    assert body["track_total_hits"] is True
+    assert set(body["aggs"]) == set(car_search.FACETS)
+    assert "search_after" not in body
+
+def test_cursor_round_trip():
+    cursor = encode_cursor([1767268800, "1234"])
+    assert decode_cursor(cursor) == [1767268800, "1234"]
+
+    body = build_query(normalize_params({"cursor": cursor}))
+    assert body["search_after"] == [1767268800, "1234"]
+    assert body["track_total_hits"] is False
+    assert "aggs" not in body
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor({"a": 1})[:-2], encode_cursor("x")])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_geo_distance_filter_and_sort():
+    body = build_query(normalize_params({"lat": "59.32932", "lon": "18.06858", "radius_km": "25", "sort": "distance"}))
+
+    assert {"geo_distance": {"distance": "25.0km", "coordinates": {"lat": 59.3293, "lon": 18.0686}}} in body["query"]["bool"]["filter"]
+    assert body["sort"][0]["_geo_distance"]["coordinates"] == {"lat": 59.3293, "lon": 18.0686}
+    assert body["sort"][-1] == {"id": "asc"}
+
+def test_cache_expiry_and_eviction(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(car_search.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=30, max_entries=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+    now[0] = 31
+    assert cache.get("a") is None
+
+class FakeSearch:
+    def __init__(self):
+        self.bodies = []
+
+    def search(self, index, **body):
+        self.bodies.append(body)
+        hits = [{"_source": {"id": str(n)}, "sort": [12.34 + n, str(n)]} for n in range(body["size"])]
+        result = {"hits": {"hits": hits, "total": {"value": 40}}}
+        if "aggs" in body:
+            result["aggregations"] = {name: {"buckets": [{"key": "dealer", "doc_count": 40}]} for name in car_search.FACETS}
+        return result
+
+def test_search_cars_caches_responses():
+    car_search._cache.clear()
+    es = FakeSearch()
+
+    first, cached = search_cars({"make": "Porsche", "size": "2", "lat": "59.3", "lon": "18.0", "sort": "distance"}, es=es)
+    assert not cached
+    assert first["total"] == 40
+    assert first["results"] == [{"id": "0", "distance_km": 12.3}, {"id": "1", "distance_km": 13.3}]
+    assert decode_cursor(first["next_cursor"]) == [13.34, "1"]
+
+    again, cached = search_cars({"make": ["Porsche"], "size": "2", "lat": "59.30", "lon": "18", "sort": "distance"}, es=es)
+    assert cached and again == first
+    assert len(es.bodies) == 1
+
+def test_benchmark_reports_latency():
+    car_search._cache.clear()
+    results = car_search.benchmark(requests=200, concurrency=4, distinct=20, es=FakeSearch())
+    assert results["errors"] == 0
+    assert results["cache_hit_share"] >= 0.8
+    assert results["p50_ms"] <= results["p95_ms"] <= results["p99_ms"]
@@ -0,0 +1,43 @@
+from dedup import build_signature, cluster_signatures, assign_clusters
+
+DESCRIPTION = (
+    "Välskött Porsche 911 Carrera 4S med full servicehistorik hos auktoriserad verkstad, "
+    "sportavgassystem, sportchrono, adaptiva sportstolar och nya däck runt om"
+)
+
+def make_ad(ad_id, description=DESCRIPTION, **fields):
+    ad = {"id": ad_id, "make": "Porsche", "model": "911", "year": 2019,
+          "mileage": 2500, "price": 1250000, "description": description}
+    ad.update(fields)
+    return ad
+
+def test_identical_descriptions_form_one_cluster():
+    signatures = [build_signature(make_ad("2")), build_signature(make_ad("1"))]
+    assert cluster_signatures(signatures) == {"1": "1", "2": "1"}
+
+def test_different_descriptions_stay_apart():
+    other = make_ad("2", description="Helt annan bil, nyservad, rökfri och garagerad sedan köpet, inga anmärkningar")
+    signatures = [build_signature(make_ad("1")), build_signature(other)]
+    assert cluster_signatures(signatures) == {"1": "1", "2": "2"}
+
+def test_ads_in_different_blocks_are_not_compared():
+    signatures = [build_signature(make_ad("1")), build_signature(make_ad("2", year=2012))]
+    assert cluster_signatures(signatures) == {"1": "1", "2": "2"}
+
+def test_existing_cluster_ids_are_kept():
+    signatures = [build_signature(make_ad("1")), build_signature(make_ad("3"))]
+    signatures[1]["cluster_id"] = "0"
+    assert cluster_signatures(signatures) == {"1": "0", "3": "0"}
+
+def test_incremental_assignment_merges_clusters(database):
+    collection = database["car_ads"]
+    first, relisted, other = make_ad("5"), make_ad("3"), make_ad("7", year=2012)
+    collection.insert_many([dict(ad) for ad in (first, relisted, other)])
+
+    assert assign_clusters(collection, [first, other])["duplicates"] == 0
+    stats = assign_clusters(collection, [relisted])
+
+    assert stats["duplicates"] == 0 and stats["merged_clusters"] == 1
+    clusters = {doc["id"]: doc["cluster_id"] for doc in collection.find({}, {"id": 1, "cluster_id": 1})}
+    assert clusters == {"5": "3", "3": "3", "7": "7"}
+    assert collection.find_one({"id": "5"})["indexed"] is False
@@ -0,0 +1,50 @@
+import mongomock
+import pytest
+
+import distributed
+import scraper
+from conftest import FakeSessions
+from frontier import get_frontier_collection, start_run, get_run_summary, DONE
+from records import CarAd
+
+URLS = [f"https://www.blocket.se/annons/porsche_911/{n}" for n in range(5)]
+
+def scraped_ad(driver, url, selector_stats):
+    ad_id = url.rsplit("/", 1)[1]
+    return CarAd(url=url, id=ad_id, scrape_date="2026-01-01T12:00:00", scrape_timestamp=1767268800,
+                 title=f"Porsche 911 {ad_id}", source="blocket")
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    db = client["car_ads_test"]
+    monkeypatch.setattr(distributed, "get_mongodb_connection", lambda: (client, db, db["car_ads"]))
+    monkeypatch.setattr(distributed, "SessionPool", FakeSessions)
+    monkeypatch.setattr(scraper, "scrape_individual_ad", scraped_ad)
+    return db
+
+def test_worker_scrapes_the_latest_blocket_run(db):
+    frontier = get_frontier_collection(db)
+    start_run(frontier, URLS[:2], source="other")
+    run_id = start_run(frontier, URLS[2:], source="blocket")
+
+    stats = distributed.run_worker(worker_id="worker", checkpoint_every=2)
+
+    assert (stats["run_id"], stats["inserted"], stats["errors"]) == (run_id, 3, 0)
+    assert get_run_summary(frontier, run_id)[DONE] == 3
+    assert db["car_ads"].count_documents({}) == 3
+
+def test_wait_for_run_reconciles_blocket_ads(db):
+    frontier = get_frontier_collection(db)
+    db["car_ads"].insert_many([
+        {"id": "9", "url": "https://www.blocket.se/annons/porsche_911/9", "active": True, "source": "blocket"},
+        {"id": "other:1", "url": "https://example.com/1", "active": True, "source": "other"},
+    ])
+    run_id = start_run(frontier, URLS, source="blocket")
+    distributed.run_worker(run_id, worker_id="worker")
+
+    result = distributed.wait_for_run(run_id)
+
+    assert (result[DONE], result["deactivated"]) == (5, 1)
+    assert db["car_ads"].find_one({"id": "9"})["active"] is False
+    assert db["car_ads"].find_one({"id": "other:1"})["active"] is True
@@ -0,0 +1,131 @@
+from datetime import datetime, timezone
+
+from frontier import (
+    get_frontier_collection, start_run, get_resumable_run, reset_in_progress, get_pending_urls,
+    get_run_urls, get_run_summary, mark_in_progress, mark_done, mark_failed, requeue_url,
+    claim_url, renew_leases, expire_exhausted, MAX_ATTEMPTS, MAX_BLOCKED, PENDING, IN_PROGRESS, DONE, FAILED,
+)
+
+URLS = [f"https://www.blocket.se/annons/porsche_911/{n}" for n in range(4)]
+
+def test_start_run_registers_pending_urls(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS)
+
+    assert sorted(get_pending_urls(frontier, run_id)) == URLS
+    assert get_run_summary(frontier, run_id) == {PENDING: 4, IN_PROGRESS: 0, DONE: 0, FAILED: 0}
+    assert get_resumable_run(frontier) == run_id
+
+def test_run_progress(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS)
+
+    for url in URLS[:3]:
+        mark_in_progress(frontier, url)
+    mark_done(frontier, URLS[:1])
+    mark_failed(frontier, URLS[1], "Failed to load ad page")
+
+    assert get_run_summary(frontier, run_id) == {PENDING: 1, IN_PROGRESS: 1, DONE: 1, FAILED: 1}
+    assert get_pending_urls(frontier, run_id) == URLS[3:]
+    assert frontier.find_one({"url": URLS[2]})["attempts"] == 1
+
+def test_reset_in_progress_after_interruption(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS)
+    mark_in_progress(frontier, URLS[0])
+    mark_done(frontier, URLS[1:2])
+
+    assert reset_in_progress(frontier, run_id) == 1
+    assert sorted(get_pending_urls(frontier, run_id)) == [URLS[0]] + URLS[2:]
+
+def test_finished_run_is_not_resumable(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS)
+    mark_done(frontier, URLS)
+
+    assert get_resumable_run(frontier) is None
+    assert sorted(get_run_urls(frontier, run_id)) == URLS
+
+def test_new_run_takes_over_known_urls(database):
+    frontier = get_frontier_collection(database)
+    first = start_run(frontier, URLS[:2], source="blocket")
+    mark_done(frontier, URLS[:2])
+    second = start_run(frontier, URLS[1:], source="other")
+
+    assert first != second
+    assert get_run_urls(frontier, first) == URLS[:1]
+    assert get_resumable_run(frontier, "blocket") is None
+    assert get_resumable_run(frontier, "other") == second
+
+def test_runs_started_in_the_same_second_are_apart(database):
+    frontier = get_frontier_collection(database)
+    first = start_run(frontier, URLS[:2])
+    second = start_run(frontier, URLS[2:])
+
+    assert first != second
+    assert sorted(get_run_urls(frontier, first)) == URLS[:2]
+
+def test_each_url_is_leased_once(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS)
+
+    claimed = [claim_url(frontier, run_id, f"worker-{n % 2}") for n in range(len(URLS))]
+    assert sorted(claimed) == URLS
+    assert claim_url(frontier, run_id, "worker-0") is None
+
+    doc = frontier.find_one({"url": claimed[0]})
+    assert doc["worker_id"] == "worker-0"
+    assert doc["lease_expires_at"].replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+def test_expired_lease_is_handed_to_another_worker(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS[:1])
+    claim_url(frontier, run_id, "crashed", lease_seconds=-1)
+    mark_in_progress(frontier, URLS[0])
+
+    assert claim_url(frontier, run_id, "healthy") == URLS[0]
+    assert frontier.find_one({"url": URLS[0]})["worker_id"] == "healthy"
+
+def test_renewed_lease_is_kept(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS[:1])
+    claim_url(frontier, run_id, "slow", lease_seconds=-1)
+
+    assert renew_leases(frontier, "slow", lease_seconds=300) == 1
+    assert claim_url(frontier, run_id, "other") is None
+
+def test_url_whose_lease_keeps_expiring_fails(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS[:2])
+    for url in URLS[:2]:
+        claim_url(frontier, run_id, "crashed", lease_seconds=-1)
+    frontier.update_one({"url": URLS[0]}, {"$set": {"attempts": MAX_ATTEMPTS}})
+
+    assert expire_exhausted(frontier, run_id) == 1
+    assert frontier.find_one({"url": URLS[0]})["state"] == FAILED
+    # The other URL can still be reclaimed
+    assert claim_url(frontier, run_id, "healthy") == URLS[1]
+
+def test_blocked_url_is_requeued(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS[:1])
+    claim_url(frontier, run_id, "worker")
+    mark_in_progress(frontier, URLS[0])
+
+    assert requeue_url(frontier, URLS[0], "captcha")
+
+    doc = frontier.find_one({"url": URLS[0]})
+    assert (doc["state"], doc["attempts"], doc["blocked"]) == (PENDING, 0, 1)
+    assert "worker_id" not in doc
+
+def test_url_blocked_too_often_fails(database):
+    frontier = get_frontier_collection(database)
+    run_id = start_run(frontier, URLS[:1])
+    frontier.update_one({"url": URLS[0]}, {"$set": {"blocked": MAX_BLOCKED}})
+    claim_url(frontier, run_id, "worker")
+
+    assert not requeue_url(frontier, URLS[0], "hard_block")
+
+    doc = frontier.find_one({"url": URLS[0]})
+    assert (doc["state"], doc["blocked"]) == (FAILED, MAX_BLOCKED)
+    assert "worker_id" not in doc
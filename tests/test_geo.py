@@ -0,0 +1,24 @@
+from geo import geocode
+
+def test_locality_in_its_county():
+    result = geocode("Uppsala", "Uppsala")
+    assert result["geo_precision"] == "locality"
+    assert result["county"] == "Uppsala"
+
+def test_unknown_locality_falls_back_to_county():
+    result = geocode("Okänd", "Stockholm")
+    assert result["geo_precision"] == "county"
+    assert abs(result["coordinates"]["lat"] - 59.33) < 0.01
+
+def test_locality_in_another_county_falls_back_to_county():
+    result = geocode("Uppsala", "Skåne")
+    assert result["geo_precision"] == "county"
+    assert result["county"] == "Skåne"
+
+def test_unknown_place():
+    assert geocode("Qwxzvb", None) is None
+
+def test_swapped_letters():
+    result = geocode("Götebrog", None)
+    assert result["geo_precision"] == "locality"
+    assert result["county"] == "Västra Götaland"
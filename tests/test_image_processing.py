@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from PIL import Image
+
+import image_processing
+from image_processing import dhash, hamming_distance, process_image
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_processing, "IMAGE_STORE_DIR", str(tmp_path / "store"))
+    return tmp_path
+
+def gradient(width=400, height=300):
+    image = Image.new("RGB", (width, height))
+    image.putdata([(x * 255 // width, y * 255 // height, 128) for y in range(height) for x in range(width)])
+    return image
+
+def save(image, path, **options):
+    image.save(path, **options)
+    return str(path)
+
+def test_process_image_stores_by_content(store):
+    download = save(gradient(), store / "download.jpg", format="JPEG")
+    result = process_image(download)
+
+    assert not os.path.exists(download)
+    assert (result["width"], result["height"]) == (400, 300)
+    assert result["variants"]["original"].endswith(f"{result['content_hash']}.jpg")
+    with Image.open(result["variants"]["thumb"]) as thumb:
+        assert thumb.format == "WEBP" and thumb.size == (320, 240)
+
+    # The same file again is discarded in favour of the stored one
+    again = process_image(save(gradient(), store / "again.jpg", format="JPEG"))
+    assert again == result
+
+def test_process_image_rejects_other_files(store):
+    path = store / "download"
+    path.write_bytes(b"<html>blocked</html>")
+    assert process_image(str(path)) is None
+    assert not path.exists()
+
+def test_dhash_survives_resizing_and_reencoding(store):
+    image = gradient()
+    other = Image.open(save(image.resize((200, 150)), store / "small.jpg", format="JPEG", quality=60))
+
+    assert len(dhash(image)) == 16
+    assert hamming_distance(dhash(image), dhash(other)) <= 6
+    assert hamming_distance(dhash(image), dhash(image.transpose(Image.Transpose.FLIP_LEFT_RIGHT))) > 6
@@ -0,0 +1,63 @@
+import random
+
+from market_stats import (
+    ANY, sketch_bucket, sketch_quantile, merge_sketches, update_rollups, record_deactivations,
+    get_segment_stats, rebuild_rollups,
+)
+
+def ad(n, price, year=2019, mileage=2500, **fields):
+    return {"url": f"https://www.blocket.se/annons/porsche_911/{n}", "id": str(n), "make": "Porsche",
+            "model": "911", "year": year, "fuel_type": "Bensin", "price": price, "mileage": mileage,
+            "active": True, **fields}
+
+def test_sketch_quantiles_are_within_the_relative_accuracy():
+    rng = random.Random(1)
+    values = sorted(rng.randrange(100000, 3000000) for _ in range(5000))
+    sketch = {}
+    for value in values:
+        bucket = sketch_bucket(value)
+        sketch[bucket] = sketch.get(bucket, 0) + 1
+
+    for quantile in (0.25, 0.5, 0.9):
+        exact = values[int(quantile * (len(values) - 1))]
+        assert abs(sketch_quantile(sketch, quantile) - exact) <= 0.011 * exact
+    assert sketch_quantile({}, 0.5) is None
+
+def test_merge_sketches():
+    assert merge_sketches({"1": 2, "3": 1}, {"1": 1, "4": 5}) == {"1": 3, "3": 1, "4": 5}
+
+def test_rollups_follow_saved_ads(database):
+    ads = [ad(1, 500000), ad(2, 700000), ad(3, 900000, year=2021)]
+    update_rollups(database, ads, {})
+
+    stats = get_segment_stats(database, "Porsche", "911")
+    assert (stats["active_ads"], stats["mean_price"]) == (3, 700000)
+    assert abs(stats["price"]["median"] - 700000) <= 7000
+    assert get_segment_stats(database, "Porsche", "911", 2019)["active_ads"] == 2
+
+    # A price change moves the ad within its segments, not into them again
+    update_rollups(database, [ad(2, 600000)], {ads[1]["url"]: ads[1]})
+    assert get_segment_stats(database, "Porsche", "911")["mean_price"] == 666667
+    assert get_segment_stats(database, "Porsche", ANY)["active_ads"] == 3
+
+def test_deactivated_ads_leave_the_rollups(database):
+    listed = ad(1, 500000, first_seen_timestamp=1767268800)
+    update_rollups(database, [listed, ad(2, 700000)], {})
+
+    record_deactivations(database, [listed], 1767268800 + 10 * 86400)
+
+    stats = get_segment_stats(database, "Porsche", "911")
+    assert (stats["active_ads"], stats["mean_price"]) == (1, 700000)
+    assert abs(stats["days_on_market"]["median"] - 10) <= 0.2
+
+def test_ads_without_price_are_not_counted(database):
+    update_rollups(database, [ad(1, None)], {})
+    assert get_segment_stats(database, "Porsche") is None
+
+def test_rebuild(database):
+    collection = database["car_ads"]
+    collection.insert_many([ad(1, 500000), ad(2, 700000), ad(3, 900000, active=False)])
+    update_rollups(database, [ad(9, 100000)], {})
+
+    assert rebuild_rollups(collection)["ads"] == 2
+    assert get_segment_stats(database, "Porsche")["mean_price"] == 600000
@@ -0,0 +1,47 @@
+import pipeline
+from pipeline import batched
+
+def test_batches_are_bounded():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+
+def test_batches_are_emitted_lazily():
+    consumed = []
+
+    def items():
+        for n in range(10):
+            consumed.append(n)
+            yield n
+
+    batches = batched(items(), 4)
+    assert next(batches) == [0, 1, 2, 3]
+    assert consumed == [0, 1, 2, 3]
+
+def test_old_batch_is_emitted_before_it_is_full(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(pipeline.time, "monotonic", lambda: now[0])
+
+    def slow_items():
+        for n, arrived in enumerate([0.0, 4.0, 11.0, 12.0, 15.0]):
+            now[0] = arrived
+            yield n
+
+    # The batch opened at 0s is emitted once the item at 11s has arrived
+    assert list(batched(slow_items(), 100, max_wait=10)) == [[0, 1, 2], [3, 4]]
+
+def test_download_queues_share_the_image_pool(database):
+    first = pipeline.ImageDownloadQueue(database["car_ads"], workers=1)
+    first.close()
+    second = pipeline.ImageDownloadQueue(database["car_ads"], workers=1)
+    second.close()
+
+    assert first._pool is second._pool is pipeline.get_image_pool()
+    # Closing a queue leaves the pool running for the next one
+    assert first._pool.submit(pow, 2, 10).result() == 1024
+
+def test_broken_image_pool_is_replaced():
+    pool = pipeline.get_image_pool()
+    replacement = pipeline.get_image_pool(broken=pool)
+
+    assert replacement is not pool
+    assert pipeline.get_image_pool(broken=pool) is replacement
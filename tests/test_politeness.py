@@ -0,0 +1,59 @@
+import pytest
+
+import politeness
+from politeness import PolitenessController, ADJUST_EVERY
+
+@pytest.fixture(autouse=True)
+def no_pauses(monkeypatch):
+    monkeypatch.setattr(politeness, "MIN_DELAY", 0)
+    monkeypatch.setattr(politeness, "DELAY_STEP", 0)
+
+def make_requests(controller, count, status=200):
+    for _ in range(count):
+        with controller.slot() as request:
+            request.mark(status=status)
+
+def test_healthy_requests_raise_the_limit():
+    controller = PolitenessController("example.com", initial_delay=0)
+
+    make_requests(controller, 3 * ADJUST_EVERY)
+
+    snapshot = controller.snapshot()
+    assert (snapshot["concurrency"], snapshot["increases"], snapshot["decreases"]) == (4, 3, 0)
+    assert (snapshot["requests"], snapshot["blocked"], snapshot["blocked_rate"]) == (30, 0, 0.0)
+
+def test_block_halves_the_limit_once_per_burst():
+    controller = PolitenessController("example.com", initial_delay=0)
+    make_requests(controller, 3 * ADJUST_EVERY)
+    controller.delay = 0.01
+
+    make_requests(controller, 3, status=429)
+
+    assert (controller.limit, controller.delay, controller.decreases) == (2.0, 0.02, 1)
+    assert controller.snapshot()["blocked"] == 3
+
+def test_exception_counts_as_blocked():
+    controller = PolitenessController("example.com", initial_delay=0)
+
+    with pytest.raises(RuntimeError):
+        with controller.slot():
+            raise RuntimeError("connection reset")
+
+    assert (controller.blocked, controller.in_flight, controller.decreases) == (1, 0, 1)
+
+def test_block_page_without_status():
+    request = politeness.Request()
+    request.mark(blocked=True)
+    assert request.blocked
+
+    request.mark(status=503)
+    assert request.blocked
+
+def test_controller_is_shared_per_host(monkeypatch):
+    monkeypatch.setattr(politeness, "_controllers", {})
+
+    controller = politeness.get_controller("www.blocket.se", initial_delay=0.1)
+
+    assert politeness.get_controller("www.blocket.se") is controller
+    assert controller.delay == 0.1
+    assert set(politeness.snapshot_all()) == {"www.blocket.se"}
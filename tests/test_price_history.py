@@ -0,0 +1,43 @@
+import pytest
+
+from price_history import record_price_changes, get_price_history, get_price_drops
+
+URL = "https://www.blocket.se/annons/porsche_911/1234"
+
+@pytest.fixture
+def database(database):
+    # mongomock has no time-series collections
+    database.create_collection("price_observations")
+    return database
+
+def ad(price, mileage=2500, timestamp=1767268800):
+    return {"url": URL, "id": "1234", "title": "Porsche 911", "price": price, "mileage": mileage,
+            "scrape_timestamp": timestamp}
+
+def test_new_ad_is_observed_but_not_a_change(database):
+    assert record_price_changes(database, [ad(500000)], {}) == []
+    assert [o["price"] for o in get_price_history(database, "1234")] == [500000]
+
+def test_unchanged_ad_is_not_observed(database):
+    assert record_price_changes(database, [ad(500000)], {URL: {"price": 500000, "mileage": 2500}}) == []
+    assert get_price_history(database, "1234") == []
+
+def test_price_drop(database):
+    changed = record_price_changes(database, [ad(450000)], {URL: {"price": 500000, "mileage": 2500}})
+
+    assert [a["price"] for a in changed] == [450000]
+    drop = get_price_drops(database, days=100000)[0]
+    assert (drop["previous_price"], drop["price"], drop["drop_percent"]) == (500000, 450000, 10.0)
+
+def test_mileage_change_is_observed_without_price_change(database):
+    assert record_price_changes(database, [ad(500000, mileage=3000)], {URL: {"price": 500000, "mileage": 2500}}) == []
+    assert [o["mileage"] for o in get_price_history(database, "1234")] == [3000]
+
+def test_missing_price_is_not_a_price_change(database):
+    # "Ring för pris": the price disappears, then comes back
+    assert record_price_changes(database, [ad(None)], {URL: {"price": 500000, "mileage": 2500}}) == []
+    assert get_price_history(database, "1234") == []
+
+    assert record_price_changes(database, [ad(480000)], {URL: {"mileage": 2500}}) == []
+    assert [o["price"] for o in get_price_history(database, "1234")] == [480000]
+    assert get_price_drops(database, days=100000) == []
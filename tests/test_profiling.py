@@ -0,0 +1,52 @@
+import json
+import time
+
+import pytest
+
+import profiling
+from profiling import profiled, profiling_requested, is_enabled
+
+@pytest.fixture(autouse=True)
+def profile_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_ENABLED", False)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+def save_batch(seconds):
+    # Named like the pipeline stage the profiler attributes samples to
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+@profiled("inner")
+def inner_run():
+    save_batch(0.01)
+    return {}
+
+@profiled("test")
+def run(seconds=0.1):
+    save_batch(seconds)
+    return {"inner": inner_run()}
+
+def test_runs_are_not_profiled_by_default(profile_dir):
+    assert "profile" not in run(0)
+    assert list(profile_dir.iterdir()) == []
+
+def test_requested_run_is_profiled(profile_dir):
+    with profiling_requested():
+        assert is_enabled()
+        result = run()
+    assert not is_enabled()
+
+    summary = result["profile"]
+    assert summary["samples"] > 0
+    assert max(summary["stages"], key=summary["stages"].get) == "save_batch"
+    # The nested run is part of the outer profile
+    assert "profile" not in result["inner"]
+
+    with open(summary["summary_file"], encoding="utf-8") as f:
+        assert json.load(f)["samples"] == summary["samples"]
+    with open(summary["collapsed_file"], encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == summary["samples"]
+    assert all(line.startswith("[") for line in lines)
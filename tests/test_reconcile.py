@@ -0,0 +1,52 @@
+import pytest
+
+import reconcile
+from reconcile import reconcile_active_ads
+
+@pytest.fixture
+def collection(database):
+    collection = database["car_ads"]
+    collection.insert_many([
+        {"id": str(n), "url": f"https://www.blocket.se/annons/porsche_911/{n}", "active": True,
+         "indexed": True, "source": "blocket" if n < 8 else "other"}
+        for n in range(10)
+    ])
+    return collection
+
+def test_missing_ads_are_deactivated(collection):
+    stats = reconcile_active_ads(collection, [str(n) for n in range(6)] + ["8"])
+
+    assert stats["deactivated"] == 3
+    inactive = sorted(doc["id"] for doc in collection.find({"active": False}))
+    assert inactive == ["6", "7", "9"]
+    # Left for the next sync when there is no Elasticsearch client
+    assert collection.count_documents({"active": False, "indexed": False}) == 3
+
+def test_scope_limits_deactivation(collection):
+    stats = reconcile_active_ads(collection, [str(n) for n in range(6)], scope={"source": "blocket"})
+    assert stats["deactivated"] == 2
+    assert collection.count_documents({"source": "other", "active": True}) == 2
+
+def test_partial_discovery_is_ignored(collection):
+    stats = reconcile_active_ads(collection, ["0", "1"])
+    assert stats["deactivated"] == 0
+    assert collection.count_documents({"active": False}) == 0
+
+def test_propagated_deactivations_are_marked_indexed(collection, monkeypatch):
+    sent = []
+    monkeypatch.setattr(reconcile, "_propagate_to_elasticsearch", lambda es, index_name, ad_ids: sent.extend(ad_ids) or 0)
+
+    stats = reconcile_active_ads(collection, [str(n) for n in range(9)], es=object())
+
+    assert (stats["deactivated"], stats["es_errors"]) == (1, 0)
+    assert sent == ["9"]
+    doc = collection.find_one({"id": "9"})
+    assert doc["indexed"] is True and doc["last_indexed"]
+
+def test_failed_propagation_leaves_ads_for_the_sync(collection, monkeypatch):
+    monkeypatch.setattr(reconcile, "_propagate_to_elasticsearch", lambda es, index_name, ad_ids: len(ad_ids))
+
+    stats = reconcile_active_ads(collection, [str(n) for n in range(9)], es=object())
+
+    assert stats["es_errors"] == 1
+    assert collection.find_one({"id": "9"})["indexed"] is False
@@ -0,0 +1,44 @@
+import pytest
+
+from records import CarAd, sample_ads
+
+def test_round_trips():
+    ad = CarAd.from_dict(sample_ads(1)[0])
+    for name in ("json", "bson", "msgpack"):
+        encoded = getattr(ad, f"to_{name}")()
+        assert getattr(CarAd, f"from_{name}")(encoded) == ad
+
+def test_to_dict_leaves_out_unset_fields():
+    data = sample_ads(1)[0]
+    assert CarAd.from_dict(data).to_dict() == data
+
+def test_from_dict_skips_mongo_id():
+    data = {**sample_ads(1)[0], "_id": "abc"}
+    assert "_id" not in CarAd.from_dict(data)
+
+def test_stored_documents_may_have_unknown_fields():
+    data = sample_ads(1)[0]
+    assert CarAd.from_dict({**data, "colour": "red"}, strict=False).to_dict() == data
+    with pytest.raises(ValueError, match="must be int"):
+        CarAd.from_dict({**data, "price": "400000"}, strict=False)
+
+@pytest.mark.parametrize("change, message", [
+    ({"colour": "red"}, "Unknown field"),
+    ({"price": "400000"}, "must be int"),
+    ({"url": None}, "Missing fields: url"),
+])
+def test_from_dict_validation(change, message):
+    with pytest.raises(ValueError, match=message):
+        CarAd.from_dict({**sample_ads(1)[0], **change})
+
+def test_dict_access():
+    ad = CarAd.from_dict(sample_ads(1)[0])
+    assert ad["price"] == ad.price
+    assert "variant" not in ad
+    assert ad.get("variant", "-") == "-"
+    ad["variant"] = "Carrera"
+    assert ad["variant"] == "Carrera"
+    with pytest.raises(KeyError):
+        ad["colour"] = "red"
+    with pytest.raises(TypeError):
+        ad["year"] = "2019"
@@ -0,0 +1,46 @@
+from schema import SCHEMA_VERSION, ad_id_from_url, compact_document, expand_document, migrate_collection
+
+AD = {
+    "url": "https://www.blocket.se/annons/porsche_911/1234",
+    "id": "1234",
+    "title": "Porsche 911",
+    "title_keyword": "Porsche 911",
+    "specifications": {"Fuel type": "Bensin", "Års-modell": "2019"},
+    "specs": {"fuel_type": "Bensin", "års_modell": "2019"},
+    "images": [{"id": "img1", "url": "https://img.blocket.se/1.jpg",
+                "filename": "img1.jpg", "local_path": "images/1234/img1.jpg"}],
+    "image_urls": ["https://img.blocket.se/1.jpg"],
+}
+
+def test_ad_id_from_url():
+    assert ad_id_from_url(AD["url"]) == "1234"
+    assert ad_id_from_url(AD["url"] + "/") == "1234"
+
+def test_compact_document_drops_derived_fields():
+    doc = compact_document(AD)
+    assert not {"title_keyword", "specs", "image_urls"} & set(doc)
+    assert doc["images"] == [{"id": "img1", "url": "https://img.blocket.se/1.jpg"}]
+    assert doc["schema_version"] == SCHEMA_VERSION
+
+def test_expand_document_recreates_derived_fields():
+    doc = expand_document(compact_document(AD))
+    for field in ("specs", "image_urls", "images"):
+        assert doc[field] == AD[field]
+
+def test_expand_document_uses_processed_variants():
+    doc = expand_document({"id": "1234", "images": [
+        {"id": "img1", "url": "https://img.blocket.se/1.jpg",
+         "variants": {"original": "store/ab/abcd.webp", "thumb": "store/ab/abcd_thumb.webp"}}
+    ]})
+    assert doc["images"][0]["local_path"] == "store/ab/abcd.webp"
+    assert doc["primary_thumbnail"] == "store/ab/abcd_thumb.webp"
+
+def test_migrate_collection(database):
+    collection = database["car_ads"]
+    collection.insert_many([dict(AD, url=f"{AD['url']}{n}", id=f"1234{n}") for n in range(5)])
+    collection.insert_one(compact_document(dict(AD, url="https://www.blocket.se/annons/porsche_911/99")))
+
+    assert migrate_collection(collection, batch_size=2) == {"migrated": 5, "batches": 3}
+    assert collection.count_documents({"schema_version": SCHEMA_VERSION}) == 6
+    assert collection.count_documents({"specs": {"$exists": True}}) == 0
+    assert migrate_collection(collection)["migrated"] == 0
@@ -0,0 +1,138 @@
+import mongomock
+import pytest
+
+import scraper
+from conftest import FakeSessions
+from frontier import get_frontier_collection, get_run_summary, PENDING, IN_PROGRESS, DONE, FAILED
+from records import CarAd
+from sessions import BlockedPageError, EmptyPageError, CAPTCHA
+
+URLS = [f"https://www.blocket.se/annons/porsche_911/{n}" for n in range(5)]
+
+class Crash(BaseException):
+    """Stands in for the process being killed in the middle of a run."""
+
+def scraped_ad(url):
+    ad_id = url.rsplit("/", 1)[1]
+    return CarAd(url=url, id=ad_id, scrape_date="2026-01-01T12:00:00", scrape_timestamp=1767268800,
+                 title=f"Porsche 911 Carrera {ad_id}", price=500000)
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    client = mongomock.MongoClient()
+    db = client["car_ads_test"]
+    monkeypatch.setattr(scraper, "get_mongodb_connection", lambda: (client, db, db["car_ads"]))
+    monkeypatch.setattr(scraper, "SessionPool", FakeSessions)
+    discoveries = []
+    monkeypatch.setattr(scraper, "discover_ad_urls", lambda driver: discoveries.append(1) or list(URLS))
+    return db, discoveries
+
+def test_run_saves_every_ad(pipeline, monkeypatch):
+    db, _ = pipeline
+    monkeypatch.setattr(scraper, "scrape_individual_ad", lambda driver, url, selector_stats: scraped_ad(url))
+
+    stats = scraper.scrape_with_checkpoints(checkpoint_every=2)
+
+    assert (stats["inserted"], stats["errors"]) == (5, 0)
+    assert get_run_summary(get_frontier_collection(db), stats["run_id"])[DONE] == 5
+    assert db["car_ads"].count_documents({}) == 5
+
+def test_resume_after_interruption(pipeline, monkeypatch):
+    db, discoveries = pipeline
+    frontier = get_frontier_collection(db)
+    scraped = []
+
+    def crash_on_fourth_ad(driver, url, selector_stats):
+        if len(scraped) == 3:
+            raise Crash()
+        scraped.append(url)
+        return scraped_ad(url)
+
+    monkeypatch.setattr(scraper, "scrape_individual_ad", crash_on_fourth_ad)
+    with pytest.raises(Crash):
+        scraper.scrape_with_checkpoints(checkpoint_every=2)
+
+    # The first checkpoint was written; the third ad was still waiting in
+    # its batch and the fourth was being scraped
+    run_id = frontier.find_one({})["run_id"]
+    assert get_run_summary(frontier, run_id) == {PENDING: 1, IN_PROGRESS: 2, DONE: 2, FAILED: 0}
+    assert db["car_ads"].count_documents({}) == 2
+
+    scraped.clear()
+    monkeypatch.setattr(scraper, "scrape_individual_ad", lambda driver, url, selector_stats: scraped.append(url) or scraped_ad(url))
+    stats = scraper.scrape_with_checkpoints(resume=True, checkpoint_every=2)
+
+    assert stats["resumed"] and stats["run_id"] == run_id
+    assert discoveries == [1]
+    assert sorted(scraped) == URLS[2:]
+    assert get_run_summary(frontier, run_id)[DONE] == 5
+    assert db["car_ads"].count_documents({}) == 5
+
+def test_resume_without_unfinished_run_starts_a_new_one(pipeline, monkeypatch):
+    db, discoveries = pipeline
+    monkeypatch.setattr(scraper, "scrape_individual_ad", lambda driver, url, selector_stats: scraped_ad(url))
+
+    scraper.scrape_with_checkpoints(checkpoint_every=2)
+    stats = scraper.scrape_with_checkpoints(resume=True, checkpoint_every=2)
+
+    assert not stats["resumed"]
+    assert discoveries == [1, 1]
+    assert stats["unchanged"] == 5
+
+def test_save_streams_in_bounded_batches(database):
+    produced = []
+    batches = []
+
+    def ads():
+        for url in URLS:
+            produced.append(url)
+            yield scraped_ad(url)
+
+    def on_batch(batch):
+        # Nothing is scraped ahead of the batch being written
+        assert len(produced) == len(batches) * 2 + len(batch)
+        batches.append([ad["url"] for ad in batch])
+
+    stats = scraper.save_to_mongo(ads(), collection=database["car_ads"], batch_size=2, on_batch=on_batch)
+
+    assert batches == [URLS[:2], URLS[2:4], URLS[4:]]
+    assert (stats["total_ads"], stats["inserted"]) == (5, 5)
+
+def test_empty_and_blocked_pages(pipeline, monkeypatch):
+    db, _ = pipeline
+    frontier = get_frontier_collection(db)
+
+    def scrape(driver, url, selector_stats):
+        if url == URLS[0]:
+            raise EmptyPageError(url)
+        if url == URLS[1]:
+            raise BlockedPageError(url, CAPTCHA)
+        return scraped_ad(url)
+
+    monkeypatch.setattr(scraper, "scrape_individual_ad", scrape)
+    stats = scraper.scrape_with_checkpoints(checkpoint_every=2)
+
+    assert (stats["inserted"], stats["empty_pages"], stats["failed_urls"]) == (3, 1, 1)
+    assert (stats["blocked_pages"], stats["requeued_urls"]) == (scraper.MAX_BLOCK_RETRIES, 1)
+    # A changed layout fails the URL at once; a blocked one is tried again
+    assert frontier.find_one({"url": URLS[0]})["state"] == FAILED
+    assert frontier.find_one({"url": URLS[1]})["state"] == PENDING
+
+def test_fields_taken_off_an_ad_are_cleared(pipeline, monkeypatch):
+    db, _ = pipeline
+    monkeypatch.setattr(scraper, "scrape_individual_ad", lambda driver, url, selector_stats: scraped_ad(url))
+    scraper.scrape_with_checkpoints(checkpoint_every=2)
+    db["car_ads"].update_one({"id": "0"}, {"$set": {"cluster_id": "0"}})
+
+    def without_price(driver, url, selector_stats):
+        ad = scraped_ad(url)
+        ad["price"] = None
+        return ad
+
+    monkeypatch.setattr(scraper, "scrape_individual_ad", without_price)
+    scraper.scrape_with_checkpoints(checkpoint_every=2)
+
+    doc = db["car_ads"].find_one({"id": "0"})
+    assert "price" not in doc
+    # Fields of later stages are kept
+    assert (doc["cluster_id"], doc["first_seen_timestamp"]) == ("0", 1767268800)
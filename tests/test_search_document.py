@@ -0,0 +1,25 @@
+from search_document import build_search_text, build_keywords
+
+AD = {
+    "title": "Porsche 911 Carrera",
+    "description": "Fin bil",
+    "price_text": "549 000 kr",
+    "location": "Stockholm",
+    "specifications": {"Bränsle": "Bensin", "Växellåda": "Automat"},
+    "tags": ["Bensin", "Servicebok"],
+    "seller": {"info": "Bilhandel i Stockholm"},
+    "make": "Porsche",
+    "model": "911",
+    "year": 2019,
+    "fuel_type": "Bensin",
+}
+
+def test_search_text_has_each_token_once():
+    assert build_search_text(AD) == "549 000 kr Stockholm Bränsle Bensin Växellåda Automat Servicebok Bilhandel i"
+
+def test_search_text_leaves_out_title_and_description():
+    assert build_search_text({"title": "Porsche", "description": "Fin bil"}) == ""
+
+def test_keywords_are_lowercase_and_unique():
+    assert build_keywords(AD) == ["porsche", "911", "2019", "bensin", "servicebok"]
+    assert build_keywords({}) == []
@@ -0,0 +1,63 @@
+import selector_stats
+from selector_stats import SelectorStats, FIELD_TOTAL, MAX_CONSECUTIVE_MISSES, DROP_WINDOW
+
+SELECTORS = ["h1.old-title", "h1[data-testid='title']", "//h1"]
+
+def extract(stats, field, selectors, winner):
+    with stats.field(field, selectors) as attempt:
+        for selector in attempt:
+            if selector == winner:
+                attempt.hit(selector)
+                break
+    stats.page_done()
+
+def test_winning_selector_is_tried_first():
+    stats = SelectorStats()
+    for _ in range(5):
+        extract(stats, "title", SELECTORS, SELECTORS[1])
+
+    assert stats.order("title", SELECTORS)[0] == SELECTORS[1]
+    assert stats.counters[("title", SELECTORS[1])]["hits"] == 5
+    # Once it leads, the selectors after it are not tried at all
+    assert stats.counters[("title", SELECTORS[2])]["misses"] == 0
+
+def test_selector_that_keeps_missing_is_skipped(monkeypatch):
+    monkeypatch.setattr(selector_stats, "RETRY_SKIPPED_EVERY", 0)
+    stats = SelectorStats()
+    for _ in range(MAX_CONSECUTIVE_MISSES):
+        extract(stats, "price", ["span.dead", "span.price"], None)
+
+    stats.counters[("price", "span.price")]["consecutive_misses"] = 0
+    assert stats.order("price", ["span.dead", "span.price"]) == ["span.price"]
+    assert stats.report()["skipped_selectors"] == {"price": ["span.dead"]}
+
+    # Skipped selectors get another chance now and then
+    monkeypatch.setattr(selector_stats, "RETRY_SKIPPED_EVERY", stats.pages)
+    assert "span.dead" in stats.order("price", ["span.dead", "span.price"])
+
+def test_a_field_is_never_given_up(monkeypatch):
+    monkeypatch.setattr(selector_stats, "RETRY_SKIPPED_EVERY", 0)
+    stats = SelectorStats()
+    for _ in range(MAX_CONSECUTIVE_MISSES):
+        extract(stats, "price", ["span.price"], None)
+    assert stats.order("price", ["span.price"]) == ["span.price"]
+
+def test_layout_change_is_reported():
+    stats = SelectorStats()
+    for _ in range(50):
+        extract(stats, "title", SELECTORS, SELECTORS[0])
+    for _ in range(DROP_WINDOW):
+        extract(stats, "title", SELECTORS, None)
+    assert stats.report()["dropped_fields"] == ["title"]
+
+def test_counters_carry_over_between_runs(database):
+    collection = database["selector_stats"]
+    stats = SelectorStats(collection)
+    for _ in range(3):
+        extract(stats, "title", SELECTORS, SELECTORS[2])
+    stats.flush()
+
+    loaded = SelectorStats(collection)
+    assert loaded.counters[("title", SELECTORS[2])]["hits"] == 3
+    assert loaded.counters[("title", FIELD_TOTAL)]["hits"] == 3
+    assert loaded.order("title", SELECTORS)[0] == SELECTORS[2]
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import similar
+from similar import SimilarIndex, find_similar
+
+MODELS = [("Porsche", "911"), ("Porsche", "Cayenne"), ("Volvo", "XC90"), ("Volvo", "V60"), ("BMW", "M3")]
+
+def random_ads(count, seed=1):
+    rng = np.random.default_rng(seed)
+    ads = []
+    for i in range(count):
+        make, model = MODELS[rng.integers(len(MODELS))]
+        ads.append({
+            "id": str(i), "make": make, "model": model, "year": int(rng.integers(1995, 2026)),
+            "price": int(rng.lognormal(13, 0.6)), "mileage": int(rng.integers(1000, 300000)),
+            "fuel_type": ["Bensin", "Diesel"][rng.integers(2)], "transmission": ["Automat", "Manuell"][rng.integers(2)],
+        })
+    return ads
+
+def brute_force(index, ad_id, k):
+    row = index.rows[ad_id]
+    rows = np.array([r for r in index.rows.values() if r != row])
+    distances = np.sqrt(((index.vectors[rows] - index.vectors[row]) ** 2).sum(axis=1))
+    return [index.ads[r]["id"] for r in rows[np.argsort(distances, kind="stable")][:k]]
+
+def test_tree_search_equals_brute_force():
+    index = SimilarIndex(random_ads(2000))
+
+    for ad_id in ["0", "17", "512", "1999"]:
+        found = index.similar(ad_id, 10, exact=True)
+        assert [ad["id"] for ad in found] == brute_force(index, ad_id, 10)
+        assert [ad["distance"] for ad in found] == sorted(ad["distance"] for ad in found)
+
+def test_same_model_comes_first_and_duplicates_are_left_out():
+    ads = [
+        {"id": "a", "make": "Porsche", "model": "911", "year": 2015, "price": 700000, "cluster_id": "c1"},
+        {"id": "b", "make": "Porsche", "model": "911", "year": 2015, "price": 700000, "cluster_id": "c1"},
+        {"id": "c", "make": "Porsche", "model": "911", "year": 2005, "price": 400000},
+        {"id": "d", "make": "Porsche", "model": "Cayenne", "year": 2015, "price": 700000},
+        {"id": "e", "make": "Volvo", "model": "XC90", "year": 2015, "price": 700000},
+    ]
+    index = SimilarIndex(ads)
+
+    assert [ad["id"] for ad in index.similar("a", 3)] == ["c", "d", "e"]
+
+def test_update_adds_and_removes_ads(monkeypatch):
+    monkeypatch.setattr(similar, "REBUILD_RATIO", 1.0)
+    ads = random_ads(50)
+    index = SimilarIndex(ads)
+    twin = dict(ads[0], id="new")
+
+    stats = index.update([twin, {"id": "1", "active": False}])
+
+    assert stats == {"added": 1, "removed": 1, "rebuilt": 0}
+    assert len(index) == 50
+    found = index.similar("0", 50)
+    assert found[0]["id"] == "new" and found[0]["distance"] == 0
+    assert "1" not in [ad["id"] for ad in found]
+
+def test_update_rebuilds_the_tree(monkeypatch):
+    monkeypatch.setattr(similar, "REBUILD_RATIO", 0.1)
+    index = SimilarIndex(random_ads(50))
+
+    stats = index.update(dict(ad, id=f"new-{ad['id']}") for ad in random_ads(10, seed=2))
+
+    assert stats["rebuilt"] == 1
+    assert (index.tree_size, len(index)) == (60, 60)
+
+def test_find_similar(database, monkeypatch):
+    monkeypatch.setattr(similar, "_index", None)
+    collection = database["car_ads"]
+    collection.insert_many([dict(ad, indexed=True, active=True, last_indexed="2026-01-01T00:00:00")
+                            for ad in random_ads(20)])
+
+    response = find_similar("3", 5, collection=collection)
+
+    assert response["success"] and len(response["results"]) == 5
+    with pytest.raises(ValueError):
+        find_similar("3", 0, collection=collection)
+    with pytest.raises(LookupError):
+        find_similar("missing", collection=collection)
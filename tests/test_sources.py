@@ -0,0 +1,48 @@
+import pytest
+
+from records import CarAd
+from sources import Source, BlocketSource, get_sources
+
+URL = "https://www.example.com/bil/porsche-911/1234"
+
+class ExampleSource(Source):
+    name = "example"
+    hosts = ["www.example.com"]
+
+    def discover(self, driver):
+        return [URL]
+
+    def fetch(self, driver, url):
+        return True
+
+    def extract(self, driver, url, selector_stats):
+        return CarAd(url=url, id="", scrape_date="2026-01-01T12:00:00", scrape_timestamp=1767268800,
+                     title="Porsche 911 Carrera 4S", price=900000)
+
+def test_get_sources():
+    assert [type(source) for source in get_sources("blocket")] == [BlocketSource]
+    with pytest.raises(ValueError, match="Unknown source 'bytbil'"):
+        get_sources("blocket, bytbil")
+
+def test_adapter_must_implement_every_step():
+    class Incomplete(Source):
+        name = "incomplete"
+
+        def discover(self, driver):
+            return []
+
+    with pytest.raises(TypeError, match="extract, fetch"):
+        Incomplete()
+
+def test_ads_get_ids_in_the_source_namespace():
+    ad = ExampleSource().scrape(None, URL)
+
+    assert (ad["id"], ad["source"]) == ("example:1234", "example")
+    assert ad["make"] == "Porsche"
+    assert ExampleSource().scope() == {"source": "example"}
+
+def test_blocket_keeps_bare_ids():
+    source = BlocketSource()
+
+    assert source.ad_id("https://www.blocket.se/annons/porsche_911/1234") == "1234"
+    assert source.scope() == {"source": {"$in": ["blocket", None]}}
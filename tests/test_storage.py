@@ -0,0 +1,62 @@
+import pytest
+
+from records import CarAd, sample_ads
+from storage import SQLiteStore
+
+def new_stats():
+    return {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0}
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "car_ads.db"))
+    yield store
+    store.close()
+
+def test_save_batch(store):
+    ads = [CarAd.from_dict(ad) for ad in sample_ads(3)]
+    stats = new_stats()
+    assert store.save_batch(ads, stats) == ads
+    assert stats == {"inserted": 3, "updated": 0, "unchanged": 0, "errors": 0}
+
+    stats = new_stats()
+    store.save_batch(ads, stats)
+    assert stats["unchanged"] == 3
+
+    ads[0]["price"] = 399000
+    stats = new_stats()
+    store.save_batch(ads, stats)
+    assert (stats["updated"], stats["unchanged"]) == (1, 2)
+    assert store.load_current_values(ads[:1])[ads[0]["url"]]["price"] == 399000
+
+def test_save_clears_fields_an_ad_lost(store):
+    ad = CarAd.from_dict(sample_ads(1)[0])
+    store.save_batch([ad], new_stats())
+
+    ad["price"] = None
+    stats = new_stats()
+    store.save_batch([ad], stats)
+
+    assert stats["updated"] == 1
+    stored = next(page for page in store.iter_documents())[0]
+    assert "price" not in stored
+    assert stored["first_seen_timestamp"] == ad["scrape_timestamp"]
+
+def test_duplicate_id_is_an_error(store):
+    first, second = (CarAd.from_dict(ad) for ad in sample_ads(2))
+    second["id"] = first["id"]
+    stats = new_stats()
+    assert store.save_batch([first, second], stats) == [first]
+    assert stats["errors"] == 1
+
+def test_mark_indexed(store):
+    store.save_batch([CarAd.from_dict(ad) for ad in sample_ads(3)], new_stats())
+    assert store.count_unindexed() == 3
+
+    for doc in store.iter_unindexed():
+        if doc["id"] != "100001":
+            store.mark_indexed(doc, "2026-01-01T12:00:00")
+    assert store.count_unindexed() == 1
+    assert [doc["id"] for doc in store.iter_unindexed()] == ["100001"]
+    indexed = next(page for page in store.iter_documents())[0]
+    assert indexed["indexed"] is True
+    assert indexed["last_indexed"] == "2026-01-01T12:00:00"
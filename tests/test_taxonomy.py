@@ -0,0 +1,8 @@
+from taxonomy import match_ad
+
+def test_title_without_make_is_recognized():
+    assert match_ad("911 Carrera 4S", {}) == {"make": "Porsche", "model": "911", "variant": "Carrera 4S"}
+
+def test_full_title():
+    result = match_ad("Porsche 911 Carrera 4S PDK", {})
+    assert (result["make"], result["model"]) == ("Porsche", "911")